@@ -216,6 +216,11 @@ class Case(Base):
         Index('idx_cedula_fecha_estado', 'cedula', 'fecha_inicio', 'estado'),
         Index('idx_estado_historico', 'estado', 'es_historico'),  # Índice para filtrar dashboard/reportes
         Index('idx_procesado', 'procesado'),  # Índice para encontrar casos no procesados rápidamente
+        Index('idx_cedula_num_incap', 'cedula', 'numero_incapacidad'),  # Match Kactus por número de incapacidad
+        # Detector de traslapos: recorrido ordenado por (cédula, fecha_inicio) solo de casos con ambas fechas
+        Index('idx_cases_cedula_fi_traslapo', 'cedula', 'fecha_inicio', 'id',
+              postgresql_where=text('fecha_inicio IS NOT NULL AND fecha_fin IS NOT NULL'),
+              sqlite_where=text('fecha_inicio IS NOT NULL AND fecha_fin IS NOT NULL')),
     )
 
 class CaseDocument(Base):
@@ -866,8 +871,16 @@ else:
         echo=False,
         pool_pre_ping=True,
         pool_recycle=3600,
-        pool_size=10,
-        max_overflow=20,
+        # Pool para ráfagas de dashboards del validador: 20 conexiones fijas + 10 extra
+        # (mismo tope de 30); si se agota, falla a los 5s en vez de encolar 30s
+        pool_size=20,
+        max_overflow=10,
+        pool_timeout=5,
+        # executemany de psycopg2: INSERT en VALUES multi-fila (1000 por sentencia) y
+        # UPDATE/DELETE vía execute_batch (500 por viaje) — bulk_*_mappings del sync
+        executemany_mode="values_plus_batch",
+        insertmanyvalues_page_size=1000,
+        executemany_batch_page_size=500,
         connect_args={
             "connect_timeout": 10,
             "options": "-c timezone=America/Bogota"
@@ -921,6 +934,12 @@ def init_db():
         # ✅ Migrar columnas de Browserbase en empresa_bot_config (seguro de re-ejecutar)
         migrar_columnas_browserbase()
 
+        # ✅ Índices usados por la sincronización Excel (seguro de re-ejecutar)
+        migrar_indices_sync()
+
+        # ✅ Índices trigram para búsquedas ILIKE '%texto%' (solo PostgreSQL, seguro de re-ejecutar)
+        migrar_indices_busqueda()
+
         # Verificar conexión
         db = SessionLocal()
         try:
@@ -1254,6 +1273,85 @@ def migrar_cola_radicacion():
         return False
 
 
+def migrar_indices_sync():
+    """
+    Asegura los índices que usa la sincronización Excel → BD en instalaciones
+    creadas antes de que existieran en los modelos.
+    Seguro de re-ejecutar (CREATE INDEX IF NOT EXISTS).
+    """
+    indices = [
+        # Búsqueda de empleado por cédula (sync instantánea / validador)
+        ("ix_employees_cedula", "CREATE INDEX IF NOT EXISTS ix_employees_cedula ON employees (cedula)"),
+        # Match de Cases_Kactus por (cédula, fecha_inicio) y por (cédula, numero_incapacidad)
+        ("idx_cedula_fecha_inicio", "CREATE INDEX IF NOT EXISTS idx_cedula_fecha_inicio ON cases (cedula, fecha_inicio)"),
+        ("idx_cedula_num_incap", "CREATE INDEX IF NOT EXISTS idx_cedula_num_incap ON cases (cedula, numero_incapacidad)"),
+        # Detector de traslapos (LAG por cédula ordenado por fecha_inicio), índice parcial
+        ("idx_cases_cedula_fi_traslapo",
+         "CREATE INDEX IF NOT EXISTS idx_cases_cedula_fi_traslapo ON cases (cedula, fecha_inicio, id) "
+         "WHERE fecha_inicio IS NOT NULL AND fecha_fin IS NOT NULL"),
+    ]
+    db = SessionLocal()
+    try:
+        print("🔄 Migrando índices de sincronización...")
+        for nombre, ddl in indices:
+            try:
+                db.execute(text(ddl))
+                db.commit()
+                print(f"   ✅ Índice '{nombre}' asegurado")
+            except Exception as e:
+                db.rollback()
+                print(f"   ⚠️  {nombre}: {e}")
+        print("✅ Migración índices de sincronización completada")
+        return True
+    except Exception as e:
+        print(f"❌ Error en migración de índices: {e}")
+        return False
+    finally:
+        db.close()
+
+
+def migrar_indices_busqueda():
+    """
+    Índices GIN trigram (pg_trgm) para las búsquedas ILIKE '%texto%' del validador
+    (serial, cédula y nombre): sin ellos cada búsqueda recorre la tabla completa.
+    Solo PostgreSQL. Requiere permiso para CREATE EXTENSION pg_trgm; si falta,
+    un DBA debe crearla una vez y la próxima ejecución crea los índices.
+    Seguro de re-ejecutar (IF NOT EXISTS).
+    """
+    if not database_url.startswith("postgresql"):
+        return True
+    indices = [
+        ("idx_cases_serial_trgm", "CREATE INDEX IF NOT EXISTS idx_cases_serial_trgm ON cases USING gin (serial gin_trgm_ops)"),
+        ("idx_cases_cedula_trgm", "CREATE INDEX IF NOT EXISTS idx_cases_cedula_trgm ON cases USING gin (cedula gin_trgm_ops)"),
+        ("idx_employees_nombre_trgm", "CREATE INDEX IF NOT EXISTS idx_employees_nombre_trgm ON employees USING gin (nombre gin_trgm_ops)"),
+    ]
+    db = SessionLocal()
+    try:
+        print("🔄 Migrando índices trigram de búsqueda...")
+        try:
+            db.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"   ⚠️  No se pudo crear la extensión pg_trgm (se omiten índices): {e}")
+            return False
+        for nombre, ddl in indices:
+            try:
+                db.execute(text(ddl))
+                db.commit()
+                print(f"   ✅ Índice '{nombre}' asegurado")
+            except Exception as e:
+                db.rollback()
+                print(f"   ⚠️  {nombre}: {e}")
+        print("✅ Migración índices de búsqueda completada")
+        return True
+    except Exception as e:
+        print(f"❌ Error en migración de índices de búsqueda: {e}")
+        return False
+    finally:
+        db.close()
+
+
 if __name__ == "__main__":
     print("=" * 60)
     print("HERRAMIENTAS DE VERIFICACIÓN Y MIGRACIÓN - database.py")
@@ -438,6 +438,32 @@ def get_authenticated_service():
         print(f"❌ Error creando servicio de Drive: {e}")
         raise
 
+# Credenciales reutilizadas para llamar la API REST de Drive sin googleapiclient
+_token_creds = None
+# Lock propio (no _creds_lock: _get_or_refresh_credentials ya lo toma adentro)
+_token_creds_lock = threading.Lock()
+
+
+def get_drive_access_token() -> str:
+    """
+    Access token vigente de Drive para peticiones HTTP directas (p. ej. descargas
+    alt=media por rangos en paralelo). Reutiliza las credenciales y solo las
+    renueva cuando expiran. Thread-safe: una sola renovación a la vez.
+    """
+    global _token_creds
+    creds = _token_creds
+    if creds is not None and creds.valid:
+        return creds.token
+    with _token_creds_lock:
+        # Otro hilo pudo renovar mientras se esperaba el lock
+        creds = _token_creds
+        if creds is None or not creds.valid:
+            creds = _get_or_refresh_credentials()
+            if not creds.valid:
+                creds.refresh(Request())
+            _token_creds = creds
+        return creds.token
+
 # ==================== FUNCIONES DE UTILIDAD ====================
 
 def create_folder_if_not_exists(service, folder_name, parent_folder_id='root'):
@@ -9,6 +9,9 @@ import os, uuid
 from pathlib import Path
 from datetime import datetime, date
 import calendar
+import logging
+import logging.handlers
+import queue
 from dotenv import load_dotenv
 
 # ✅ Cargar variables de entorno desde .env
@@ -337,9 +340,49 @@ scheduler_sync = None
 scheduler_recordatorios = None  # ✅ NUEVO
 scheduler_token = None
 
+# Logs por cola: los handlers de la raíz pasan a un hilo (QueueListener) y emitir un log
+# desde un endpoint async es solo un append, sin escribir a stderr en el event loop
+_log_listener = None
+_log_handlers_raiz = []
+
+
+def _iniciar_logs_en_cola():
+    """Pone los handlers de la raíz detrás de una cola (sin handlers: stderr con formato básico)."""
+    global _log_listener, _log_handlers_raiz
+    raiz = logging.getLogger()
+    _log_handlers_raiz = list(raiz.handlers)
+    handlers = _log_handlers_raiz
+    if not handlers:
+        salida = logging.StreamHandler()
+        salida.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(name)s: %(message)s"))
+        handlers = [salida]
+    cola = queue.Queue(-1)
+    _log_listener = logging.handlers.QueueListener(cola, *handlers, respect_handler_level=True)
+    for handler in _log_handlers_raiz:
+        raiz.removeHandler(handler)
+    raiz.addHandler(logging.handlers.QueueHandler(cola))
+    _log_listener.start()
+
+
+def _detener_logs_en_cola():
+    """Vacía la cola y devuelve a la raíz sus handlers originales."""
+    global _log_listener
+    if _log_listener is None:
+        return
+    _log_listener.stop()
+    raiz = logging.getLogger()
+    for handler in list(raiz.handlers):
+        if isinstance(handler, logging.handlers.QueueHandler):
+            raiz.removeHandler(handler)
+    for handler in _log_handlers_raiz:
+        raiz.addHandler(handler)
+    _log_listener = None
+
+
 @app.on_event("startup")
 def startup_event():
     global scheduler_sync, scheduler_recordatorios, scheduler_token
+    _iniciar_logs_en_cola()
     init_db()
     print("🚀 API iniciada")
 
@@ -622,7 +665,7 @@ def startup_event():
         print(f"⚠️ Error iniciando limpieza exportaciones: {e}")
 
 @app.on_event("shutdown")
-def shutdown_event():
+async def shutdown_event():
     global scheduler_sync, scheduler_recordatorios, scheduler_token
     
     # ⭐ AGREGAR - Detener scheduler tabla viva
@@ -643,6 +686,27 @@ def shutdown_event():
     if scheduler_token:
         scheduler_token.shutdown()
         print("🛑 Renovación de token detenida")
+    
+    # Pool de procesos de mejora de páginas PDF: solo si el módulo ya se cargó
+    # (no importar OpenCV/skimage durante el apagado solo para cerrarlo)
+    try:
+        import sys
+        pdf_editor = sys.modules.get("app.pdf_editor")
+        if pdf_editor:
+            pdf_editor.cerrar_pool_paginas()
+            print("🛑 Pool de páginas PDF detenido")
+    except Exception as e:
+        print(f"⚠️ Error cerrando pool de páginas PDF: {e}")
+    
+    # Cliente HTTP compartido de descargas de Drive (conexiones abiertas del pool de httpx)
+    try:
+        from app.validador import cerrar_cliente_drive_http
+        await cerrar_cliente_drive_http()
+        print("🛑 Cliente HTTP de Drive cerrado")
+    except Exception as e:
+        print(f"⚠️ Error cerrando cliente HTTP de Drive: {e}")
+    
+    _detener_logs_en_cola()
 
 # ==================== FACTORY RESET ====================
 
@@ -12,13 +12,17 @@ Bibliotecas usadas (todas gratuitas y enterprise-grade):
 
 import os
 import io
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 import numpy as np
 import cv2
 from PIL import Image, ImageDraw, ImageEnhance
 from pathlib import Path
 import fitz  # PyMuPDF
 from skimage import exposure, filters, restoration
-from typing import List, Tuple, Optional
+from typing import List, Tuple, Optional, Union
 
 
 class PDFEnhancer:
@@ -245,15 +249,92 @@ class PDFEnhancer:
         return image_array
 
 
+def _png_pagina_mejorada(page: fitz.Page, scale: float, enhancer: "PDFEnhancer") -> bytes:
+    """Render de alta resolución + mejora + deskew de una página, como PNG a 300 dpi"""
+    # Renderizar página a imagen de alta resolución
+    mat = fitz.Matrix(scale, scale)
+    pix = page.get_pixmap(matrix=mat)
+    
+    # Convertir a numpy array
+    img_array = np.frombuffer(
+        pix.samples, 
+        dtype=np.uint8
+    ).reshape(pix.height, pix.width, pix.n)
+    
+    # Mejorar calidad con algoritmos avanzados
+    enhanced = enhancer.enhance_image_quality(img_array, scale=1.0)
+    
+    # Auto-deskew (corregir inclinación)
+    enhanced = enhancer.auto_deskew(enhanced)
+    
+    # Convertir de vuelta a imagen PIL
+    enhanced_pil = Image.fromarray(enhanced)
+    
+    img_bytes = io.BytesIO()
+    enhanced_pil.save(img_bytes, format='PNG', optimize=True, dpi=(300, 300))
+    return img_bytes.getvalue()
+
+
+def _mejorar_pagina_proceso(pdf_bytes: bytes, page_num: int, scale: float) -> bytes:
+    """Trabajo de un proceso del pool: abre su propia copia del PDF y devuelve el PNG mejorado"""
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    try:
+        return _png_pagina_mejorada(doc[page_num], scale, PDFEnhancer())
+    finally:
+        doc.close()
+
+
+# Pool de procesos para mejorar varias páginas a la vez (CPU: MuPDF + OpenCV + PIL, fuera
+# del GIL y con el store de MuPDF aislado por proceso). Se crea al primer uso con "spawn":
+# un fork del servidor (threads de uvicorn, schedulers, locks tomados) puede colgar al hijo.
+_POOL_PAGINAS: Optional[ProcessPoolExecutor] = None
+_POOL_PAGINAS_LOCK = threading.Lock()
+
+
+def mejorar_paginas_en_paralelo(pdf_bytes: bytes, pages: List[int], scale: float = 2.5) -> List[bytes]:
+    """
+    PNG mejorado de cada página de `pages` (mismo orden), calculados en paralelo en
+    un pool de hasta 4 procesos. Aplicar con PDFEditor.aplicar_pagina_mejorada.
+    Cada PNG sale del PDF original: páginas repetidas NO se mejoran dos veces
+    (para eso, el camino secuencial con enhance_page_quality).
+    """
+    global _POOL_PAGINAS
+    with _POOL_PAGINAS_LOCK:
+        if _POOL_PAGINAS is None:
+            _POOL_PAGINAS = ProcessPoolExecutor(
+                max_workers=min(4, os.cpu_count() or 1),
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+    return list(_POOL_PAGINAS.map(
+        _mejorar_pagina_proceso, repeat(pdf_bytes), pages, repeat(scale)
+    ))
+
+
+def cerrar_pool_paginas():
+    """Apaga el pool de mejora de páginas (shutdown de la app); se recrea si se vuelve a usar."""
+    global _POOL_PAGINAS
+    with _POOL_PAGINAS_LOCK:
+        if _POOL_PAGINAS is not None:
+            _POOL_PAGINAS.shutdown(wait=False, cancel_futures=True)
+            _POOL_PAGINAS = None
+
+
+def _abrir_pdf(origen: Union[str, bytes]) -> fitz.Document:
+    """Abre un PDF desde ruta o desde bytes en memoria (sin pasar por disco)."""
+    if isinstance(origen, (bytes, bytearray)):
+        return fitz.open(stream=origen, filetype="pdf")
+    return fitz.open(origen)
+
+
 class PDFEditor:
     """
     📄 Editor completo de PDF con todas las funcionalidades profesionales
     """
     
-    def __init__(self, pdf_path: str):
-        """Inicializa el editor con un archivo PDF"""
-        self.pdf_path = pdf_path
-        self.doc = fitz.open(pdf_path)
+    def __init__(self, pdf: Union[str, bytes]):
+        """Inicializa el editor con un archivo PDF (ruta o bytes)"""
+        self.pdf_path = pdf if isinstance(pdf, str) else None
+        self.doc = _abrir_pdf(pdf)
         self.modifications: List[str] = []
         self.enhancer = PDFEnhancer()
     
@@ -279,36 +360,15 @@ class PDFEditor:
         if page_num < 0 or page_num >= len(self.doc):
             raise ValueError(f"Número de página inválido: {page_num}")
         
+        png = _png_pagina_mejorada(self.doc[page_num], scale, self.enhancer)
+        self.aplicar_pagina_mejorada(page_num, png, scale)
+    
+    def aplicar_pagina_mejorada(self, page_num: int, png: bytes, scale: float = 2.5):
+        """Reemplaza el contenido de la página con la imagen mejorada (PNG) ya calculada"""
         page = self.doc[page_num]
-        
-        # Renderizar página a imagen de alta resolución
-        mat = fitz.Matrix(scale, scale)
-        pix = page.get_pixmap(matrix=mat)
-        
-        # Convertir a numpy array
-        img_array = np.frombuffer(
-            pix.samples, 
-            dtype=np.uint8
-        ).reshape(pix.height, pix.width, pix.n)
-        
-        # Mejorar calidad con algoritmos avanzados
-        enhanced = self.enhancer.enhance_image_quality(img_array, scale=1.0)
-        
-        # Auto-deskew (corregir inclinación)
-        enhanced = self.enhancer.auto_deskew(enhanced)
-        
-        # Convertir de vuelta a imagen PIL
-        enhanced_pil = Image.fromarray(enhanced)
-        
-        # Crear nueva página con la imagen mejorada
-        img_bytes = io.BytesIO()
-        enhanced_pil.save(img_bytes, format='PNG', optimize=True, dpi=(300, 300))
-        img_bytes.seek(0)
-        
-        # Reemplazar contenido de la página
         rect = page.rect
         page.clean_contents()
-        page.insert_image(rect, stream=img_bytes.getvalue())
+        page.insert_image(rect, stream=png)
         
         self.modifications.append(f"Enhanced quality of page {page_num} (scale={scale})")
     
@@ -422,6 +482,8 @@ class PDFEditor:
         Aplica compresión y limpieza para optimizar tamaño
         """
         if output_path is None:
+            if self.pdf_path is None:
+                raise ValueError("PDF abierto desde bytes: indique output_path")
             output_path = self.pdf_path
         
         self.doc.save(
@@ -457,7 +519,7 @@ class PDFAttachmentManager:
     
     @staticmethod
     def create_highlight_image(
-        pdf_path: str, 
+        pdf_path: Union[str, bytes], 
         page_num: int, 
         coords: Tuple[float, float, float, float], 
         output_path: str
@@ -466,7 +528,7 @@ class PDFAttachmentManager:
         🖼️ Crea una imagen recortada y resaltada para adjuntar al email
         coords: (x1, y1, x2, y2) en coordenadas PDF
         """
-        doc = fitz.open(pdf_path)
+        doc = _abrir_pdf(pdf_path)
         
         try:
             page = doc[page_num]
@@ -501,7 +563,7 @@ class PDFAttachmentManager:
     
     @staticmethod
     def create_page_preview(
-        pdf_path: str, 
+        pdf_path: Union[str, bytes], 
         page_num: int, 
         output_path: str, 
         highlight_areas: Optional[List[Tuple]] = None
@@ -510,7 +572,7 @@ class PDFAttachmentManager:
         📄 Crea un preview de una página completa con áreas resaltadas
         highlight_areas: Lista de tuplas (x1, y1, x2, y2)
         """
-        doc = fitz.open(pdf_path)
+        doc = _abrir_pdf(pdf_path)
         
         try:
             page = doc[page_num]
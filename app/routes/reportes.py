@@ -22,7 +22,7 @@ from app.schemas.reporte import (
     RegenerarTablaResponse
 )
 from app.services.reporte_service import ReporteService
-from app.utils.excel_formatter import ExcelFormatter
+from app.utils.excel_formatter import crear_excel, crear_csv, crear_json
 from app.services.prorroga_detector import auto_detectar_prorroga_caso, analizar_historial_empleado
 from app.services.cie10_service import buscar_codigo, validar_dias
 from app.services.correlacion_analytics import (
@@ -184,17 +184,17 @@ async def exportar_avanzado(
         empresa_nombre = empresa.lower().replace(" ", "_") if empresa != "all" else "todas-empresas"
         
         if formato == "xlsx":
-            archivo = ExcelFormatter.crear_excel(df, titulo="Reporte Incapacidades")
+            archivo = crear_excel(df, titulo="Reporte Incapacidades")
             nombre = f"reporte_incapacidades_{empresa_nombre}_{fecha_export}.xlsx"
             media_type = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
         
         elif formato == "csv":
-            archivo = ExcelFormatter.crear_csv(df)
+            archivo = crear_csv(df)
             nombre = f"reporte_incapacidades_{empresa_nombre}_{fecha_export}.csv"
             media_type = "text/csv"
         
         elif formato == "json":
-            archivo = ExcelFormatter.crear_json(df)
+            archivo = crear_json(df)
             nombre = f"reporte_incapacidades_{empresa_nombre}_{fecha_export}.json"
             media_type = "application/json"
         
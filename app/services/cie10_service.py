@@ -41,6 +41,7 @@ import re
 from typing import Optional, List, Dict, Tuple
 from pathlib import Path
 from functools import lru_cache
+from types import MappingProxyType
 
 # ═══════════════════════════════════════════════════════════
 # CARGA DE DATOS (singleton, se carga una vez)
@@ -169,6 +170,7 @@ def recargar_datos():
     _umbrales_data = None
     _validaciones_data = None
     _dias_tipicos_data = None
+    _buscar_codigo_normalizado.cache_clear()
     _cargar_cie10()
     _cargar_correlaciones()
     _construir_indice_invertido()
@@ -207,14 +209,39 @@ def _normalizar_codigo(codigo: str) -> str:
 
 def buscar_codigo(codigo: str) -> Optional[dict]:
     """Busca un código CIE-10 y retorna su información completa con jerarquía"""
+    info = _buscar_codigo_normalizado(_normalizar_codigo(codigo))
+    # El memo es inmutable: basta un dict nuevo y copiar las dos piezas anidadas
+    # (lista y dict planos) para que el caller pueda modificar el resultado
+    resultado = {"codigo": info["codigo"], "codigo_original": codigo, **info}
+    resultado["dias_tipicos"] = list(info["dias_tipicos"])
+    if info["capitulo"] is not None:
+        resultado["capitulo"] = dict(info["capitulo"])
+    return resultado
+
+
+@lru_cache(maxsize=4096)
+def _buscar_codigo_normalizado(cod_norm: str) -> MappingProxyType:
+    """
+    Búsqueda memorizada por código normalizado.
+    Los diagnósticos se repiten mucho (reportes, sync Kactus): la 2ª consulta
+    del mismo código no vuelve a armar la jerarquía ni a ir a la base MinSalud.
+    Retorna una vista de solo lectura (dias_tipicos como tupla): el memo no se puede mutar.
+    """
+    info = _armar_info_codigo(cod_norm)
+    info["dias_tipicos"] = tuple(info["dias_tipicos"])
+    if info["capitulo"] is not None:
+        info["capitulo"] = MappingProxyType(info["capitulo"])
+    return MappingProxyType(info)
+
+
+def _armar_info_codigo(cod_norm: str) -> dict:
+    """Información completa de un código normalizado (base local → MinSalud → no encontrado)."""
     cie10 = _cargar_cie10()
-    cod_norm = _normalizar_codigo(codigo)
     info = cie10.get("codigos", {}).get(cod_norm)
     if info:
         capitulo = _identificar_capitulo(cod_norm)
         return {
             "codigo": cod_norm,
-            "codigo_original": codigo,
             "descripcion": info.get("desc", ""),
             "bloque": info.get("bloque", ""),
             "grupo": info.get("grupo", ""),
@@ -236,7 +263,6 @@ def buscar_codigo(codigo: str) -> Optional[dict]:
             capitulo = _identificar_capitulo(cod_norm)
             return {
                 "codigo": cod_norm,
-                "codigo_original": codigo,
                 "descripcion": oficial["titulo"],
                 "bloque": "",
                 "grupo": "",
@@ -257,7 +283,6 @@ def buscar_codigo(codigo: str) -> Optional[dict]:
     capitulo = _identificar_capitulo(cod_norm)
     return {
         "codigo": cod_norm,
-        "codigo_original": codigo,
         "descripcion": f"Código {cod_norm} no está en la base de datos detallada",
         "bloque": "",
         "grupo": "",
@@ -5,9 +5,16 @@ Sincronización AUTOMÁTICA Google Sheets → PostgreSQL
 """
 
 import os
+import io
+import csv
+import hashlib
+import tempfile
+import threading
+import time
 import pandas as pd
 import requests
 from datetime import datetime, timedelta
+from sqlalchemy import and_, case, event, func
 from app.database import SessionLocal, Employee, Company, Case, CorreoNotificacion
 from io import BytesIO
 
@@ -19,6 +26,50 @@ LOCAL_CACHE_PATH = "/tmp/base_empleados_cache.xlsx"
 # Se sobreescribe en sincronizar_excel_completo(sheet_id=...) para multi-empresa.
 _ACTIVE_SHEET_ID = GOOGLE_DRIVE_FILE_ID
 
+# Memo por proceso del xlsx abierto: (ruta, mtime, tamaño) → {"xls": pd.ExcelFile, "hojas": {pestaña: DataFrame}}
+# El libro se abre (unzip + shared strings) una sola vez y cada pestaña se parsea una sola vez,
+# también entre sincronizar_empleado_desde_excel y sincronizar_excel_completo.
+_PARSED_CACHE = {}
+_PARSED_CACHE_LOCK = threading.Lock()
+
+# Sync instantánea: un Excel descargado hace menos de N segundos se reutiliza
+TTL_DESCARGA_INSTANTANEA = 60
+_descargas_recientes = {}  # sheet_id → (time.monotonic() de la descarga, ruta)
+_DESCARGAS_LOCK = threading.Lock()
+
+# Motor de lectura xlsx: calamine (Rust) si está instalado, si no openpyxl
+try:
+    import python_calamine  # noqa: F401
+    EXCEL_ENGINE = "calamine"
+except ImportError:
+    EXCEL_ENGINE = "openpyxl"
+
+# Huella (blake2b) del Excel en el último sync exitoso por (sheet, pestaña empleados, pestaña kactus).
+# Si el archivo descargado es idéntico byte a byte, sincronizar_excel_completo no re-procesa nada.
+_huella_ultimo_sync = {}
+
+# Columnas opcionales de la pestaña de empleados: NaN → None una sola vez por DataFrame
+COLUMNAS_NULLABLES_EMPLEADO = [
+    "telefono", "cargo", "centro_costo", "tipo_contrato", "ciudad",
+    "eps", "jefe_nombre", "jefe_email", "jefe_cargo", "area_trabajo",
+]
+
+# Campos de un caso que Cases_Kactus puede sobrescribir
+CAMPOS_KACTUS_CASO = (
+    "numero_incapacidad", "codigo_cie10", "diagnostico",
+    "fecha_inicio", "fecha_fin", "fecha_inicio_kactus", "fecha_fin_kactus",
+    "dias_incapacidad",
+)
+
+# A partir de cuántas altas de empleados se usa COPY FROM STDIN (solo PostgreSQL)
+UMBRAL_COPY_EMPLEADOS = 500
+COLUMNAS_COPY_EMPLEADO = [
+    "cedula", "nombre", "correo", "telefono", "company_id", "eps",
+    "jefe_nombre", "jefe_email", "jefe_cargo", "area_trabajo",
+    "cargo", "centro_costo", "fecha_ingreso", "tipo_contrato", "ciudad",
+    "activo", "created_at", "updated_at",
+]
+
 # Configuración de limpieza automática
 DIAS_ANTIGUEDAD_LIMPIEZA = 15  # Eliminar filas procesadas hace más de 15 días
 COLUMNA_PROCESADO = "Procesado"  # Nombre de la columna de fecha de procesamiento
@@ -177,19 +228,7 @@ def _eliminar_filas_procesadas_kactus(filas: list):
         
         # Ordenar descendente para eliminar desde abajo (no afecta índices superiores)
         filas_ordenadas = sorted(set(filas), reverse=True)
-        
-        requests_delete = []
-        for fila in filas_ordenadas:
-            requests_delete.append({
-                'deleteDimension': {
-                    'range': {
-                        'sheetId': sheet_id,
-                        'dimension': 'ROWS',
-                        'startIndex': fila - 1,  # 0-indexed
-                        'endIndex': fila
-                    }
-                }
-            })
+        requests_delete = _requests_borrar_filas(sheet_id, filas_ordenadas)
         
         service.spreadsheets().batchUpdate(
             spreadsheetId=_ACTIVE_SHEET_ID,
@@ -349,18 +388,7 @@ def _limpiar_filas_antiguas_kactus(dias_antiguedad: int = None):
         filas_ordenadas = sorted(filas_a_eliminar, reverse=True)
         
         # Crear requests de eliminación
-        requests_delete = []
-        for fila in filas_ordenadas:
-            requests_delete.append({
-                'deleteDimension': {
-                    'range': {
-                        'sheetId': sheet_id,
-                        'dimension': 'ROWS',
-                        'startIndex': fila - 1,  # 0-indexed
-                        'endIndex': fila
-                    }
-                }
-            })
+        requests_delete = _requests_borrar_filas(sheet_id, filas_ordenadas)
         
         service.spreadsheets().batchUpdate(
             spreadsheetId=_ACTIVE_SHEET_ID,
@@ -375,6 +403,33 @@ def _limpiar_filas_antiguas_kactus(dias_antiguedad: int = None):
         return 0
 
 
+def _requests_borrar_filas(sheet_id: int, filas: list) -> list:
+    """
+    Requests deleteDimension para borrar filas (1-indexed), de abajo hacia arriba.
+    Filas consecutivas se agrupan en UN rango: vaciar una hoja procesada completa
+    es una sola operación estructural en vez de una por fila.
+    """
+    rangos = []  # [inicio, fin] 1-indexed inclusivos, del más bajo al más alto de la hoja
+    for fila in sorted(set(filas)):
+        if rangos and fila == rangos[-1][1] + 1:
+            rangos[-1][1] = fila
+        else:
+            rangos.append([fila, fila])
+    return [
+        {
+            'deleteDimension': {
+                'range': {
+                    'sheetId': sheet_id,
+                    'dimension': 'ROWS',
+                    'startIndex': inicio - 1,  # 0-indexed
+                    'endIndex': fin
+                }
+            }
+        }
+        for inicio, fin in reversed(rangos)
+    ]
+
+
 def _idx_to_col_letter(idx: int) -> str:
     """Convierte índice 0-based a letra de columna Excel (0=A, 1=B, 26=AA, etc.)"""
     result = ""
@@ -383,8 +438,243 @@ def _idx_to_col_letter(idx: int) -> str:
         idx = idx // 26 - 1
     return result
 
+def _normalizar_nulos_empleados(df):
+    """Convierte NaN → None en las columnas opcionales (vectorizado, evita pd.notna por celda)."""
+    for col in COLUMNAS_NULLABLES_EMPLEADO:
+        if col in df.columns:
+            df[col] = df[col].astype(object).where(df[col].notna(), None)
+    return df
+
+
+def _leer_hoja_excel(path: str, sheet_name=0):
+    """
+    Lee una pestaña del Excel reutilizando el parseo previo si el archivo no cambió.
+    Retorna una copia: los llamadores pueden modificar el DataFrame sin tocar el memo.
+    """
+    clave = (path, os.path.getmtime(path), os.path.getsize(path))
+    with _PARSED_CACHE_LOCK:
+        entrada = _PARSED_CACHE.get(clave)
+        if entrada is None:
+            _cerrar_libros_memorizados()  # Solo se conserva la última versión del archivo
+            entrada = _PARSED_CACHE[clave] = {
+                "xls": pd.ExcelFile(path, engine=EXCEL_ENGINE),
+                "hojas": {},
+            }
+        hojas = entrada["hojas"]
+        if sheet_name not in hojas:
+            hojas[sheet_name] = entrada["xls"].parse(sheet_name)
+        return hojas[sheet_name].copy()
+
+
+def _cerrar_libros_memorizados():
+    """Cierra los ExcelFile abiertos y vacía el memo (requiere _PARSED_CACHE_LOCK)."""
+    for entrada in _PARSED_CACHE.values():
+        try:
+            entrada["xls"].close()
+        except Exception:
+            pass
+    _PARSED_CACHE.clear()
+
+
+def _invalidar_cache_parseo():
+    """Descarta las pestañas memorizadas (llamar al escribir un Excel nuevo en disco)."""
+    with _PARSED_CACHE_LOCK:
+        _cerrar_libros_memorizados()
+
+
+def _descargar_excel_reciente(ttl: int = None, forzar: bool = False):
+    """
+    descargar_excel_desde_drive() con memo TTL por Sheet para la sync instantánea.
+    Varias cédulas seguidas (o simultáneas) comparten una descarga: el lock hace
+    que quien llega mientras otro descarga espere y reutilice ese archivo.
+    Solo se memorizan descargas frescas (no el cache anterior usado como fallback).
+    forzar=True ignora el memo. Retorna (ruta, desde_memo).
+    """
+    ttl = TTL_DESCARGA_INSTANTANEA if ttl is None else ttl
+    sheet_id = _ACTIVE_SHEET_ID
+    with _DESCARGAS_LOCK:
+        entrada = _descargas_recientes.get(sheet_id)
+        if not forzar and entrada and time.monotonic() - entrada[0] < ttl and os.path.exists(entrada[1]):
+            return entrada[1], True
+        ruta, fresca = _descargar_excel_con_estado()
+        if ruta and fresca:
+            _descargas_recientes[sheet_id] = (time.monotonic(), ruta)
+        else:
+            _descargas_recientes.pop(sheet_id, None)
+        return ruta, False
+
+
+def _ruta_cache_excel(sheet_id: str) -> str:
+    """Archivo de cache local por Sheet (el maestro conserva LOCAL_CACHE_PATH)."""
+    if sheet_id == GOOGLE_DRIVE_FILE_ID:
+        return LOCAL_CACHE_PATH
+    return f"/tmp/base_empleados_cache_{sheet_id}.xlsx"
+
+
+def _leer_etag(ruta_cache: str):
+    """
+    Marca de versión guardada junto al cache (ETag HTTP de la URL pública o
+    "drive:<modifiedTime>" de la Drive API), solo si el xlsx cacheado sigue en disco.
+    """
+    try:
+        if os.path.exists(ruta_cache):
+            with open(ruta_cache + ".etag", "r") as f:
+                return f.read().strip() or None
+    except OSError:
+        pass
+    return None
+
+
+def _publicar_excel_cache(ruta_tmp: str, ruta_cache: str, etag: str = None):
+    """
+    Reemplaza atómicamente el cache con el xlsx recién descargado en ruta_tmp,
+    guarda su ETag (si lo hay) e invalida el parseo memorizado.
+    """
+    os.replace(ruta_tmp, ruta_cache)
+    try:
+        if etag:
+            with open(ruta_cache + ".etag", "w") as f:
+                f.write(etag)
+        elif os.path.exists(ruta_cache + ".etag"):
+            os.remove(ruta_cache + ".etag")
+    except OSError:
+        pass
+    _invalidar_cache_parseo()
+
+
+def _huella_archivo(path: str):
+    """Hash blake2b del contenido del archivo (None si no se puede leer)."""
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+    except OSError:
+        return None
+
+
+def _solo_fecha(valor):
+    """datetime/Timestamp → date (las columnas DATE de PostgreSQL ya llegan como date)."""
+    return valor.date() if isinstance(valor, datetime) else valor
+
+
+def _limpiar_df_empleados(df):
+    """
+    Limpieza vectorizada de la pestaña de empleados (una pasada por columna, no por fila):
+      - cedula        → str del entero, None si vacía o no numérica
+      - empresa       → str sin espacios alrededor, None si vacía
+      - telefono      → str, None si vacío
+      - fecha_ingreso → Timestamp, None si vacía o inválida
+      - opcionales    → None en lugar de NaN
+    """
+    df = _normalizar_nulos_empleados(df)
+    if df.empty:
+        return df
+    if "cedula" in df.columns:
+        cedula_num = pd.to_numeric(df["cedula"], errors="coerce")
+        validas = cedula_num.notna()
+        cedulas = pd.Series(None, index=df.index, dtype=object)
+        cedulas[validas] = cedula_num[validas].astype("int64").astype(str)
+        df["cedula"] = cedulas
+    if "empresa" in df.columns:
+        df["empresa"] = df["empresa"].astype(str).str.strip().where(df["empresa"].notna(), None)
+    if "telefono" in df.columns:
+        df["telefono"] = df["telefono"].astype(str).where(df["telefono"].notna(), None)
+    if "fecha_ingreso" in df.columns:
+        fechas = pd.to_datetime(df["fecha_ingreso"], errors="coerce", format="mixed")
+        df["fecha_ingreso"] = fechas.astype(object).where(fechas.notna(), None)
+    return df
+
+
+def _copy_insertar_empleados(db, filas: list):
+    """
+    Inserta empleados con COPY FROM STDIN a una tabla temporal + INSERT ... ON CONFLICT.
+    Solo PostgreSQL. Corre dentro de la transacción de la sesión (no hace commit).
+    """
+    ahora = datetime.now()
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for fila in filas:
+        valores = dict(fila, created_at=ahora, updated_at=ahora)
+        writer.writerow([r"\N" if valores.get(c) is None else valores[c] for c in COLUMNAS_COPY_EMPLEADO])
+    buf.seek(0)
+
+    columnas = ", ".join(COLUMNAS_COPY_EMPLEADO)
+    actualizar = ", ".join(
+        f"{c} = EXCLUDED.{c}" for c in COLUMNAS_COPY_EMPLEADO if c not in ("cedula", "company_id", "created_at")
+    )
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.execute("DROP TABLE IF EXISTS emp_stage")
+        cursor.execute("CREATE TEMP TABLE emp_stage (LIKE employees INCLUDING DEFAULTS) ON COMMIT DROP")
+        cursor.copy_expert(f"COPY emp_stage ({columnas}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", buf)
+        cursor.execute(
+            f"INSERT INTO employees ({columnas}) SELECT {columnas} FROM emp_stage "
+            f"ON CONFLICT (company_id, cedula) DO UPDATE SET {actualizar}"
+        )
+    finally:
+        cursor.close()
+
+
+def _insertar_empleados(db, filas: list):
+    """
+    Altas del PASO 2 con UNA sola política de conflicto: ON CONFLICT (company_id, cedula)
+    DO UPDATE, tanto por COPY (lotes grandes en PostgreSQL) como por INSERT normal.
+    Corre dentro de la transacción de la sesión (no hace commit).
+    """
+    dialecto = db.get_bind().dialect.name
+    if dialecto == "postgresql":
+        if len(filas) >= UMBRAL_COPY_EMPLEADOS:
+            # Carga masiva (sheet nuevo / full refresh): COPY evita el parse/plan por fila
+            _copy_insertar_empleados(db, filas)
+            return
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialecto == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        db.bulk_insert_mappings(Employee, filas)
+        return
+
+    ahora = datetime.now()
+    stmt = insert(Employee)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["company_id", "cedula"],
+        set_={
+            c: stmt.excluded[c]
+            for c in COLUMNAS_COPY_EMPLEADO if c not in ("cedula", "company_id", "created_at")
+        },
+    )
+    db.execute(stmt, [dict(fila, created_at=ahora, updated_at=ahora) for fila in filas])
+
+
+def _commit_asincrono(session, transaction, connection):
+    """after_begin del sync completo: synchronous_commit=off solo para la transacción en curso."""
+    connection.exec_driver_sql("SET LOCAL synchronous_commit = off")
+
+
 def descargar_excel_desde_drive():
     """Descarga el Excel desde Google Sheets usando autenticación"""
+    return _descargar_excel_con_estado()[0]
+
+
+def _descargar_excel_con_estado():
+    """
+    Como descargar_excel_desde_drive() pero retorna (ruta, fresca):
+    fresca=False cuando la descarga falló y se usa el cache anterior.
+    """
+    ruta_cache = _ruta_cache_excel(_ACTIVE_SHEET_ID)
+    # Descarga en curso en un archivo temporal único (syncs simultáneos no se pisan) en el
+    # mismo directorio que el cache, para que os.replace sea atómico; nunca se parsea a medio escribir
+    fd, ruta_tmp = tempfile.mkstemp(suffix=".part", dir=os.path.dirname(ruta_cache) or ".")
+    os.close(fd)
+    try:
+        return _descargar_excel(ruta_cache, ruta_tmp)
+    finally:
+        # Si se publicó, os.replace ya lo movió; si falló, no queda basura en /tmp
+        if os.path.exists(ruta_tmp):
+            os.remove(ruta_tmp)
+
+
+def _descargar_excel(ruta_cache: str, ruta_tmp: str):
+    """Cuerpo de _descargar_excel_con_estado(): baja el xlsx a ruta_tmp y lo publica en ruta_cache."""
     try:
         print(f"📥 Descargando Excel desde Google Sheets (autenticado)...")
         
@@ -398,7 +688,23 @@ def descargar_excel_desde_drive():
         # PASO 2: Descargar el archivo usando Drive API
         try:
             from googleapiclient.http import MediaIoBaseDownload
-            from io import BytesIO
+            
+            # Descarga condicional: un Sheet nativo no tiene md5Checksum, pero su modifiedTime
+            # cambia con cada edición. Si coincide con el del cache local, no se exporta de nuevo.
+            marca_drive = None
+            try:
+                meta = drive_service.files().get(
+                    fileId=_ACTIVE_SHEET_ID,
+                    fields="modifiedTime",
+                    supportsAllDrives=True,
+                ).execute()
+                if meta.get("modifiedTime"):
+                    marca_drive = f"drive:{meta['modifiedTime']}"
+            except Exception as meta_err:
+                print(f"   ⚠️ No se pudo leer modifiedTime ({str(meta_err)[:100]}), descargando completo")
+            if marca_drive and _leer_etag(ruta_cache) == marca_drive:
+                print("✅ Excel sin cambios (modifiedTime de Drive) — usando cache local")
+                return ruta_cache, True
             
             # Usar Drive API para exportar el archivo como XLSX (autenticado)
             export_request = drive_service.files().export(
@@ -406,22 +712,18 @@ def descargar_excel_desde_drive():
                 mimeType='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
             )
             
-            # Descargar contenido
-            fh = BytesIO()
-            downloader = MediaIoBaseDownload(fh, export_request)
-            done = False
-            while not done:
-                status, done = downloader.next_chunk()
+            # Descargar por chunks directo a disco (sin acumular el xlsx completo en RAM)
+            with open(ruta_tmp, 'wb') as fh:
+                downloader = MediaIoBaseDownload(fh, export_request)
+                done = False
+                while not done:
+                    status, done = downloader.next_chunk()
             
-            # Guardar en cache local
-            fh.seek(0)
-            content = fh.read()
+            # Publicar en cache local (con la marca de versión para la próxima descarga condicional)
+            _publicar_excel_cache(ruta_tmp, ruta_cache, marca_drive)
             
-            with open(LOCAL_CACHE_PATH, 'wb') as f:
-                f.write(content)
-            
-            print(f"✅ Excel descargado autenticado vía Drive API ({len(content)} bytes)")
-            return LOCAL_CACHE_PATH
+            print(f"✅ Excel descargado autenticado vía Drive API ({os.path.getsize(ruta_cache)} bytes)")
+            return ruta_cache, True
             
         except Exception as drive_err:
             print(f"   ⚠️ Drive API falló ({drive_err}), intentando con URL pública...")
@@ -431,29 +733,49 @@ def descargar_excel_desde_drive():
         try:
             # FALLBACK 1: Intentar URL pública
             print(f"   ⚠️ Intentando URL pública...")
-            response = requests.get(
+            # Descarga condicional: si el Sheet no cambió, Google responde 304 sin cuerpo
+            headers = {}
+            etag_previo = _leer_etag(ruta_cache)
+            if etag_previo and not etag_previo.startswith("drive:"):  # marca del camino Drive API, no un ETag HTTP
+                headers["If-None-Match"] = etag_previo
+            with requests.get(
                 f"https://docs.google.com/spreadsheets/d/{_ACTIVE_SHEET_ID}/export?format=xlsx",
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                with open(LOCAL_CACHE_PATH, 'wb') as f:
-                    f.write(response.content)
-                print(f"✅ Excel descargado vía URL pública ({len(response.content)} bytes)")
-                return LOCAL_CACHE_PATH
-            else:
-                raise Exception(f"URL pública retornó HTTP {response.status_code}")
+                timeout=30,
+                headers=headers,
+                stream=True,
+            ) as response:
+                if response.status_code == 304:
+                    print("✅ Excel sin cambios (HTTP 304) — usando cache local")
+                    return ruta_cache, True
+                if response.status_code != 200:
+                    raise Exception(f"URL pública retornó HTTP {response.status_code}")
+                
+                # Escribir a disco por chunks de 64KB mientras llega la respuesta
+                bytes_escritos = 0
+                with open(ruta_tmp, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=65536):
+                        f.write(chunk)
+                        bytes_escritos += len(chunk)
+                
+                # Content-Length es del cuerpo sin decodificar: solo comparable sin Content-Encoding
+                esperado = response.headers.get("Content-Length")
+                if esperado and not response.headers.get("Content-Encoding") and int(esperado) != bytes_escritos:
+                    raise Exception(f"descarga incompleta ({bytes_escritos}/{esperado} bytes)")
+                
+                _publicar_excel_cache(ruta_tmp, ruta_cache, response.headers.get("ETag"))
+                print(f"✅ Excel descargado vía URL pública ({bytes_escritos} bytes)")
+                return ruta_cache, True
         
         except Exception as url_err:
             print(f"   ⚠️ URL pública también falló ({url_err})")
             
             # FALLBACK 2: Usar cache anterior
-            if os.path.exists(LOCAL_CACHE_PATH):
+            if os.path.exists(ruta_cache):
                 print(f"   ⚠️ Usando cache anterior")
-                return LOCAL_CACHE_PATH
+                return ruta_cache, False
             
             print(f"❌ Error descargando Excel (sin cache disponible): {e}")
-            return None
+            return None, False
 
 
 def sincronizar_empleado_desde_excel(cedula: str, company_id: int = None):
@@ -464,7 +786,9 @@ def sincronizar_empleado_desde_excel(cedula: str, company_id: int = None):
       - Lee el Sheet PROPIO de esa empresa si lo tiene (no el maestro)
     """
     global _ACTIVE_SHEET_ID
-    db = SessionLocal()
+    # expire_on_commit=False: el id y los datos insertados siguen disponibles tras el commit
+    # sin un SELECT extra, y el objeto retornado es legible ya cerrada la sesión.
+    db = SessionLocal(expire_on_commit=False)
     sheet_id_previo = _ACTIVE_SHEET_ID
     try:
         q = db.query(Employee).filter(Employee.cedula == cedula)
@@ -488,12 +812,12 @@ def sincronizar_empleado_desde_excel(cedula: str, company_id: int = None):
                 print(f"📄 Sync instantánea desde el Sheet propio de company_id={company_id}")
             company_slug_owner = db.query(Company).filter(Company.id == company_id).first()
 
-        excel_path = descargar_excel_desde_drive()
+        excel_path, desde_memo = _descargar_excel_reciente()
         if not excel_path:
             print(f"❌ No se pudo descargar el Excel")
             return None
 
-        df = pd.read_excel(excel_path, sheet_name=0)
+        df = _leer_hoja_excel(excel_path, 0)
         try:
             cedula_int = int(cedula)
         except ValueError:
@@ -501,11 +825,17 @@ def sincronizar_empleado_desde_excel(cedula: str, company_id: int = None):
             return None
 
         empleado_excel = df[df["cedula"] == cedula_int]
+        if empleado_excel.empty and desde_memo:
+            # El memo puede ser anterior al alta de esta cédula en el Sheet → descarga fresca
+            excel_path, _ = _descargar_excel_reciente(forzar=True)
+            if excel_path:
+                df = _leer_hoja_excel(excel_path, 0)
+                empleado_excel = df[df["cedula"] == cedula_int]
         if empleado_excel.empty:
             print(f"❌ Empleado {cedula} no encontrado en Excel")
             return None
 
-        row = empleado_excel.iloc[0]
+        row = _normalizar_nulos_empleados(empleado_excel.copy()).iloc[0]
         # Empresa: la columna del sheet, o la dueña del sheet si viene vacía
         empresa_nombre = str(row["empresa"]).strip() if ("empresa" in df.columns and pd.notna(row.get("empresa"))) else None
         if not empresa_nombre and company_slug_owner:
@@ -521,38 +851,39 @@ def sincronizar_empleado_desde_excel(cedula: str, company_id: int = None):
             from app.database import asignar_slug
             asignar_slug(db, company)
             db.commit()
-            db.refresh(company)
-
-        # Con la cédula única POR EMPRESA, verificar solo dentro de esta empresa
-        ya_en_empresa = db.query(Employee).filter(
-            Employee.cedula == cedula, Employee.company_id == company.id
-        ).first()
-        if ya_en_empresa:
-            ya_en_empresa.activo = True
-            db.commit()
-            return ya_en_empresa
+
+        # Con la cédula única POR EMPRESA, verificar solo dentro de esta empresa.
+        # La consulta inicial ya descartó (cédula, company_id) — o la cédula en cualquier
+        # empresa si no vino company_id —, así que solo hace falta si la empresa del Excel es otra.
+        if company_id and company.id != company_id:
+            ya_en_empresa = db.query(Employee).filter(
+                Employee.cedula == cedula, Employee.company_id == company.id
+            ).first()
+            if ya_en_empresa:
+                ya_en_empresa.activo = True
+                db.commit()
+                return ya_en_empresa
 
         nuevo_empleado = Employee(
             cedula=str(row["cedula"]),
             nombre=row["nombre"],
             correo=row["correo"],
-            telefono=str(row.get("telefono", "")) if pd.notna(row.get("telefono")) else None,
+            telefono=str(row["telefono"]) if row.get("telefono") is not None else None,
             company_id=company.id,
-            eps=row.get("eps", None),
-            jefe_nombre=row.get("jefe_nombre", None),
-            jefe_email=row.get("jefe_email", None),
-            jefe_cargo=row.get("jefe_cargo", None),
-            area_trabajo=row.get("area_trabajo", None),
-            cargo=row.get("cargo", None) if pd.notna(row.get("cargo", None)) else None,
-            centro_costo=row.get("centro_costo", None) if pd.notna(row.get("centro_costo", None)) else None,
+            eps=row.get("eps"),
+            jefe_nombre=row.get("jefe_nombre"),
+            jefe_email=row.get("jefe_email"),
+            jefe_cargo=row.get("jefe_cargo"),
+            area_trabajo=row.get("area_trabajo"),
+            cargo=row.get("cargo"),
+            centro_costo=row.get("centro_costo"),
             fecha_ingreso=pd.to_datetime(row.get("fecha_ingreso")) if pd.notna(row.get("fecha_ingreso", None)) else None,
-            tipo_contrato=row.get("tipo_contrato", None) if pd.notna(row.get("tipo_contrato", None)) else None,
-            ciudad=row.get("ciudad", None) if pd.notna(row.get("ciudad", None)) else None,
+            tipo_contrato=row.get("tipo_contrato"),
+            ciudad=row.get("ciudad"),
             activo=True
         )
         db.add(nuevo_empleado)
         db.commit()
-        db.refresh(nuevo_empleado)
         print(f"✅ Empleado {cedula} sincronizado: {nuevo_empleado.nombre}")
         return nuevo_empleado
     except Exception as e:
@@ -591,7 +922,12 @@ def sincronizar_excel_completo(
     """
     global _ACTIVE_SHEET_ID
     _ACTIVE_SHEET_ID = sheet_id if sheet_id else GOOGLE_DRIVE_FILE_ID
-    db = SessionLocal()
+    # expire_on_commit=False: tras cada commit no se re-SELECCIONAN las empresas/empleados ya cargados
+    db = SessionLocal(expire_on_commit=False)
+    if db.get_bind().dialect.name == "postgresql":
+        # El sync es re-ejecutable desde el Excel: sus commits no esperan el fsync del WAL.
+        # SET LOCAL en cada transacción de ESTA sesión → no se filtra a las conexiones del pool.
+        event.listen(db, "after_begin", _commit_asincrono)
     try:
         print(f"\n{'='*60}")
         print(f"🔄 SYNC EXACTO Excel → PostgreSQL - {datetime.now().strftime('%H:%M:%S')}")
@@ -602,6 +938,13 @@ def sincronizar_excel_completo(
             print(f"❌ No se pudo descargar el Excel, sync cancelado\n")
             return
         
+        # Excel idéntico al del último sync exitoso de estas pestañas → nada que re-procesar
+        clave_sync = (_ACTIVE_SHEET_ID, empleados_sheet, kactus_sheet)
+        huella = _huella_archivo(excel_path)
+        if huella and _huella_ultimo_sync.get(clave_sync) == huella:
+            print("⏭️  Excel sin cambios desde el último sync — omitido\n")
+            return
+        
         # ========== PASO 1: LIMPIEZA EMPRESAS DUPLICADAS ==========
         # Limpiar nombres con \n, espacios extra, y merge duplicados
         print(f"📊 PASO 1: Limpieza de empresas duplicadas...")
@@ -658,15 +1001,27 @@ def sincronizar_excel_completo(
         # - No depende de la posición, es robusto ante inserciones/eliminaciones
         print(f"📊 PASO 2: Sincronizando empleados (POR CÉDULA)...")
         
+        # La huella solo se guarda si PASO 2 y PASO 3 quedaron en BD; si no, el próximo sync reintenta
+        paso2_ok = paso3_ok = True
         skip_retire = False
         try:
-            df = pd.read_excel(excel_path, sheet_name=empleados_sheet)
+            df = _limpiar_df_empleados(_leer_hoja_excel(excel_path, empleados_sheet))
             print(f"   📋 Excel tiene {len(df)} filas en pestaña '{empleados_sheet}'")
+            if {"cedula", "nombre"} <= set(df.columns):
+                # Filas sin cédula o sin nombre fuera de una vez (el índice conserva la fila del Excel)
+                df = df.dropna(subset=["cedula", "nombre"])
+            else:
+                print(f"   ⚠️ Pestaña '{empleados_sheet}' sin columnas cedula/nombre — sync de empleados omitido")
+                df = pd.DataFrame()
+                skip_retire = True
         except ValueError:
             print(f"   ⚠️ Pestaña '{empleados_sheet}' no encontrada — sync de empleados omitido")
             df = pd.DataFrame()
             skip_retire = True
 
+        # Todas las empresas en un dict por nombre: una sola consulta en vez de un SELECT por fila
+        empresas_por_nombre = {c.nombre: c for c in db.query(Company).all()}
+
         # Obtener empleados activos SOLO del alcance de este sheet (aislamiento multi-tenant):
         #  - Sheet propio → empresas nombradas en la pestaña + la empresa dueña del sheet.
         #    Nunca todos: un sheet de tenant vacío NO debe retirar empleados de otras empresas.
@@ -676,11 +1031,9 @@ def sincronizar_excel_completo(
             if df is not None and not df.empty and "empresa" in df.columns:
                 empresas_en_tab = set(df["empresa"].dropna().str.strip().unique())
 
-            company_ids_tab = []
-            if empresas_en_tab:
-                company_ids_tab = [
-                    c.id for c in db.query(Company).filter(Company.nombre.in_(empresas_en_tab)).all()
-                ]
+            company_ids_tab = [
+                empresas_por_nombre[n].id for n in empresas_en_tab if n in empresas_por_nombre
+            ]
             if company_id and company_id not in company_ids_tab:
                 company_ids_tab.append(company_id)
 
@@ -710,132 +1063,171 @@ def sincronizar_excel_completo(
         empleados_por_clave = {(e.cedula, e.company_id): e for e in empleados_bd}
         print(f"   📋 BD tiene {len(empleados_por_clave)} empleados activos (en el alcance de este sheet)")
 
-        nuevos = actualizados = reactivados = 0
+        # Empleados existentes fuera de empleados_por_clave cuyas cédulas aparecen en el Excel,
+        # en una sola consulta indexada por (cédula, empresa) en vez de un SELECT por fila:
+        #  - inactivos → posibles reingresos (se reactivan)
+        #  - activos fuera del alcance (p. ej. empresa con Sheet propio listada en el maestro)
+        #    → no se tocan; insertarlos violaría uq_employee_company_cedula y revertiría el lote
+        inactivos_por_clave = {}
+        claves_fuera_alcance = set()
+        if not df.empty and "cedula" in df.columns:
+            cedulas_excel = set(df["cedula"].dropna())
+            if cedulas_excel:
+                for e in db.query(Employee).filter(Employee.cedula.in_(cedulas_excel)).all():
+                    clave_bd = (e.cedula, e.company_id)
+                    if clave_bd in empleados_por_clave:
+                        continue
+                    if e.activo:
+                        claves_fuera_alcance.add(clave_bd)
+                    else:
+                        inactivos_por_clave[clave_bd] = e
+
+        # Crear de una vez las empresas del Excel que aún no existen en BD
+        if not df.empty and "empresa" in df.columns:
+            nombres_excel = set(df["empresa"].dropna().unique())
+            faltantes = sorted(nombres_excel - empresas_por_nombre.keys())
+            if faltantes:
+                try:
+                    # SAVEPOINT: si falla la creación no se pierde el resto de la transacción
+                    with db.begin_nested():
+                        from app.database import asignar_slug
+                        nuevas = [Company(nombre=n, activa=True) for n in faltantes]
+                        db.add_all(nuevas)
+                        db.flush()
+                        for company in nuevas:
+                            asignar_slug(db, company)
+                    empresas_por_nombre.update({c.nombre: c for c in nuevas})
+                    print(f"   🏢 {len(nuevas)} empresas nuevas creadas desde el Excel")
+                except Exception as e:
+                    print(f"   ❌ Error creando empresas nuevas: {e}")
+
+        nuevos = actualizados = reactivados = sin_cambios = 0
         claves_en_excel = set()
+        # Cambios acumulados como mappings → un bulk UPDATE + un bulk INSERT al final del PASO 2
+        updates_por_id = {}
+        inserts_por_clave = {}
+        ahora = datetime.now()
 
         # ✅ SINCRONIZACIÓN POR CÉDULA (sin-op si df vacío por pestaña inexistente)
-        for idx, row in df.iterrows():
+        # Columnas ya limpias (_limpiar_df_empleados) y filas inválidas ya descartadas:
+        # el loop solo lee valores
+        for idx, row in zip(df.index, df.to_dict(orient="records")):
             try:
-                if pd.isna(row.get("cedula")) or pd.isna(row.get("nombre")):
-                    continue
-                
                 # Datos del Excel
-                cedula = str(int(row["cedula"]))
+                cedula = row["cedula"]
 
                 nombre = row["nombre"]
                 correo = row.get("correo", "")
-                telefono = str(row.get("telefono", "")) if pd.notna(row.get("telefono")) else None
-                eps = row.get("eps", None)
-                empresa_nombre = str(row["empresa"]).strip()
+                telefono = row.get("telefono")
+                eps = row.get("eps")
+                empresa_nombre = row["empresa"]
                 
-                jefe_nombre = row.get("jefe_nombre", None)
-                jefe_email = row.get("jefe_email", None)
-                jefe_cargo = row.get("jefe_cargo", None)
-                area_trabajo = row.get("area_trabajo", None)
+                jefe_nombre = row.get("jefe_nombre")
+                jefe_email = row.get("jefe_email")
+                jefe_cargo = row.get("jefe_cargo")
+                area_trabajo = row.get("area_trabajo")
                 
                 # ✅ COLUMNAS KACTUS
-                cargo = row.get("cargo", None) if pd.notna(row.get("cargo", None)) else None
-                centro_costo = row.get("centro_costo", None) if pd.notna(row.get("centro_costo", None)) else None
-                fecha_ingreso_raw = row.get("fecha_ingreso", None)
-                fecha_ingreso = None
-                if pd.notna(fecha_ingreso_raw):
-                    try:
-                        fecha_ingreso = pd.to_datetime(fecha_ingreso_raw)
-                    except Exception:
-                        fecha_ingreso = None
-                tipo_contrato = row.get("tipo_contrato", None) if pd.notna(row.get("tipo_contrato", None)) else None
-                ciudad = row.get("ciudad", None) if pd.notna(row.get("ciudad", None)) else None
+                cargo = row.get("cargo")
+                centro_costo = row.get("centro_costo")
+                fecha_ingreso = row.get("fecha_ingreso")
+                tipo_contrato = row.get("tipo_contrato")
+                ciudad = row.get("ciudad")
                 
-                # Buscar o crear empresa (strip para evitar duplicados)
-                company = db.query(Company).filter(Company.nombre == empresa_nombre).first()
-                if not company:
-                    company = Company(nombre=empresa_nombre, activa=True)
-                    db.add(company)
-                    db.flush()
-                    from app.database import asignar_slug
-                    asignar_slug(db, company)
-                    db.commit()
-                    db.refresh(company)
+                # Empresa ya precargada/creada antes del loop (strip para evitar duplicados)
+                company = empresas_por_nombre.get(empresa_nombre)
+                if company is None:
+                    raise ValueError(f"empresa '{empresa_nombre}' no existe y no se pudo crear")
                 
-                claves_en_excel.add((cedula, company.id))
+                clave = (cedula, company.id)
+                claves_en_excel.add(clave)
+
+                datos = {
+                    "nombre": nombre,
+                    "correo": correo,
+                    "telefono": telefono,
+                    "company_id": company.id,
+                    "eps": eps,
+                    "jefe_nombre": jefe_nombre,
+                    "jefe_email": jefe_email,
+                    "jefe_cargo": jefe_cargo,
+                    "area_trabajo": area_trabajo,
+                    "cargo": cargo,
+                    "centro_costo": centro_costo,
+                    "fecha_ingreso": fecha_ingreso,
+                    "tipo_contrato": tipo_contrato,
+                    "ciudad": ciudad,
+                    "activo": True,
+                }
 
                 # ✅ LÓGICA CLAVE: Buscar empleado POR (CÉDULA, EMPRESA) — aislamiento total
-                empleado = empleados_por_clave.get((cedula, company.id))
+                empleado = empleados_por_clave.get(clave)
 
                 # También buscar inactivos DE ESTA EMPRESA por si fue retirado antes y volvió
                 if not empleado:
-                    empleado = db.query(Employee).filter(
-                        Employee.cedula == cedula,
-                        Employee.company_id == company.id,
-                        Employee.activo == False,
-                    ).first()
+                    if clave in claves_fuera_alcance:
+                        print(f"   ⏭️  Fila {idx + 2}: {cedula} ya activo en '{empresa_nombre}' (gestionado por su propio Sheet) — omitido")
+                        continue
+                    empleado = inactivos_por_clave.pop(clave, None)
                     if empleado:
+                        empleados_por_clave[clave] = empleado
                         reactivados += 1
                         print(f"   🔄 Reactivando empleado {cedula} ({nombre}) en '{empresa_nombre}'")
 
                 if empleado:
                     # ✅ ACTUALIZAR datos del empleado (ediciones en Excel se reflejan en BD)
-                    empleado.nombre = nombre
-                    empleado.correo = correo
-                    empleado.telefono = telefono
-                    empleado.company_id = company.id
-                    empleado.eps = eps
-                    empleado.jefe_nombre = jefe_nombre
-                    empleado.jefe_email = jefe_email
-                    empleado.jefe_cargo = jefe_cargo
-                    empleado.area_trabajo = area_trabajo
-                    empleado.cargo = cargo
-                    empleado.centro_costo = centro_costo
-                    empleado.fecha_ingreso = fecha_ingreso
-                    empleado.tipo_contrato = tipo_contrato
-                    empleado.ciudad = ciudad
-                    empleado.activo = True
-                    empleado.updated_at = datetime.now()
-                    db.commit()
-                    actualizados += 1
+                    # Solo si algo cambió respecto a lo ya cargado: filas idénticas no generan UPDATE
+                    if empleado.id in updates_por_id or any(
+                        getattr(empleado, campo) != valor for campo, valor in datos.items()
+                    ):
+                        datos["id"] = empleado.id
+                        datos["updated_at"] = ahora
+                        updates_por_id[empleado.id] = datos
+                        actualizados += 1
+                    else:
+                        sin_cambios += 1
                 else:
                     # ✅ CREAR empleado en ESTA empresa. Con la cédula única POR EMPRESA,
                     # el mismo empleado puede existir en otra empresa cliente como fila
                     # independiente — cada uno con su historial, sin robos ni conflictos.
-                    nuevo_empleado = Employee(
-                        cedula=cedula,
-                        nombre=nombre,
-                        correo=correo,
-                        telefono=telefono,
-                        company_id=company.id,
-                        eps=eps,
-                        jefe_nombre=jefe_nombre,
-                        jefe_email=jefe_email,
-                        jefe_cargo=jefe_cargo,
-                        area_trabajo=area_trabajo,
-                        cargo=cargo,
-                        centro_costo=centro_costo,
-                        fecha_ingreso=fecha_ingreso,
-                        tipo_contrato=tipo_contrato,
-                        ciudad=ciudad,
-                        activo=True
-                    )
-                    db.add(nuevo_empleado)
-                    db.commit()
-                    nuevos += 1
+                    # Filas repetidas en el Excel sobrescriben la misma alta en vez de duplicarla.
+                    datos["cedula"] = cedula
+                    if clave not in inserts_por_clave:
+                        nuevos += 1
+                    inserts_por_clave[clave] = datos
             
             except Exception as e:
                 print(f"   ❌ Error en fila {idx + 2}: {e}")
-                db.rollback()
         
         # ✅ MARCAR COMO RETIRADOS los empleados que ya no están en el Excel
         # Si la persona es recontratada y su cédula vuelve a aparecer en el Excel,
         # el sistema la detecta arriba y la reactiva automáticamente.
         # skip_retire=True cuando la pestaña no existía (no retirar por eso)
-        retirados = 0
+        ids_retirar = []
         if not skip_retire:
             for clave_bd, empleado_bd in empleados_por_clave.items():
                 if clave_bd not in claves_en_excel:
-                    empleado_bd.activo = False
-                    empleado_bd.updated_at = datetime.now()
-                    db.commit()
-                    retirados += 1
+                    ids_retirar.append(empleado_bd.id)
                     print(f"   🚪 Retirado: {empleado_bd.cedula} ({empleado_bd.nombre}) — ya no está en Excel")
+        retirados = len(ids_retirar)
+        
+        # ✅ UNA sola transacción para altas, ediciones, reactivaciones y retiros del PASO 2
+        try:
+            if updates_por_id:
+                db.bulk_update_mappings(Employee, list(updates_por_id.values()))
+            if inserts_por_clave:
+                _insertar_empleados(db, list(inserts_por_clave.values()))
+            if ids_retirar:
+                # Un solo UPDATE ... WHERE id IN (...) en vez de marcar objeto por objeto
+                db.query(Employee).filter(Employee.id.in_(ids_retirar)).update(
+                    {Employee.activo: False, Employee.updated_at: datetime.now()},
+                    synchronize_session=False)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"   ❌ Error guardando empleados (transacción revertida): {e}")
+            nuevos = actualizados = reactivados = retirados = sin_cambios = 0
+            paso2_ok = False
         
         # RESUMEN
         total_activos = db.query(Employee).filter(Employee.activo == True).count()
@@ -844,6 +1236,7 @@ def sincronizar_excel_completo(
         print(f"   • Emails empresas: Gestionados desde Directorio (admin portal)")
         print(f"   • Empleados nuevos: {nuevos}")
         print(f"   • Empleados actualizados: {actualizados}")
+        print(f"   • Empleados sin cambios: {sin_cambios}")
         print(f"   • Empleados reactivados: {reactivados}")
         print(f"   • Empleados retirados: {retirados}")
         print(f"   • Total activos en BD: {total_activos}")
@@ -870,7 +1263,7 @@ def sincronizar_excel_completo(
         #   - Procesado          : Fecha de procesamiento (se llena automáticamente)
         # ═══════════════════════════════════════════════════════════════════════════════════════════════
         try:
-            df_cases = pd.read_excel(excel_path, sheet_name=kactus_sheet)
+            df_cases = _leer_hoja_excel(excel_path, kactus_sheet)
             if len(df_cases) > 0:
                 print(f"📊 PASO 3: Procesando Cases_Kactus ({len(df_cases)} filas)...")
                 cases_creados = 0
@@ -880,7 +1273,6 @@ def sincronizar_excel_completo(
                 filas_error = []  # Filas con error → se marcarán con "ERROR: ..." en Excel
                 filas_ya_procesadas = 0  # Contador de filas que ya estaban procesadas
                 
-                from sqlalchemy import and_, func, or_
                 from app.database import EstadoCaso, TipoIncapacidad
                 
                 # Mapeo de tipos de incapacidad desde texto
@@ -937,12 +1329,45 @@ def sincronizar_excel_completo(
                     "prelicencia": TipoIncapacidad.PRELICENCIA,
                 }
                 
-                for idx, row in df_cases.iterrows():
+                # Columnas en minúsculas una sola vez (búsqueda case-insensitive: "Procesado"/"procesado")
+                columnas_lower = [str(c).lower() for c in df_cases.columns]
+                
+                # ═══ PRECARGA: casos y empleados de las cédulas de la hoja (1 SELECT cada uno) ═══
+                # Reemplaza las consultas por fila (fecha_inicio, numero_incapacidad, serial, empleado)
+                # por búsquedas en diccionarios.
+                caso_por_fecha = {}      # (cédula, fecha_inicio) → Case
+                caso_por_numero = {}     # (cédula, numero_incapacidad) → Case
+                serials_existentes = set()
+                empleado_por_cedula = {}
+                
+                def _indexar_caso(c):
+                    if c.fecha_inicio:
+                        caso_por_fecha.setdefault((c.cedula, _solo_fecha(c.fecha_inicio)), c)
+                    if c.numero_incapacidad:
+                        caso_por_numero.setdefault((c.cedula, c.numero_incapacidad), c)
+                    serials_existentes.add(c.serial)
+                
+                cedulas_hoja = set()
+                if "cedula" in columnas_lower:
+                    col_cedula = df_cases.columns[columnas_lower.index("cedula")]
+                    cedulas_hoja = set(
+                        pd.to_numeric(df_cases[col_cedula], errors="coerce").dropna().astype("int64").astype(str)
+                    )
+                if cedulas_hoja:
+                    for c in db.query(Case).filter(Case.cedula.in_(cedulas_hoja)).order_by(Case.id).all():
+                        _indexar_caso(c)
+                    for e in db.query(Employee).filter(
+                        Employee.cedula.in_(cedulas_hoja)
+                    ).order_by(Employee.activo.desc(), Employee.id).all():
+                        empleado_por_cedula.setdefault(e.cedula, e)
+                
+                updates_casos = {}  # caso.id → valores finales (bulk_update_mappings al final)
+                
+                # itertuples(name=None) evita construir una Series por fila como iterrows()
+                for idx, valores in enumerate(df_cases.itertuples(index=False, name=None)):
                     try:
                         # ═══ VERIFICAR SI YA FUE PROCESADA (tiene fecha en columna "Procesado" o "procesado") ═══
-                        # Buscar columna procesado case-insensitive
-                        # Crear diccionario con claves en minúsculas para búsqueda case-insensitive
-                        row_lower = {str(k).lower(): v for k, v in row.items()}
+                        row_lower = dict(zip(columnas_lower, valores))
                         
                         procesado_val = row_lower.get("procesado")
                         if pd.notna(procesado_val) and str(procesado_val).strip():
@@ -985,17 +1410,11 @@ def sincronizar_excel_completo(
                             continue
                         
                         # ═══ BUSCAR SI YA EXISTE EN BD ═══
-                        caso = db.query(Case).filter(
-                            Case.cedula == cedula_case,
-                            func.date(Case.fecha_inicio) == fecha_inicio.date()
-                        ).first()
+                        caso = caso_por_fecha.get((cedula_case, fecha_inicio.date()))
                         
                         # Si no existe por fecha_inicio, buscar por numero_incapacidad
                         if not caso and num_incap:
-                            caso = db.query(Case).filter(
-                                Case.cedula == cedula_case,
-                                Case.numero_incapacidad == num_incap
-                            ).first()
+                            caso = caso_por_numero.get((cedula_case, num_incap))
                         
                         if caso:
                             # ═══ CASO YA EXISTE EN BD ═══
@@ -1004,53 +1423,64 @@ def sincronizar_excel_completo(
                             tiene_traslap = getattr(caso, 'dias_traslapo', 0) or 0
                             datos_cambiaron = False
 
+                            # Valores finales del caso (partiendo de lo ya encolado si la fila se repite)
+                            # → se escriben con un solo UPDATE por lotes al final del PASO 3
+                            cambios = updates_casos.get(caso.id) or dict(
+                                {campo: getattr(caso, campo) for campo in CAMPOS_KACTUS_CASO}, id=caso.id
+                            )
+
                             # Actualizar datos de identificación siempre que vengan de Kactus
-                            if num_incap and caso.numero_incapacidad != num_incap:
-                                caso.numero_incapacidad = num_incap
+                            if num_incap and cambios["numero_incapacidad"] != num_incap:
+                                cambios["numero_incapacidad"] = num_incap
                                 datos_cambiaron = True
-                            if codigo_cie and caso.codigo_cie10 != codigo_cie:
-                                caso.codigo_cie10 = codigo_cie
+                            if codigo_cie and cambios["codigo_cie10"] != codigo_cie:
+                                cambios["codigo_cie10"] = codigo_cie
                                 datos_cambiaron = True
-                            if diagnostico and caso.diagnostico != diagnostico:
-                                caso.diagnostico = diagnostico
+                            if diagnostico and cambios["diagnostico"] != diagnostico:
+                                cambios["diagnostico"] = diagnostico
                                 datos_cambiaron = True
 
                             # fecha_inicio: Kactus es la fuente de verdad
-                            caso.fecha_inicio_kactus = fecha_inicio
+                            cambios["fecha_inicio_kactus"] = fecha_inicio
                             fecha_inicio_date = fecha_inicio.date() if hasattr(fecha_inicio, 'date') else fecha_inicio
-                            if caso.fecha_inicio != fecha_inicio_date:
-                                caso.fecha_inicio = fecha_inicio
+                            if cambios["fecha_inicio"] != fecha_inicio_date:
+                                print(f"   📅 Kactus override fecha_inicio: {cambios['fecha_inicio']} → {fecha_inicio.strftime('%d/%m/%Y')}")
+                                cambios["fecha_inicio"] = fecha_inicio
                                 datos_cambiaron = True
-                                print(f"   📅 Kactus override fecha_inicio: {caso.fecha_inicio} → {fecha_inicio.strftime('%d/%m/%Y')}")
 
                             # fecha_fin: Kactus es la fuente de verdad
                             if fecha_fin:
-                                caso.fecha_fin_kactus = fecha_fin
+                                cambios["fecha_fin_kactus"] = fecha_fin
                                 fecha_fin_date = fecha_fin.date() if hasattr(fecha_fin, 'date') else fecha_fin
-                                if caso.fecha_fin != fecha_fin_date:
-                                    caso.fecha_fin = fecha_fin
+                                if cambios["fecha_fin"] != fecha_fin_date:
+                                    print(f"   📅 Kactus override fecha_fin: {cambios['fecha_fin']} → {fecha_fin.strftime('%d/%m/%Y')}")
+                                    cambios["fecha_fin"] = fecha_fin
                                     datos_cambiaron = True
-                                    print(f"   📅 Kactus override fecha_fin: {caso.fecha_fin} → {fecha_fin.strftime('%d/%m/%Y')}")
 
                             # dias_incapacidad: Kactus siempre reemplaza (son los días BRUTOS del certificado)
                             # dias_traslapo NO se toca — es calculado por el sistema y representa el solapamiento
                             # Los días efectivos = dias_incapacidad - dias_traslapo (se calcula al mostrar)
-                            if dias and caso.dias_incapacidad != dias:
+                            if dias and cambios["dias_incapacidad"] != dias:
                                 if tiene_traslap:
-                                    print(f"   📊 Kactus override días (con traslape {tiene_traslap}d): {caso.dias_incapacidad} → {dias} brutos")
+                                    print(f"   📊 Kactus override días (con traslape {tiene_traslap}d): {cambios['dias_incapacidad']} → {dias} brutos")
                                 else:
-                                    print(f"   📊 Kactus override días: {caso.dias_incapacidad} → {dias}")
-                                caso.dias_incapacidad = dias
+                                    print(f"   📊 Kactus override días: {cambios['dias_incapacidad']} → {dias}")
+                                cambios["dias_incapacidad"] = dias
                                 datos_cambiaron = True
 
                             # Marca de sync
-                            caso.es_historico = es_historico
-                            caso.procesado = True
-                            caso.fecha_procesado = datetime.now()
-                            caso.usuario_procesado = "sync_kactus"
-                            caso.kactus_sync_at = datetime.now()
-                            caso.updated_at = datetime.now()
-                            db.commit()
+                            ahora = datetime.now()
+                            cambios.update(
+                                es_historico=es_historico,
+                                procesado=True,
+                                fecha_procesado=ahora,
+                                usuario_procesado="sync_kactus",
+                                kactus_sync_at=ahora,
+                                updated_at=ahora,
+                            )
+                            updates_casos[caso.id] = cambios
+                            # Indexar también por la fecha que trajo Kactus (filas repetidas en la hoja)
+                            caso_por_fecha.setdefault((cedula_case, fecha_inicio.date()), caso)
                             cases_actualizados += 1
                             if datos_cambiaron:
                                 print(f"   🔄 Actualizado (Kactus): CC {cedula_case} | {fecha_inicio.strftime('%d/%m/%Y')} | {dias}d")
@@ -1059,7 +1489,7 @@ def sincronizar_excel_completo(
                         else:
                             # ═══ CREAR CASO NUEVO ═══
                             # Buscar empleado para obtener company_id y nombre
-                            empleado = db.query(Employee).filter(Employee.cedula == cedula_case).first()
+                            empleado = empleado_por_cedula.get(cedula_case)
                             
                             # Generar serial: CEDULA DD MM YYYY DD MM YYYY
                             fi_str = fecha_inicio.strftime("%d %m %Y")
@@ -1067,8 +1497,7 @@ def sincronizar_excel_completo(
                             serial = f"{cedula_case} {fi_str} {ff_str}"
                             
                             # Verificar que el serial no exista
-                            serial_existente = db.query(Case).filter(Case.serial == serial).first()
-                            if serial_existente:
+                            if serial in serials_existentes:
                                 print(f"   ⚠️ Serial {serial} ya existe, saltando...")
                                 filas_procesadas.append(idx + 2)
                                 continue
@@ -1103,13 +1532,16 @@ def sincronizar_excel_completo(
                                     "es_historico": es_historico
                                 }
                             )
-                            db.add(nuevo_caso)
-                            db.commit()
+                            # SAVEPOINT por caso: un INSERT fallido no tumba la transacción del PASO 3
+                            with db.begin_nested():
+                                db.add(nuevo_caso)
+                            _indexar_caso(nuevo_caso)  # filas repetidas en la hoja lo encuentran en memoria
                             
                             # ✅ VERIFICAR SI ES PRÓRROGA EN CONTEXTO DE MATERNIDAD/PRELICENCIA
                             try:
                                 from app.services.prorroga_detector import verificar_prorroga_contexto_maternidad
-                                resultado_maternidad = verificar_prorroga_contexto_maternidad(db, nuevo_caso)
+                                with db.begin_nested():
+                                    resultado_maternidad = verificar_prorroga_contexto_maternidad(db, nuevo_caso)
                                 if resultado_maternidad.get("es_prorroga_cadena_previa"):
                                     print(f"   ✅ PRÓRROGA MATERNIDAD: {nuevo_caso.serial}")
                             except Exception as e:
@@ -1128,7 +1560,20 @@ def sincronizar_excel_completo(
                     except Exception as e:
                         print(f"   ❌ Error fila {idx+2}: {e}")
                         filas_error.append((idx + 2, str(e)))  # Guardar fila + error para marcar en Excel
-                        db.rollback()
+                
+                # ═══ GUARDAR: UPDATE por lotes de los casos existentes + un solo commit ═══
+                try:
+                    if updates_casos:
+                        db.bulk_update_mappings(Case, list(updates_casos.values()))
+                    db.commit()
+                except Exception as e:
+                    db.rollback()
+                    print(f"   ❌ Error guardando Cases_Kactus (transacción revertida): {e}")
+                    # Nada quedó en BD: esas filas NO deben borrarse del Excel
+                    filas_error.extend((fila, f"No se guardó en BD: {e}") for fila in filas_procesadas)
+                    filas_procesadas = []
+                    cases_creados = cases_historicos = cases_actualizados = 0
+                    paso3_ok = False
                 
                 print(f"\n   📊 Resumen Cases_Kactus:")
                 print(f"      • Casos CREADOS (nuevos): {cases_creados}")
@@ -1166,6 +1611,7 @@ def sincronizar_excel_completo(
                 print(f"   ℹ️ Hoja 2 (Cases_Kactus) no existe aún, omitiendo...")
             else:
                 print(f"   ⚠️ Error leyendo Cases_Kactus: {e}")
+                paso3_ok = False
         
         # ========== PASO 4: CORREOS NOTIFICACIÓN → GESTIONADOS DESDE ADMIN PORTAL ==========
         # Los correos de notificación ya NO se sincronizan desde el Excel.
@@ -1175,6 +1621,10 @@ def sincronizar_excel_completo(
         total_correos = db.query(CorreoNotificacion).filter(CorreoNotificacion.activo == True).count()
         print(f"   ✅ {total_correos} correos activos en base de datos (gestionados desde admin portal)")
         
+        if huella and paso2_ok and paso3_ok:
+            _huella_ultimo_sync[clave_sync] = huella
+        elif huella:
+            print("   ⚠️ Sync con errores al guardar — el mismo Excel se re-procesará en el próximo sync")
         
     except Exception as e:
         print(f"\n❌ ERROR GENERAL EN SYNC: {e}")
@@ -1183,6 +1633,7 @@ def sincronizar_excel_completo(
         db.rollback()
     finally:
         db.close()
+        _invalidar_estado_sync()  # el dashboard ve los cambios del sync sin esperar el TTL
 
 
 # ══════════════════════════════════════════════════════════════════
@@ -1195,49 +1646,51 @@ def _detectar_traslapos_globales(db):
     Ejemplo: Incap A del 31/01 al 02/02 e Incap B del 02/02 al 04/02 → 1 día traslapado.
     En Kactus se subiría como 03/02 al 04/02 (2 días en vez de 3).
     """
-    from sqlalchemy import func, and_
-    
     try:
-        # Obtener todas las cédulas con más de 1 caso activo
-        cedulas = db.query(Case.cedula).filter(
+        # La BD compara cada caso con el ANTERIOR de la misma cédula (LAG sobre cédula,
+        # fecha_inicio) y solo devuelve los que se traslapan: no se traen todos los casos.
+        ventana = {"partition_by": Case.cedula, "order_by": (Case.fecha_inicio, Case.id)}
+        ordenados = db.query(
+            Case.id.label("id"),
+            Case.fecha_inicio.label("fecha_inicio"),
+            Case.fecha_inicio_kactus.label("fecha_inicio_kactus"),
+            Case.dias_traslapo.label("dias_traslapo"),
+            func.lag(Case.fecha_fin).over(**ventana).label("fin_anterior"),
+            func.lag(Case.serial).over(**ventana).label("serial_anterior"),
+        ).filter(
             Case.fecha_inicio != None,
             Case.fecha_fin != None
-        ).group_by(Case.cedula).having(func.count(Case.id) > 1).all()
-        
-        traslapos_detectados = 0
+        ).subquery()
+        
+        # ¿Se traslapa? fecha_fin del anterior >= fecha_inicio del caso
+        # Solo marcar si no tiene ya Kactus override (que es la fecha real ajustada)
+        traslapados = db.query(ordenados).filter(
+            func.date(ordenados.c.fin_anterior) >= func.date(ordenados.c.fecha_inicio),
+            ordenados.c.fecha_inicio_kactus == None,
+            ordenados.c.dias_traslapo == 0,
+        ).all()
+        
+        # Los cambios salen directo de la consulta → un UPDATE por lotes, sin cargar los Case
+        ahora = datetime.now()
+        updates = []
+        for t in traslapados:
+            dias_overlap = (t.fin_anterior.date() - t.fecha_inicio.date()).days + 1
+            updates.append({
+                "id": t.id,
+                "dias_traslapo": dias_overlap,
+                "traslapo_con_serial": t.serial_anterior,
+                # Fecha Kactus sugerida (inicio original + días traslapo)
+                "fecha_inicio_kactus": t.fecha_inicio + timedelta(days=dias_overlap),
+                "updated_at": ahora,
+            })
+        traslapos_detectados = len(updates)
         
-        for (cedula,) in cedulas:
-            casos = db.query(Case).filter(
-                Case.cedula == cedula,
-                Case.fecha_inicio != None,
-                Case.fecha_fin != None
-            ).order_by(Case.fecha_inicio.asc()).all()
-            
-            for i in range(len(casos) - 1):
-                caso_actual = casos[i]
-                caso_siguiente = casos[i + 1]
-                
-                if not caso_actual.fecha_fin or not caso_siguiente.fecha_inicio:
-                    continue
-                
-                # ¿Se traslapa? fecha_fin del actual >= fecha_inicio del siguiente
-                if caso_actual.fecha_fin.date() >= caso_siguiente.fecha_inicio.date():
-                    dias_overlap = (caso_actual.fecha_fin.date() - caso_siguiente.fecha_inicio.date()).days + 1
-                    
-                    # Solo marcar si no tiene ya Kactus override (que es la fecha real ajustada)
-                    if not caso_siguiente.fecha_inicio_kactus and caso_siguiente.dias_traslapo == 0:
-                        caso_siguiente.dias_traslapo = dias_overlap
-                        caso_siguiente.traslapo_con_serial = caso_actual.serial
-                        
-                        # Calcular fecha Kactus sugerida (inicio original + días traslapo)
-                        from datetime import timedelta
-                        nueva_fecha_inicio = caso_siguiente.fecha_inicio + timedelta(days=dias_overlap)
-                        caso_siguiente.fecha_inicio_kactus = nueva_fecha_inicio
-                        
-                        # Recalcular días Kactus si no los tiene
-                        caso_siguiente.updated_at = datetime.now()
-                        db.commit()
-                        traslapos_detectados += 1
+        # Un solo commit para todos los traslapos (antes uno por caso)
+        if updates:
+            db.bulk_update_mappings(Case, updates)
+        db.commit()
+        if updates:
+            _invalidar_estado_sync()
         
         if traslapos_detectados > 0:
             print(f"   🔀 {traslapos_detectados} traslapos detectados automáticamente")
@@ -1286,41 +1739,75 @@ def vaciar_hoja_kactus_quincenal():
 # ESTADO DE SINCRONIZACIÓN
 # ══════════════════════════════════════════════════════════════════
 
+TTL_ESTADO_SYNC = 30  # segundos
+_estado_sync_cache = {"t": 0.0, "valor": None}
+_ESTADO_SYNC_LOCK = threading.Lock()
+
+
 def obtener_estado_sync():
-    """Retorna el estado actual de la sincronización BD ↔ Excel"""
+    """
+    Retorna el estado actual de la sincronización BD ↔ Excel.
+    Memorizado TTL_ESTADO_SYNC segundos: el dashboard lo consulta seguido y cada
+    cálculo recorre toda la tabla cases. El lock hace que, al vencer, solo una
+    petición recalcule y las simultáneas reutilicen ese resultado.
+    """
+    with _ESTADO_SYNC_LOCK:
+        if _estado_sync_cache["valor"] is not None and \
+                time.monotonic() - _estado_sync_cache["t"] < TTL_ESTADO_SYNC:
+            return _estado_sync_cache["valor"]
+        estado = _calcular_estado_sync()
+        if estado.get("ok"):  # los errores no se memorizan
+            _estado_sync_cache.update(t=time.monotonic(), valor=estado)
+        return estado
+
+
+def _invalidar_estado_sync():
+    """Descarta el estado memorizado (tras un sync o una detección de traslapos)."""
+    with _ESTADO_SYNC_LOCK:
+        _estado_sync_cache.update(t=0.0, valor=None)
+
+
+def _calcular_estado_sync():
+    """Consulta a BD del estado de sincronización (sin cache)."""
     db = SessionLocal()
     try:
-        from sqlalchemy import func
-        
-        total_empleados = db.query(Employee).filter(Employee.activo == True).count()
-        total_casos = db.query(Case).count()
-        casos_con_kactus = db.query(Case).filter(Case.kactus_sync_at != None).count()
+        # Todos los conteos en UNA consulta: un solo recorrido de cases (antes 8 consultas)
+        (
+            total_empleados,
+            total_casos,
+            casos_con_kactus,
+            casos_con_diagnostico,
+            casos_con_cie10,
+            casos_con_traslapo,
+            ultima_sync_kactus,
+            ultimo_caso_creado,
+        ) = db.query(
+            db.query(func.count(Employee.id)).filter(Employee.activo == True).scalar_subquery(),
+            func.count(Case.id),
+            func.count(Case.kactus_sync_at),
+            func.count(case((and_(Case.diagnostico != None, Case.diagnostico != ''), 1))),
+            func.count(case((and_(Case.codigo_cie10 != None, Case.codigo_cie10 != ''), 1))),
+            func.count(case((Case.dias_traslapo > 0, 1))),
+            func.max(Case.kactus_sync_at),
+            func.max(Case.created_at),
+        ).select_from(Case).one()
         casos_sin_kactus = total_casos - casos_con_kactus
-        casos_con_diagnostico = db.query(Case).filter(
-            Case.diagnostico != None,
-            Case.diagnostico != ''
-        ).count()
-        casos_con_cie10 = db.query(Case).filter(
-            Case.codigo_cie10 != None,
-            Case.codigo_cie10 != ''
-        ).count()
-        casos_con_traslapo = db.query(Case).filter(
-            Case.dias_traslapo > 0
-        ).count()
-        
-        ultima_sync_kactus = db.query(func.max(Case.kactus_sync_at)).scalar()
-        ultimo_caso_creado = db.query(func.max(Case.created_at)).scalar()
         
         # Traslapos por empleado
         traslapos_detalle = []
         if casos_con_traslapo > 0:
             traslapos = db.query(Case).filter(Case.dias_traslapo > 0).order_by(Case.updated_at.desc()).limit(20).all()
+            # Nombres de todas las cédulas en una consulta (antes un SELECT por caso)
+            nombre_por_cedula = {}
+            for ced, nombre in db.query(Employee.cedula, Employee.nombre).filter(
+                Employee.cedula.in_({t.cedula for t in traslapos})
+            ).order_by(Employee.id).all():
+                nombre_por_cedula.setdefault(ced, nombre)
             for t in traslapos:
-                emp = db.query(Employee).filter(Employee.cedula == t.cedula).first()
                 traslapos_detalle.append({
                     "serial": t.serial,
                     "cedula": t.cedula,
-                    "nombre": emp.nombre if emp else "?",
+                    "nombre": nombre_por_cedula.get(t.cedula, "?"),
                     "fecha_inicio": str(t.fecha_inicio.date()) if t.fecha_inicio else None,
                     "fecha_fin": str(t.fecha_fin.date()) if t.fecha_fin else None,
                     "fecha_inicio_kactus": str(t.fecha_inicio_kactus.date()) if t.fecha_inicio_kactus else None,
@@ -3,14 +3,109 @@ FORMATEADOR DE EXCEL
 Utilidades para exportar a Excel, CSV y JSON con formato profesional
 """
 
-import pandas as pd
-from io import BytesIO
+import csv
 import json
-from typing import Any
-import logging
-from openpyxl.styles import Font, PatternFill, Alignment, numbers
+import tempfile
+import pandas as pd
+import xlsxwriter
+from io import BytesIO, StringIO
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import wraps
+from typing import Any, Optional
+
+# Cache LRU de exportaciones: mismo DataFrame (y mismos argumentos) → mismos bytes.
+# Los dashboards y exportaciones suelen repetirse con datos idénticos en segundos.
+_MAX_EXPORTACIONES_CACHE = 32
+_exportaciones_cache: "OrderedDict[bytes, bytes]" = OrderedDict()
+_exportaciones_lock = threading.Lock()
+
+
+# Estilos de la hoja (propiedades de formato de xlsxwriter), definidos una sola vez.
+# Los objetos Format pertenecen a cada workbook; aquí solo se comparten sus propiedades.
+_FORMATO_ENCABEZADO = {
+    'bold': True, 'font_color': '#FFFFFF', 'font_size': 10,
+    'bg_color': '#1F4E78', 'align': 'center', 'valign': 'vcenter', 'text_wrap': True,
+}
+# Celdas de datos: fuente tamaño 10, alineamiento vertical (por columna)
+_FORMATO_DATOS = {'font_size': 10, 'valign': 'vcenter'}
+
+
+def _huella_df(df: pd.DataFrame, *extra) -> Optional[bytes]:
+    """Huella del contenido + columnas + tipos del DataFrame; None si tiene celdas no hasheables."""
+    try:
+        h = hashlib.blake2b(digest_size=16)
+        h.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+        h.update(repr((list(df.columns), [str(t) for t in df.dtypes], extra)).encode("utf-8"))
+        return h.digest()
+    except TypeError:
+        return None  # listas/dicts dentro de celdas: se exporta sin cache
+
+
+def _con_cache(formato: str):
+    """Memoriza la salida de un exportador por huella del DataFrame (LRU acotado)."""
+    def decorador(fn):
+        @wraps(fn)
+        def envoltura(df: pd.DataFrame, *args, **kwargs) -> bytes:
+            clave = _huella_df(df, formato, args, sorted(kwargs.items()))
+            if clave is not None:
+                with _exportaciones_lock:
+                    datos = _exportaciones_cache.get(clave)
+                    if datos is not None:
+                        _exportaciones_cache.move_to_end(clave)
+                        return datos
+            datos = fn(df, *args, **kwargs)
+            if clave is not None:
+                with _exportaciones_lock:
+                    _exportaciones_cache[clave] = datos
+                    while len(_exportaciones_cache) > _MAX_EXPORTACIONES_CACHE:
+                        _exportaciones_cache.popitem(last=False)
+            return datos
+        return envoltura
+    return decorador
 
-logger = logging.getLogger(__name__)
+
+def _limpiar_fecha(val_str: str) -> str:
+    """Convierte cualquier formato de fecha/datetime a DD/MM/YYYY o DD/MM/YYYY HH:MM"""
+    try:
+        # Si ya está en formato DD/MM/YYYY o DD/MM/YYYY HH:MM, devolverlo como está
+        if val_str and (
+            (len(val_str) == 10 and val_str[2] == '/' and val_str[5] == '/') or
+            (len(val_str) >= 16 and val_str[2] == '/' and val_str[5] == '/')
+        ):
+            return val_str
+        
+        # Soporta: "2026-03-26T00:00:00", "2026-03-26 00:00:00.000000", "2026-03-26"
+        dt = pd.to_datetime(val_str)
+        if dt.hour == 0 and dt.minute == 0 and dt.second == 0:
+            return dt.strftime("%d/%m/%Y")
+        return dt.strftime("%d/%m/%Y %H:%M")
+    except Exception:
+        return str(val_str).upper()
+
+
+def _limpiar_valor(val) -> str:
+    if pd.isna(val) or val is None:
+        return val
+    val_str = str(val).strip()
+    
+    # Si ya está en formato DD/MM/YYYY, devolverlo como está
+    if len(val_str) == 10 and val_str[2] == '/' and val_str[5] == '/':
+        return val_str
+    
+    # Si ya está en formato DD/MM/YYYY HH:MM, devolverlo como está
+    if len(val_str) >= 16 and val_str[2] == '/' and val_str[5] == '/' and ':' in val_str:
+        return val_str
+    
+    # Detectar fechas ISO: empieza con 4 dígitos-mes-día o contiene T
+    es_fecha = (
+        (len(val_str) >= 10 and val_str[4:5] == '-' and val_str[7:8] == '-') or
+        ('T' in val_str and val_str[4:5] == '-')
+    )
+    if es_fecha:
+        return _limpiar_fecha(val_str)
+    return val_str.upper()
 
 
 def _normalizar_df(df: pd.DataFrame) -> pd.DataFrame:
@@ -25,46 +120,6 @@ def _normalizar_df(df: pd.DataFrame) -> pd.DataFrame:
     # Renombrar columnas a MAYÚSCULAS
     df.columns = [str(col).upper() for col in df.columns]
 
-    def _limpiar_fecha(val_str: str) -> str:
-        """Convierte cualquier formato de fecha/datetime a DD/MM/YYYY o DD/MM/YYYY HH:MM"""
-        try:
-            # Si ya está en formato DD/MM/YYYY o DD/MM/YYYY HH:MM, devolverlo como está
-            if val_str and (
-                (len(val_str) == 10 and val_str[2] == '/' and val_str[5] == '/') or
-                (len(val_str) >= 16 and val_str[2] == '/' and val_str[5] == '/')
-            ):
-                return val_str
-            
-            # Soporta: "2026-03-26T00:00:00", "2026-03-26 00:00:00.000000", "2026-03-26"
-            dt = pd.to_datetime(val_str)
-            if dt.hour == 0 and dt.minute == 0 and dt.second == 0:
-                return dt.strftime("%d/%m/%Y")
-            return dt.strftime("%d/%m/%Y %H:%M")
-        except Exception:
-            return str(val_str).upper()
-
-    def _limpiar_valor(val) -> str:
-        if pd.isna(val) or val is None:
-            return val
-        val_str = str(val).strip()
-        
-        # Si ya está en formato DD/MM/YYYY, devolverlo como está
-        if len(val_str) == 10 and val_str[2] == '/' and val_str[5] == '/':
-            return val_str
-        
-        # Si ya está en formato DD/MM/YYYY HH:MM, devolverlo como está
-        if len(val_str) >= 16 and val_str[2] == '/' and val_str[5] == '/' and ':' in val_str:
-            return val_str
-        
-        # Detectar fechas ISO: empieza con 4 dígitos-mes-día o contiene T
-        es_fecha = (
-            (len(val_str) >= 10 and val_str[4:5] == '-' and val_str[7:8] == '-') or
-            ('T' in val_str and val_str[4:5] == '-')
-        )
-        if es_fecha:
-            return _limpiar_fecha(val_str)
-        return val_str.upper()
-
     # Procesar cada columna
     for col in df.columns:
         if pd.api.types.is_datetime64_any_dtype(df[col]):
@@ -79,99 +134,164 @@ def _normalizar_df(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
-
-class ExcelFormatter:
-    """Formateador para exportaciones de datos"""
-    
-    @staticmethod
-    def crear_excel(df: pd.DataFrame, titulo: str = "Reporte") -> bytes:
-        """
-        Crea archivo Excel con formato profesional
-        - Texto en MAYÚSCULAS
-        - Fechas limpias
-        - Encabezados con estilo
-        - Tamaño de fuente estandarizado (10pt)
-        """
-        try:
-            # Normalizar datos
-            df = _normalizar_df(df)
-            
-            output = BytesIO()
-            
-            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                df.to_excel(writer, sheet_name='Datos', index=False)
-                
-                workbook = writer.book
-                worksheet = writer.sheets['Datos']
-                
-                # Estilo de encabezados
-                header_font = Font(bold=True, color="FFFFFF", size=10)
-                header_fill = PatternFill(patternType="solid", fgColor="1F4E78")
-                header_align = Alignment(horizontal="center", vertical="center", wrap_text=True)
-                
-                for cell in worksheet[1]:
-                    cell.font = header_font
-                    cell.fill = header_fill
-                    cell.alignment = header_align
-                
-                # Formato de celdas de datos: fuente tamaño 10, alineamiento vertical
-                data_font = Font(size=10)
-                data_align = Alignment(vertical="center", wrap_text=False)
-                for row in worksheet.iter_rows(min_row=2, max_row=worksheet.max_row, max_col=worksheet.max_column):
-                    for cell in row:
-                        cell.font = data_font
-                        cell.alignment = data_align
-                
-                # Ajustar ancho de columnas
-                for column in worksheet.columns:
-                    max_length = 0
-                    column_letter = column[0].column_letter
-                    for cell in column:
-                        try:
-                            if cell.value and len(str(cell.value)) > max_length:
-                                max_length = len(str(cell.value))
-                        except:
-                            pass
-                    adjusted_width = min(max_length + 3, 50)
-                    worksheet.column_dimensions[column_letter].width = max(adjusted_width, 12)
-                
-                # Congelar primera fila (encabezados)
-                worksheet.freeze_panes = 'A2'
-            
-            output.seek(0)
-            return output.read()
+@_con_cache("xlsx")
+def crear_excel(df: pd.DataFrame, titulo: str = "Reporte", style: bool = True) -> bytes:
+    """
+    Crea archivo Excel con formato profesional
+    - Texto en MAYÚSCULAS
+    - Fechas limpias
+    - Encabezados con estilo
+    - Tamaño de fuente estandarizado (10pt)
+    
+    style=False: solo los datos normalizados, sin estilos ni anchos de columna
+    (exportaciones programáticas / previews de API que no se abren a mano).
+    """
+    # Normalizar datos
+    df = _normalizar_df(df)
+    
+    output = BytesIO()
+    
+    if not style:
+        df.to_excel(output, sheet_name='Datos', index=False, engine='xlsxwriter')
+        return output.getvalue()
+    
+    # xlsxwriter escribe en streaming (solo escritura): no arma el grafo de celdas de openpyxl
+    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
+        df.to_excel(writer, sheet_name='Datos', index=False)
         
-        except Exception as e:
-            logger.error(f"Error creando Excel: {str(e)}")
-            raise
-    
-    @staticmethod
-    def crear_csv(df: pd.DataFrame) -> bytes:
-        """
-        Crea archivo CSV con texto en MAYÚSCULAS
-        """
-        try:
-            df = _normalizar_df(df)
-            output = BytesIO()
-            df.to_csv(output, index=False, encoding='utf-8-sig')
-            output.seek(0)
-            return output.read()
+        workbook = writer.book
+        worksheet = writer.sheets['Datos']
         
-        except Exception as e:
-            logger.error(f"Error creando CSV: {str(e)}")
-            raise
-    
-    @staticmethod
-    def crear_json(df: pd.DataFrame) -> bytes:
-        """
-        Crea archivo JSON con texto en MAYÚSCULAS
-        """
-        try:
-            df = _normalizar_df(df)
-            datos = df.to_dict(orient='records')
-            json_str = json.dumps(datos, ensure_ascii=False, indent=2)
-            return json_str.encode('utf-8')
+        header_format = workbook.add_format(_FORMATO_ENCABEZADO)
+        data_format = workbook.add_format(_FORMATO_DATOS)
         
-        except Exception as e:
-            logger.error(f"Error creando JSON: {str(e)}")
-            raise
+        for i, col in enumerate(df.columns):
+            worksheet.write(0, i, str(col), header_format)
+            # Ancho de columna: largo máximo calculado en pandas (vectorizado)
+            largo = df.iloc[:, i].fillna("").astype(str).str.len().max()
+            max_length = max(0 if pd.isna(largo) else int(largo), len(str(col)))
+            adjusted_width = min(max_length + 3, 50)
+            worksheet.set_column(i, i, max(adjusted_width, 12), data_format)
+        
+        # Congelar primera fila (encabezados)
+        worksheet.freeze_panes(1, 0)
+    
+    output.seek(0)
+    return output.read()
+
+
+def _escribir_excel_filas(destino, columnas, filas) -> None:
+    """
+    Escribe el xlsx en `destino` (archivo binario) desde un iterable de filas (tuplas):
+    xlsxwriter en modo constant_memory escribe cada fila y la libera, así que la
+    memoria no crece con el número de filas. Mismo formato y normalización de texto.
+    """
+    columnas = [str(col).upper() for col in columnas]
+    anchos = [len(col) for col in columnas]
+    
+    workbook = xlsxwriter.Workbook(destino, {'constant_memory': True})
+    worksheet = workbook.add_worksheet('Datos')
+    
+    header_format = workbook.add_format(_FORMATO_ENCABEZADO)
+    data_format = workbook.add_format(_FORMATO_DATOS)
+    
+    worksheet.write_row(0, 0, columnas, header_format)
+    
+    fila_idx = 0
+    for fila_idx, fila in enumerate(filas, start=1):
+        valores = [_limpiar_valor(v) if isinstance(v, str) else v for v in fila]
+        worksheet.write_row(fila_idx, 0, valores, data_format)
+        for i, v in enumerate(valores):
+            if v is not None:
+                largo = len(str(v))
+                if largo > anchos[i]:
+                    anchos[i] = largo
+    
+    # Anchos al final (constant_memory solo restringe volver a filas ya escritas)
+    for i, largo in enumerate(anchos):
+        worksheet.set_column(i, i, max(min(largo + 3, 50), 12))
+    
+    # Congelar primera fila (encabezados)
+    worksheet.freeze_panes(1, 0)
+    workbook.close()
+
+
+def crear_excel_filas(columnas, filas, titulo: str = "Reporte") -> bytes:
+    """Igual que crear_excel pero desde un iterable de filas (tuplas), sin DataFrame."""
+    output = BytesIO()
+    _escribir_excel_filas(output, columnas, filas)
+    return output.getvalue()
+
+
+def crear_excel_filas_temp(columnas, filas, titulo: str = "Reporte", max_memoria: int = 16 * 1024 * 1024):
+    """
+    Como crear_excel_filas pero a un SpooledTemporaryFile (en RAM hasta max_memoria,
+    luego a disco), posicionado al inicio para transmitirlo por bloques.
+    Quien lo recibe debe cerrarlo.
+    """
+    archivo = tempfile.SpooledTemporaryFile(max_size=max_memoria)
+    try:
+        _escribir_excel_filas(archivo, columnas, filas)
+    except Exception:
+        archivo.close()
+        raise
+    archivo.seek(0)
+    return archivo
+
+
+def leer_por_bloques(archivo, tamano_bloque: int = 64 * 1024):
+    """Genera el contenido de un archivo binario por bloques y lo cierra al terminar."""
+    try:
+        while True:
+            bloque = archivo.read(tamano_bloque)
+            if not bloque:
+                break
+            yield bloque
+    finally:
+        archivo.close()
+
+
+@_con_cache("csv")
+def crear_csv(df: pd.DataFrame) -> bytes:
+    """
+    Crea archivo CSV con texto en MAYÚSCULAS
+    """
+    df = _normalizar_df(df)
+    # pandas arma el CSV como str una vez y se codifica en una pasada (BOM incluido)
+    return df.to_csv(index=False).encode('utf-8-sig')
+
+
+def crear_csv_filas(columnas, filas, filas_por_bloque: int = 500):
+    """
+    CSV en streaming desde un iterable de filas (tuplas): genera bloques de bytes para
+    StreamingResponse (UTF-8 con BOM en el primero). Misma normalización que crear_csv.
+    """
+    buffer = StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow([str(col).upper() for col in columnas])
+    yield buffer.getvalue().encode("utf-8-sig")
+    buffer.seek(0)
+    buffer.truncate()
+    
+    for n, fila in enumerate(filas, start=1):
+        writer.writerow([_limpiar_valor(v) if isinstance(v, str) else v for v in fila])
+        if n % filas_por_bloque == 0:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+@_con_cache("json")
+def crear_json(df: pd.DataFrame) -> bytes:
+    """
+    Crea archivo JSON con texto en MAYÚSCULAS
+    """
+    df = _normalizar_df(df)
+    # json.dumps y no df.to_json: to_json escapa "/" como "\/" y serializa NaN/fechas distinto,
+    # lo que cambiaría el texto de links y fechas en los reportes
+    datos = df.to_dict(orient='records')
+    json_str = json.dumps(datos, ensure_ascii=False, indent=2)
+    return json_str.encode('utf-8')
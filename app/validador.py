@@ -4,24 +4,35 @@ Endpoints para gestión, validación y búsqueda de casos
 """
 
 from fastapi import APIRouter, Depends, HTTPException, Header, UploadFile, File, Form, Request, Query, BackgroundTasks
-from fastapi.responses import StreamingResponse, FileResponse
-import requests
+from starlette.background import BackgroundTask
+from fastapi.responses import StreamingResponse, FileResponse, ORJSONResponse, Response
+import httpx
 import io
 import os
+import asyncio
 import tempfile
+import shutil
 import base64
-from sqlalchemy.orm import Session
+import hashlib
+import re
+import hmac
+import time
+import threading
+from functools import lru_cache
+from sqlalchemy.orm import Session, joinedload, selectinload
 from sqlalchemy.orm.attributes import flag_modified
-from sqlalchemy import or_, and_, func
+from sqlalchemy import or_, and_, func, delete, select, bindparam
 from typing import List, Optional, Dict, Any
 from datetime import datetime, timedelta
 from pydantic import BaseModel
 import pandas as pd
+import openpyxl
+import logging
 
 from app.database import (
     get_db, Case, CaseDocument, CaseEvent, CaseNote, Employee, 
     Company, SearchHistory, EstadoCaso, EstadoDocumento, TipoIncapacidad,
-    CorreoNotificacion, AlertaEmail, Alerta180Log, get_utc_now
+    CorreoNotificacion, AlertaEmail, Alerta180Log, get_utc_now, SessionLocal
 )
 from app.checks_disponibles import CHECKS_DISPONIBLES, obtener_checks_por_tipo
 from app.email_templates import get_email_template_universal
@@ -32,6 +43,13 @@ from app.notification_queue import notification_queue, NotificacionPendiente  #
 from app.services.prorroga_detector import analizar_historial_empleado  # ✅ Detección de prórrogas por cadenas
 
 router = APIRouter(prefix="/validador", tags=["Portal de Validadores"])
+logger = logging.getLogger(__name__)
+# Nivel por VALIDADOR_LOG_LEVEL (DEBUG muestra la traza de los PDFs). Los registros propagan
+# a la raíz: formato, destino y la cola no bloqueante los configura la app (startup en main.py)
+logger.setLevel(os.environ.get("VALIDADOR_LOG_LEVEL", "INFO").upper())
+
+# Los endpoints que solo consultan la BD (Session síncrona) y no hacen await se declaran
+# con `def`: FastAPI los ejecuta en su threadpool y las consultas no bloquean el event loop.
 
 
 def _parsear_serial_local(serial: str):
@@ -78,14 +96,17 @@ class BusquedaRelacionalRequest(BaseModel):
 
 # ==================== UTILIDADES ====================
 
+# Se lee una vez al importar (main.py carga el .env antes de importar este módulo)
+_ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+
+
 def verificar_token_admin(x_admin_token: str = Header(...)):
     """Verifica que el token de administrador sea válido"""
-    admin_token = os.environ.get("ADMIN_TOKEN")
-    
-    if not admin_token:
+    if not _ADMIN_TOKEN:
         raise HTTPException(status_code=500, detail="ADMIN_TOKEN no configurado en el servidor")
     
-    if x_admin_token != admin_token:
+    # Comparación en tiempo constante (bytes: admite cabeceras con caracteres no ASCII)
+    if not hmac.compare_digest(x_admin_token.encode("utf-8"), _ADMIN_TOKEN.encode("utf-8")):
         raise HTTPException(status_code=403, detail="Token de administrador inválido")
     
     return True
@@ -107,6 +128,120 @@ def registrar_evento(db: Session, case_id: int, accion: str, actor: str = "Siste
     db.commit()
 
 
+# ⚡ Cache nombre de empresa → id (tabla pequeña y casi estática): ahorra un SELECT
+# a companies en cada /casos, /stats, exportación y búsqueda relacional.
+# Solo se cachean aciertos, con TTL, para que empresas nuevas/renombradas aparezcan solas.
+TTL_EMPRESA_ID = 300  # segundos
+_empresa_id_cache: Dict[str, tuple] = {}  # nombre → (company_id, expira_en)
+_EMPRESA_ID_LOCK = threading.Lock()
+
+
+def _company_id_por_nombre(db: Session, nombre: str) -> Optional[int]:
+    """Id de la empresa con ese nombre exacto (None si no existe)."""
+    ahora = time.monotonic()
+    with _EMPRESA_ID_LOCK:
+        entrada = _empresa_id_cache.get(nombre)
+    if entrada and entrada[1] > ahora:
+        return entrada[0]
+    fila = db.query(Company.id).filter(Company.nombre == nombre).first()
+    if fila is None:
+        return None
+    with _EMPRESA_ID_LOCK:
+        _empresa_id_cache[nombre] = (fila[0], ahora + TTL_EMPRESA_ID)
+    return fila[0]
+
+
+# ID de archivo en links de Drive: .../file/d/<id>/... o ...?id=<id>&...
+_DRIVE_ID_RE = re.compile(r'(?:/file/d/|[?&]id=)([A-Za-z0-9_-]+)')
+
+
+@lru_cache(maxsize=4096)
+def _extraer_drive_id(link: Optional[str]) -> Optional[str]:
+    """file_id de un link de Drive (None si el link no trae uno)."""
+    m = _DRIVE_ID_RE.search(link or "")
+    return m.group(1) if m else None
+
+
+# Endpoints de PDF: solo drive_link y updated_at del caso. Sentencia construida una vez con
+# bindparam: la clave de cache de SQLAlchemy es estable y el SQL compilado se reutiliza
+_PDF_CASO_POR_SERIAL = select(Case.drive_link, Case.updated_at).where(Case.serial == bindparam("serial"))
+
+
+@lru_cache(maxsize=4096)
+def _etag_pdf(file_id: str, updated_str: str, variante: str = "") -> str:
+    """ETag de un PDF de Drive por versión del caso (blake2b de 16 bytes; variante p. ej. 'preview')."""
+    clave = f"{file_id}:{updated_str}:{variante}" if variante else f"{file_id}:{updated_str}"
+    return hashlib.blake2b(clave.encode(), digest_size=16).hexdigest()
+
+
+# Cliente HTTP asíncrono compartido para descargas públicas de Drive desde endpoints
+# async: no bloquea el event loop y reutiliza conexiones (uc?export=download redirige)
+_drive_http = httpx.AsyncClient(timeout=25.0, follow_redirects=True)
+
+
+async def cerrar_cliente_drive_http():
+    """Cierra el cliente HTTP compartido de Drive (shutdown de la app)."""
+    await _drive_http.aclose()
+
+
+async def _descargar_drive_bytes(url: str, timeout: float = 25.0) -> bytes:
+    """Descarga en streaming (bloques de 1 MB) a memoria, para abrir con fitz.open(stream=...)."""
+    async with _drive_http.stream("GET", url, timeout=timeout) as response:
+        if response.status_code != 200:
+            raise HTTPException(status_code=500, detail="Error descargando PDF")
+        datos = bytearray()
+        async for bloque in response.aiter_bytes(1024 * 1024):
+            datos += bloque
+        return bytes(datos)
+
+
+# Descarga autenticada de Drive por la API REST (alt=media): archivos grandes en rangos paralelos
+_DRIVE_API_ARCHIVO = "https://www.googleapis.com/drive/v3/files/{}"
+_DRIVE_PARTES_PARALELAS = 6
+_DRIVE_MIN_PARALELO = 1024 * 1024  # por debajo de 1 MB, una sola petición
+
+
+async def _descargar_pdf_drive(file_id: str) -> bytes:
+    """
+    Descarga un archivo de Drive sin bloquear el event loop. Desde 1 MB se piden
+    _DRIVE_PARTES_PARALELAS rangos HTTP a la vez y se unen en orden.
+    """
+    from app.drive_uploader import get_drive_access_token
+    token = await asyncio.to_thread(get_drive_access_token)
+    auth = {"Authorization": f"Bearer {token}"}
+    url = _DRIVE_API_ARCHIVO.format(file_id)
+    
+    meta = await _drive_http.get(url, params={"fields": "size", "supportsAllDrives": "true"}, headers=auth)
+    meta.raise_for_status()
+    tamano = int(meta.json().get("size") or 0)
+    
+    media = {"alt": "media", "supportsAllDrives": "true"}
+    if tamano < _DRIVE_MIN_PARALELO:
+        resp = await _drive_http.get(url, params=media, headers=auth)
+        resp.raise_for_status()
+        return resp.content
+    
+    paso = -(-tamano // _DRIVE_PARTES_PARALELAS)
+    
+    async def parte(inicio: int) -> bytes:
+        fin = min(inicio + paso, tamano) - 1
+        resp = await _drive_http.get(url, params=media, headers={**auth, "Range": f"bytes={inicio}-{fin}"})
+        resp.raise_for_status()
+        return resp.content
+    
+    data = b"".join(await asyncio.gather(*(parte(i) for i in range(0, tamano, paso))))
+    if len(data) != tamano:
+        raise ValueError(f"Descarga incompleta de {file_id}: {len(data)}/{tamano} bytes")
+    return data
+
+
+def _patron_contiene(texto: str) -> str:
+    """Patrón ILIKE '%texto%' con los comodines del usuario escapados (usar con escape='\\').
+    En Postgres lo acelera el índice trigram (ver migrar_indices_busqueda)."""
+    texto = texto.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{texto}%"
+
+
 def obtener_emails_empresa_directorio(company_id, db=None):
     """Obtiene emails CC por empresa.
     Orden de prioridad: 1) correos_notificacion area='empresas', 2) Company.email_copia fallback
@@ -148,16 +283,17 @@ def obtener_emails_empresa_directorio(company_id, db=None):
         
         emails = list(emails)
         if emails:
-            print(f"📧 CC empresa → {len(emails)} emails para company_id={company_id}")
-            for f in fuentes:
-                print(f"     {f}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"📧 CC empresa → {len(emails)} emails para company_id={company_id}")
+                for f in fuentes:
+                    logger.debug(f"     {f}")
         else:
-            print(f"⚠️ CC empresa → Sin emails para company_id={company_id}")
-            print(f"     Verifica: correos_notificacion O companies.email_copia")
+            logger.warning(f"⚠️ CC empresa → Sin emails para company_id={company_id}")
+            logger.warning("     Verifica: correos_notificacion O companies.email_copia")
         
         return emails
     except Exception as e:
-        print(f"⚠️ Error obteniendo emails CC empresa: {e}")
+        logger.warning(f"⚠️ Error obteniendo emails CC empresa: {e}")
         return []
     finally:
         if close_db and db:
@@ -166,45 +302,90 @@ def obtener_emails_empresa_directorio(company_id, db=None):
     return emails
 
 
-def enviar_email_con_adjuntos(to_email, subject, html_body, adjuntos_paths=[], caso=None, db=None, whatsapp_message=None):
-    """
-    ✅ Sistema profesional de envío con copias por empresa, empleado Y WhatsApp
-    """
-    import base64
-    
-    # Convertir adjuntos a base64
+_B64_BLOQUE = 57 * 1024  # múltiplo de 3: cada bloque codifica sin relleno intermedio
+
+
+def _b64_archivo(f) -> str:
+    """Base64 del archivo por bloques: nunca se tiene el PDF crudo completo en memoria."""
+    partes = bytearray()
+    while True:
+        bloque = f.read(_B64_BLOQUE)
+        if not bloque:
+            break
+        partes += base64.b64encode(bloque)
+    return partes.decode('ascii')
+
+
+def _adjuntos_a_base64(adjuntos_paths):
+    """Lee y codifica en base64 los PDFs adjuntos (los que no existan se omiten)."""
     adjuntos_base64 = []
     for path in adjuntos_paths:
         if os.path.exists(path):
             try:
                 with open(path, 'rb') as f:
-                    content = base64.b64encode(f.read()).decode('utf-8')
+                    content = _b64_archivo(f)
                     adjuntos_base64.append({
                         'filename': os.path.basename(path),
                         'content': content,
                         'mimetype': 'application/pdf'
                     })
             except Exception as e:
-                print(f"⚠️ Error procesando adjunto {path}: {e}")
+                logger.warning(f"⚠️ Error procesando adjunto {path}: {e}")
+    return adjuntos_base64
+
+
+async def _guardar_adjuntos_temp(adjuntos: List[UploadFile], prefijo: str) -> List[str]:
+    """
+    Copia los UploadFile a archivos temporales en paralelo (un hilo por adjunto) y
+    por bloques con shutil.copyfileobj, sin cargar cada archivo completo en memoria.
+    """
+    def _guardar(adjunto: UploadFile, i: int) -> str:
+        temp_path = os.path.join(tempfile.gettempdir(), f"{prefijo}_{i}_{adjunto.filename}")
+        adjunto.file.seek(0)
+        with open(temp_path, "wb") as f:
+            shutil.copyfileobj(adjunto.file, f, 1024 * 1024)
+        return temp_path
+    
+    return list(await asyncio.gather(
+        *(asyncio.to_thread(_guardar, adjunto, i) for i, adjunto in enumerate(adjuntos))
+    ))
+
+
+# Palabra clave del asunto → tipo de notificación (en orden de prioridad; gana la primera que aparezca)
+_TIPOS_POR_ASUNTO = (
+    ('Confirmación', 'confirmacion'),
+    ('Incompleta', 'incompleta'),
+    ('Ilegible', 'ilegible'),
+    ('Validada', 'completa'),
+    ('EPS', 'eps'),
+    ('TTHH', 'tthh'),
+    ('Extra', 'extra'),
+    ('Recordatorio', 'recordatorio'),
+    ('Seguimiento', 'alerta_jefe'),
+)
+
+
+def _tipo_notificacion_desde_asunto(subject: str) -> str:
+    return next((tipo for clave, tipo in _TIPOS_POR_ASUNTO if clave in subject), 'confirmacion')
+
+
+async def enviar_email_con_adjuntos_async(*args, **kwargs):
+    """
+    enviar_email_con_adjuntos desde endpoints async: la lectura + base64 de los PDFs
+    y el envío corren en un hilo, sin bloquear el event loop mientras tanto.
+    """
+    return await asyncio.to_thread(enviar_email_con_adjuntos, *args, **kwargs)
+
+
+def enviar_email_con_adjuntos(to_email, subject, html_body, adjuntos_paths=[], caso=None, db=None, whatsapp_message=None):
+    """
+    ✅ Sistema profesional de envío con copias por empresa, empleado Y WhatsApp
+    """
+    # Convertir adjuntos a base64
+    adjuntos_base64 = _adjuntos_a_base64(adjuntos_paths)
     
     # Determinar tipo de notificación desde el subject
-    tipo_map = {
-        'Confirmación': 'confirmacion',
-        'Incompleta': 'incompleta',
-        'Ilegible': 'ilegible',
-        'Validada': 'completa',
-        'EPS': 'eps',
-        'TTHH': 'tthh',
-        'Extra': 'extra',
-        'Recordatorio': 'recordatorio',
-        'Seguimiento': 'alerta_jefe'
-    }
-    
-    tipo_notificacion = 'confirmacion'
-    for key, value in tipo_map.items():
-        if key in subject:
-            tipo_notificacion = value
-            break
+    tipo_notificacion = _tipo_notificacion_desde_asunto(subject)
     
     # ✅ OBTENER EMAILS DE COPIA Y TELÉFONO
     # CC empresa ahora viene del DIRECTORIO (correos_notificacion area='empresas')
@@ -214,27 +395,27 @@ def enviar_email_con_adjuntos(to_email, subject, html_body, adjuntos_paths=[], c
     
     if caso:
         # ✅ CC EMPRESA: Desde el DIRECTORIO (ya no usa Company.email_copia)
-        if hasattr(caso, 'company_id') and caso.company_id:
-            emails_dir = obtener_emails_empresa_directorio(caso.company_id)
+        company_id = getattr(caso, 'company_id', None)
+        if company_id:
+            emails_dir = obtener_emails_empresa_directorio(company_id)
             if emails_dir:
                 cc_empresa = ",".join(emails_dir)
-                print(f"📧 CC empresa (directorio): {cc_empresa}")
+                logger.debug(f"📧 CC empresa (directorio): {cc_empresa}")
         
         # ✅ CC EMPLEADO: Correo del empleado en BD (se mantiene)
-        if hasattr(caso, 'empleado') and caso.empleado:
-            if hasattr(caso.empleado, 'correo') and caso.empleado.correo:
-                correo_bd = caso.empleado.correo
-                print(f"📧 CC empleado BD: {correo_bd}")
+        correo_bd = getattr(getattr(caso, 'empleado', None), 'correo', None) or None
+        if correo_bd:
+            logger.debug(f"📧 CC empleado BD: {correo_bd}")
         
-        if hasattr(caso, 'telefono_form') and caso.telefono_form:
-            whatsapp = caso.telefono_form
-            print(f"📱 WhatsApp: {whatsapp}")
+        whatsapp = getattr(caso, 'telefono_form', None) or None
+        if whatsapp:
+            logger.debug(f"📱 WhatsApp: {whatsapp}")
     
     # ✅ Si no se pasó mensaje WhatsApp explícito, se usa el mensaje recibido por parámetro
     # (whatsapp_message ya viene del parámetro de la función)
     
     # Obtener drive_link si hay caso
-    drive_link = caso.drive_link if caso and hasattr(caso, 'drive_link') else None
+    drive_link = getattr(caso, 'drive_link', None) if caso else None
     
     # Enviar notificación
     resultado = enviar_notificacion(
@@ -252,9 +433,9 @@ def enviar_email_con_adjuntos(to_email, subject, html_body, adjuntos_paths=[], c
     )
     
     if resultado:
-        print(f"✅ Email enviado: TO={to_email}, CC_EMPRESA={cc_empresa or 'N/A'}, CC_BD={correo_bd or 'N/A'}")
+        logger.info(f"✅ Email enviado: TO={to_email}, CC_EMPRESA={cc_empresa or 'N/A'}, CC_BD={correo_bd or 'N/A'}")
     else:
-        print(f"❌ Error enviando email")
+        logger.error("❌ Error enviando email")
     
     return resultado
 
@@ -263,97 +444,8 @@ def send_html_email(to_email, subject, html_body, caso=None):
     """✅ Wrapper sin adjuntos"""
     return enviar_email_con_adjuntos(to_email, subject, html_body, [], caso=caso)
 
-def enviar_email_con_adjuntos_temp(to_email, subject, html_body, adjuntos_paths=[], caso=None, db=None):
-    """
-    ✅ Sistema profesional de envío con copias por empresa, empleado Y WhatsApp
-    """
-    import base64
-    
-    # Convertir adjuntos a base64
-    adjuntos_base64 = []
-    for path in adjuntos_paths:
-        if os.path.exists(path):
-            try:
-                with open(path, 'rb') as f:
-                    content = base64.b64encode(f.read()).decode('utf-8')
-                    adjuntos_base64.append({
-                        'filename': os.path.basename(path),
-                        'content': content,
-                        'mimetype': 'application/pdf'
-                    })
-            except Exception as e:
-                print(f"⚠️ Error procesando adjunto {path}: {e}")
-    
-    # Determinar tipo de notificación desde el subject
-    tipo_map = {
-        'Confirmación': 'confirmacion',
-        'Incompleta': 'incompleta',
-        'Ilegible': 'ilegible',
-        'Validada': 'completa',
-        'EPS': 'eps',
-        'TTHH': 'tthh',
-        'Extra': 'extra',
-        'Recordatorio': 'recordatorio',
-        'Seguimiento': 'alerta_jefe'
-    }
-    
-    tipo_notificacion = 'confirmacion'
-    for key, value in tipo_map.items():
-        if key in subject:
-            tipo_notificacion = value
-            break
-    
-    # ✅ OBTENER EMAILS DE COPIA Y TELÉFONO
-    # CC empresa ahora viene del DIRECTORIO (correos_notificacion area='empresas')
-    cc_empresa = None
-    correo_bd = None
-    whatsapp = None
-    
-    if caso:
-        # ✅ CC EMPRESA: Desde el DIRECTORIO (ya no usa Company.email_copia)
-        if hasattr(caso, 'company_id') and caso.company_id:
-            emails_dir = obtener_emails_empresa_directorio(caso.company_id)
-            if emails_dir:
-                cc_empresa = ",".join(emails_dir)
-                print(f"📧 CC empresa (directorio): {cc_empresa}")
-        
-        # ✅ CC EMPLEADO: Correo del empleado en BD (se mantiene)
-        if hasattr(caso, 'empleado') and caso.empleado:
-            if hasattr(caso.empleado, 'correo') and caso.empleado.correo:
-                correo_bd = caso.empleado.correo
-                print(f"📧 CC empleado BD: {correo_bd}")
-        
-        if hasattr(caso, 'telefono_form') and caso.telefono_form:
-            whatsapp = caso.telefono_form
-            print(f"📱 WhatsApp: {whatsapp}")
-    
-    # ✅ El mensaje WhatsApp se genera automáticamente
-    whatsapp_message = None
-    
-    # Obtener drive_link si hay caso
-    drive_link = caso.drive_link if caso and hasattr(caso, 'drive_link') else None
-    
-    # Enviar notificación
-    resultado = enviar_notificacion(
-        tipo_notificacion=tipo_notificacion,
-        email=to_email,
-        serial=caso.serial if caso else 'N/A',
-        subject=subject,
-        html_content=html_body,
-        cc_email=cc_empresa,
-        correo_bd=correo_bd,
-        whatsapp=whatsapp,
-        whatsapp_message=whatsapp_message,
-        adjuntos_base64=adjuntos_base64,
-        drive_link=drive_link
-    )
-    
-    if resultado:
-        print(f"✅ Email enviado: TO={to_email}, CC_EMPRESA={cc_empresa or 'N/A'}, CC_BD={correo_bd or 'N/A'}")
-    else:
-        print(f"❌ Error enviando email")
-    
-    return resultado
+# Alias por compatibilidad (era una copia idéntica; whatsapp_message queda en None por defecto)
+enviar_email_con_adjuntos_temp = enviar_email_con_adjuntos
 
 
 def obtener_emails_presunto_fraude(empresa_nombre, db=None):
@@ -453,7 +545,7 @@ async def configurar_email_copia(
 
 
 @router.get("/empresas")
-async def listar_empresas(
+def listar_empresas(
     request: Request,
     db: Session = Depends(get_db),
     _: bool = Depends(verificar_token_admin)
@@ -475,8 +567,8 @@ async def listar_empresas(
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.get("/casos")
-async def listar_casos(
+@router.get("/casos", response_class=ORJSONResponse)
+def listar_casos(
     request: Request,
     empresa: Optional[str] = None,
     estado: Optional[str] = None,
@@ -499,16 +591,25 @@ async def listar_casos(
     - Casos históricos = sin PDF, solo registros base de datos para control quincenal
     """
     
-    query = db.query(Case)
+    # Solo las columnas que se devuelven (tuplas, sin instancias ORM); empleado y empresa
+    # por LEFT JOIN en el mismo SELECT
+    query = db.query(
+        Case.id, Case.serial, Case.cedula, Case.tipo, Case.estado, Case.created_at,
+        Case.bloquea_nueva, Case.telefono_form, Case.email_form, Case.dias_incapacidad,
+        Case.eps, Case.fecha_inicio, Case.fecha_fin, Case.metadata_form,
+        Case.recordatorios_count, Case.drive_link,
+        Employee.nombre.label("empleado_nombre"),
+        Company.nombre.label("empresa_nombre"),
+    ).outerjoin(Employee, Case.employee_id == Employee.id).outerjoin(Company, Case.company_id == Company.id)
     
     # ✅ FILTRO HISTÓRICO - Excluir casos históricos por defecto
     if not incluir_historicos:
         query = query.filter(Case.es_historico == False)
     
     if empresa and empresa != "all" and empresa != "undefined":
-        company = db.query(Company).filter(Company.nombre == empresa).first()
-        if company:
-            query = query.filter(Case.company_id == company.id)
+        company_id = _company_id_por_nombre(db, empresa)
+        if company_id:
+            query = query.filter(Case.company_id == company_id)
     
     if estado and estado != "all" and estado != "undefined":
         try:
@@ -530,12 +631,13 @@ async def listar_casos(
             min_dias = int(dias_match.group(1))
             query = query.filter(Case.dias_incapacidad >= min_dias)
         else:
-            query = query.join(Employee, Case.employee_id == Employee.id, isouter=True)
+            # Employee ya está en el LEFT JOIN de la consulta base
+            patron = _patron_contiene(q)
             query = query.filter(
                 or_(
-                    Case.serial.ilike(f"%{q}%"),
-                    Case.cedula.ilike(f"%{q}%"),
-                    Employee.nombre.ilike(f"%{q}%")
+                    Case.serial.ilike(patron, escape="\\"),
+                    Case.cedula.ilike(patron, escape="\\"),
+                    Employee.nombre.ilike(patron, escape="\\")
                 )
             )
     
@@ -546,9 +648,6 @@ async def listar_casos(
     
     items = []
     for caso in casos:
-        empleado = caso.empleado if caso.empleado else None
-        empresa_obj = caso.empresa if caso.empresa else None
-        
         # Contar reenvíos desde metadata_form
         total_reenvios = 0
         if caso.metadata_form and isinstance(caso.metadata_form, dict):
@@ -560,34 +659,36 @@ async def listar_casos(
             "id": caso.id,
             "serial": caso.serial,
             "cedula": caso.cedula,
-            "nombre": empleado.nombre if empleado else "No registrado",
-            "empresa": empresa_obj.nombre if empresa_obj else "Otra empresa",
-            "tipo": caso.tipo.value if caso.tipo else None,
-            "estado": caso.estado.value,
-            "created_at": caso.created_at.isoformat(),
+            "nombre": caso.empleado_nombre if caso.empleado_nombre is not None else "No registrado",
+            "empresa": caso.empresa_nombre if caso.empresa_nombre is not None else "Otra empresa",
+            # Enums y fechas van crudos: orjson emite el .value y el ISO 8601 (igual que isoformat())
+            "tipo": caso.tipo,
+            "estado": caso.estado,
+            "created_at": caso.created_at,
             "bloquea_nueva": caso.bloquea_nueva,
             "telefono_form": caso.telefono_form,
             "email_form": caso.email_form,
             "dias_incapacidad": caso.dias_incapacidad,
             "eps": caso.eps,
-            "fecha_inicio": caso.fecha_inicio.isoformat() if caso.fecha_inicio else None,
-            "fecha_fin": caso.fecha_fin.isoformat() if caso.fecha_fin else None,
+            "fecha_inicio": caso.fecha_inicio,
+            "fecha_fin": caso.fecha_fin,
             "total_reenvios": total_reenvios,
             "recordatorios_count": caso.recordatorios_count or 0,
             "fraude_confirmado": bool(caso.metadata_form.get('fraude_confirmado')) if caso.metadata_form and isinstance(caso.metadata_form, dict) else False,
             "drive_link": caso.drive_link,
         })
     
-    return {
+    # orjson serializa directo (sin pasar por jsonable_encoder ni json.dumps)
+    return ORJSONResponse({
         "items": items,
         "total": total,
         "page": page,
         "page_size": page_size,
         "total_pages": (total + page_size - 1) // page_size
-    }
+    })
 
 @router.get("/casos/tabla-viva")
-async def obtener_tabla_viva(
+def obtener_tabla_viva(
     request: Request,
     empresa: Optional[str] = None,
     periodo: Optional[str] = None,
@@ -625,9 +726,9 @@ async def obtener_tabla_viva(
     
     # Filtro por empresa
     if empresa and empresa != "all" and empresa != "undefined":
-        company = db.query(Company).filter(Company.nombre == empresa).first()
-        if company:
-            query = query.filter(Case.company_id == company.id)
+        company_id = _company_id_por_nombre(db, empresa)
+        if company_id:
+            query = query.filter(Case.company_id == company_id)
     
     # Total de casos actuales
     total = query.count()
@@ -651,22 +752,26 @@ async def obtener_tabla_viva(
     }
 
 @router.get("/casos/{serial}")
-async def detalle_caso(
+def detalle_caso(
     serial: str,
     db: Session = Depends(get_db),
     _: bool = Depends(verificar_token_admin)
 ):
     """Obtiene el detalle completo de un caso"""
     
-    caso = db.query(Case).filter(Case.serial == serial).first()
+    # Empleado/empresa por JOIN; documentos, eventos y notas por selectinload (sin producto cartesiano)
+    caso = db.query(Case).options(
+        joinedload(Case.empleado), joinedload(Case.empresa),
+        selectinload(Case.documentos), selectinload(Case.eventos), selectinload(Case.notas)
+    ).filter(Case.serial == serial).first()
     if not caso:
         raise HTTPException(status_code=404, detail="Caso no encontrado")
     
     empleado = caso.empleado
     empresa = caso.empresa
     documentos = caso.documentos
-    eventos = db.query(CaseEvent).filter(CaseEvent.case_id == caso.id).order_by(CaseEvent.created_at.desc()).all()
-    notas = db.query(CaseNote).filter(CaseNote.case_id == caso.id).order_by(CaseNote.created_at.desc()).all()
+    eventos = sorted(caso.eventos, key=lambda ev: ev.created_at, reverse=True)
+    notas = sorted(caso.notas, key=lambda nota: nota.created_at, reverse=True)
     
     return {
         "serial": caso.serial,
@@ -1035,7 +1140,7 @@ async def estado_cola_notificaciones(
 
 
 @router.get("/notificaciones/{serial}/historial")
-async def historial_notificaciones(
+def historial_notificaciones(
     serial: str,
     _: bool = Depends(verificar_token_admin)
 ):
@@ -1171,7 +1276,7 @@ async def desmarcar_caso_procesado(
     }
 
 @router.get("/casos/sin-procesar")
-async def listar_casos_sin_procesar(
+def listar_casos_sin_procesar(
     empresa: Optional[str] = None,
     page: int = 1,
     page_size: int = 50,
@@ -1185,9 +1290,9 @@ async def listar_casos_sin_procesar(
     query = db.query(Case).filter(Case.procesado == False)
     
     if empresa and empresa != "all" and empresa != "undefined":
-        company = db.query(Company).filter(Company.nombre == empresa).first()
-        if company:
-            query = query.filter(Case.company_id == company.id)
+        company_id = _company_id_por_nombre(db, empresa)
+        if company_id:
+            query = query.filter(Case.company_id == company_id)
     
     total = query.count()
     offset = (page - 1) * page_size
@@ -1238,7 +1343,7 @@ async def agregar_nota(
     }
 
 @router.get("/stats")
-async def obtener_estadisticas(
+def obtener_estadisticas(
     request: Request,
     empresa: Optional[str] = None,
     db: Session = Depends(get_db),
@@ -1254,35 +1359,32 @@ async def obtener_estadisticas(
     - Excluye los 20,686+ registros históricos sin PDF
     """
     
-    query = db.query(Case).filter(Case.es_historico == False)  # ✅ Solo casos actuales
+    # Conteo por estado en UNA consulta (GROUP BY) en vez de un COUNT por estado
+    query = db.query(Case.estado, func.count(Case.id)).filter(Case.es_historico == False)  # ✅ Solo casos actuales
     
     if empresa and empresa != "all" and empresa != "undefined":
-        company = db.query(Company).filter(Company.nombre == empresa).first()
-        if company:
-            query = query.filter(Case.company_id == company.id)
+        company_id = _company_id_por_nombre(db, empresa)
+        if company_id:
+            query = query.filter(Case.company_id == company_id)
+    
+    por_estado = dict(query.group_by(Case.estado).all())
     
     stats = {
-        "total_casos": query.count(),
-        "incompletas": query.filter(Case.estado == EstadoCaso.INCOMPLETA).count(),
-        "eps": query.filter(Case.estado == EstadoCaso.EPS_TRANSCRIPCION).count(),
-        "posible_fraude": query.filter(Case.estado == EstadoCaso.DERIVADO_TTHH).count(),
-        "completas": query.filter(Case.estado == EstadoCaso.COMPLETA).count(),
-        "nuevos": query.filter(Case.estado == EstadoCaso.NUEVO).count(),
-        "causa_extra": query.filter(Case.estado == EstadoCaso.CAUSA_EXTRA).count(),
+        "total_casos": sum(por_estado.values()),
+        "incompletas": por_estado.get(EstadoCaso.INCOMPLETA, 0),
+        "eps": por_estado.get(EstadoCaso.EPS_TRANSCRIPCION, 0),
+        "posible_fraude": por_estado.get(EstadoCaso.DERIVADO_TTHH, 0),
+        "completas": por_estado.get(EstadoCaso.COMPLETA, 0),
+        "nuevos": por_estado.get(EstadoCaso.NUEVO, 0),
+        "causa_extra": por_estado.get(EstadoCaso.CAUSA_EXTRA, 0),
     }
     
     return stats
 
-@router.get("/reglas/requisitos")
-async def obtener_requisitos_documentos(
-    tipo: str,
-    dias: Optional[int] = None,
-    vehiculo_fantasma: Optional[bool] = None,
-    madre_trabaja: Optional[bool] = None,
-    es_prorroga: bool = False,
-    db: Session = Depends(get_db)
-):
-    """Motor de reglas dinámico: calcula documentos requeridos según contexto"""
+@lru_cache(maxsize=64)
+def _reglas_requisitos(tipo: str, tres_dias_o_mas: bool, vehiculo_fantasma: bool, madre_trabaja: bool) -> tuple:
+    """Reglas de documentos requeridos (función pura del contexto, memorizada).
+    Devuelve tuplas inmutables para que nadie altere el resultado cacheado."""
     
     documentos_requeridos = []
     mensajes = []
@@ -1290,7 +1392,7 @@ async def obtener_requisitos_documentos(
     if tipo == "enfermedad_general":
         documentos_requeridos.append({"doc": "incapacidad_medica", "requerido": True, "aplica": True})
         
-        if dias and dias >= 3:
+        if tres_dias_o_mas:
             documentos_requeridos.append({"doc": "epicrisis_o_resumen_clinico", "requerido": True, "aplica": True})
             mensajes.append("Enfermedad general ≥3 días requiere epicrisis o resumen clínico")
         else:
@@ -1299,7 +1401,7 @@ async def obtener_requisitos_documentos(
     elif tipo == "enfermedad_laboral":
         documentos_requeridos.append({"doc": "incapacidad_medica", "requerido": True, "aplica": True})
         
-        if dias and dias >= 3:
+        if tres_dias_o_mas:
             documentos_requeridos.append({"doc": "epicrisis_o_resumen_clinico", "requerido": True, "aplica": True})
             mensajes.append("Enfermedad laboral ≥3 días requiere epicrisis o resumen clínico")
     
@@ -1343,13 +1445,68 @@ async def obtener_requisitos_documentos(
             documentos_requeridos.append({"doc": "licencia_maternidad", "requerido": False, "aplica": False})
             mensajes.append("Madre no trabaja: licencia de maternidad no requerida")
     
+    return (
+        tuple(tuple(d.items()) for d in documentos_requeridos),
+        tuple(mensajes),
+    )
+
+@router.get("/reglas/requisitos")
+async def obtener_requisitos_documentos(
+    tipo: str,
+    dias: Optional[int] = None,
+    vehiculo_fantasma: Optional[bool] = None,
+    madre_trabaja: Optional[bool] = None,
+    es_prorroga: bool = False,
+):
+    """Motor de reglas dinámico: calcula documentos requeridos según contexto"""
+    
+    documentos, mensajes = _reglas_requisitos(
+        tipo, bool(dias and dias >= 3), bool(vehiculo_fantasma), bool(madre_trabaja)
+    )
+    
     return {
-        "documentos": documentos_requeridos,
-        "mensajes": mensajes
+        "documentos": [dict(d) for d in documentos],
+        "mensajes": list(mensajes)
     }
 
+def _consulta_registro_relacional(query, registro: BusquedaRelacional):
+    """Aplica los filtros de un registro de búsqueda relacional (ruta fila a fila)."""
+    if registro.cedula:
+        query = query.filter(Case.cedula == registro.cedula)
+    
+    if registro.serial:
+        query = query.filter(Case.serial == registro.serial)
+    
+    if registro.nombre:
+        query = query.filter(Employee.nombre.ilike(_patron_contiene(registro.nombre), escape="\\"))
+    
+    if registro.tipo_incapacidad:
+        query = query.filter(Case.tipo == registro.tipo_incapacidad)
+    
+    if registro.eps:
+        query = query.filter(Case.eps.ilike(_patron_contiene(registro.eps), escape="\\"))
+    
+    if registro.fecha_inicio and registro.fecha_fin:
+        fecha_inicio_dt = datetime.fromisoformat(registro.fecha_inicio)
+        fecha_fin_dt = datetime.fromisoformat(registro.fecha_fin)
+        query = query.filter(
+            and_(
+                Case.fecha_inicio >= fecha_inicio_dt,
+                Case.fecha_fin <= fecha_fin_dt
+            )
+        )
+    elif registro.fecha_inicio:
+        fecha_inicio_dt = datetime.fromisoformat(registro.fecha_inicio)
+        query = query.filter(Case.fecha_inicio >= fecha_inicio_dt)
+    elif registro.fecha_fin:
+        fecha_fin_dt = datetime.fromisoformat(registro.fecha_fin)
+        query = query.filter(Case.fecha_fin <= fecha_fin_dt)
+    
+    return query.all()
+
+
 @router.post("/busqueda-relacional")
-async def busqueda_relacional(
+def busqueda_relacional(
     request: BusquedaRelacionalRequest,
     db: Session = Depends(get_db),
     _: bool = Depends(verificar_token_admin)
@@ -1366,55 +1523,51 @@ async def busqueda_relacional(
     resultados = []
     filtros_globales = request.filtros_globales or {}
     
-    for registro in request.registros:
-        query = db.query(Case).join(Employee, Case.employee_id == Employee.id, isouter=True)
-        
-        if registro.cedula:
-            query = query.filter(Case.cedula == registro.cedula)
-        
-        if registro.serial:
-            query = query.filter(Case.serial == registro.serial)
-        
-        if registro.nombre:
-            query = query.filter(Employee.nombre.ilike(f"%{registro.nombre}%"))
-        
-        if registro.tipo_incapacidad:
-            query = query.filter(Case.tipo == registro.tipo_incapacidad)
-        
-        if registro.eps:
-            query = query.filter(Case.eps.ilike(f"%{registro.eps}%"))
-        
-        if registro.fecha_inicio and registro.fecha_fin:
-            fecha_inicio_dt = datetime.fromisoformat(registro.fecha_inicio)
-            fecha_fin_dt = datetime.fromisoformat(registro.fecha_fin)
-            query = query.filter(
-                and_(
-                    Case.fecha_inicio >= fecha_inicio_dt,
-                    Case.fecha_fin <= fecha_fin_dt
-                )
-            )
-        elif registro.fecha_inicio:
-            fecha_inicio_dt = datetime.fromisoformat(registro.fecha_inicio)
-            query = query.filter(Case.fecha_inicio >= fecha_inicio_dt)
-        elif registro.fecha_fin:
-            fecha_fin_dt = datetime.fromisoformat(registro.fecha_fin)
-            query = query.filter(Case.fecha_fin <= fecha_fin_dt)
+    def consulta_base():
+        query = db.query(Case).join(Employee, Case.employee_id == Employee.id, isouter=True).options(
+            joinedload(Case.empleado), joinedload(Case.empresa), selectinload(Case.documentos)
+        )
         
         if filtros_globales.get("empresa"):
-            company = db.query(Company).filter(Company.nombre == filtros_globales["empresa"]).first()
-            if company:
-                query = query.filter(Case.company_id == company.id)
+            company_id = _company_id_por_nombre(db, filtros_globales["empresa"])
+            if company_id:
+                query = query.filter(Case.company_id == company_id)
         
         if filtros_globales.get("tipo_documento"):
             tipos_docs = filtros_globales["tipo_documento"]
             query = query.join(CaseDocument).filter(CaseDocument.doc_tipo.in_(tipos_docs))
         
-        casos = query.all()
+        return query
+    
+    # ⚡ Registros que solo traen cédula o solo serial (lo normal en un Excel): una sola
+    # consulta con IN para todos, en vez de una por fila
+    def es_simple(registro):
+        return (bool(registro.cedula) != bool(registro.serial)) and not (
+            registro.nombre or registro.tipo_incapacidad or registro.eps
+            or registro.fecha_inicio or registro.fecha_fin
+        )
+    
+    cedulas = {r.cedula for r in request.registros if es_simple(r) and r.cedula}
+    seriales = {r.serial for r in request.registros if es_simple(r) and r.serial}
+    por_cedula: Dict[str, list] = {}
+    por_serial: Dict[str, list] = {}
+    if cedulas or seriales:
+        for caso in consulta_base().filter(or_(Case.cedula.in_(cedulas), Case.serial.in_(seriales))).all():
+            if caso.cedula in cedulas:
+                por_cedula.setdefault(caso.cedula, []).append(caso)
+            if caso.serial in seriales:
+                por_serial.setdefault(caso.serial, []).append(caso)
+    
+    for registro in request.registros:
+        if es_simple(registro):
+            casos = por_cedula.get(registro.cedula, []) if registro.cedula else por_serial.get(registro.serial, [])
+        else:
+            casos = _consulta_registro_relacional(consulta_base(), registro)
         
         for caso in casos:
             empleado = caso.empleado
             empresa = caso.empresa
-            documentos = db.query(CaseDocument).filter(CaseDocument.case_id == caso.id).all()
+            documentos = caso.documentos  # precargados con selectinload (un SELECT para todos)
             
             resultados.append({
                 "cedula": caso.cedula,
@@ -1454,6 +1607,45 @@ async def busqueda_relacional(
         "registros_buscados": len(request.registros)
     }
 
+# Campo de BusquedaRelacional → encabezados aceptados en el Excel/CSV (en minúsculas)
+_COLUMNAS_BUSQUEDA_EXCEL = {
+    "cedula": ["cedula", "cc", "identificacion", "documento"],
+    "serial": ["serial", "numero", "consecutivo", "id"],
+    "nombre": ["nombre", "trabajador", "empleado", "persona"],
+    "tipo_incapacidad": ["tipo", "tipo_incapacidad", "causa", "categoria"],
+    "eps": ["eps", "entidad", "salud", "aseguradora"],
+    "fecha_inicio": ["fecha_inicio", "fecha inicio", "inicio", "desde"],
+    "fecha_fin": ["fecha_fin", "fecha fin", "fin", "hasta"]
+}
+
+
+def _leer_xlsx_busqueda(contents: bytes) -> pd.DataFrame:
+    """
+    Lee un .xlsx en streaming (openpyxl read_only) conservando solo las columnas cuyo
+    encabezado reconoce la búsqueda relacional; el resto de celdas se descarta al vuelo.
+    Omite filas sin ningún valor en esas columnas (un registro vacío traería todos los casos).
+    """
+    aceptados = {n for nombres in _COLUMNAS_BUSQUEDA_EXCEL.values() for n in nombres}
+    wb = openpyxl.load_workbook(io.BytesIO(contents), read_only=True, data_only=True)
+    try:
+        filas = wb.active.iter_rows(values_only=True)
+        indices = {}  # encabezado → posición (primera aparición)
+        for i, col in enumerate(next(filas, ())):
+            if col is not None and str(col).lower().strip() in aceptados:
+                indices.setdefault(col, i)
+        
+        columnas = {col: [] for col in indices}
+        for fila in filas:
+            valores = [fila[i] if i < len(fila) else None for i in indices.values()]
+            if all(v is None for v in valores):
+                continue
+            for lista, valor in zip(columnas.values(), valores):
+                lista.append(valor)
+        return pd.DataFrame(columnas)
+    finally:
+        wb.close()
+
+
 @router.post("/busqueda-relacional/excel")
 async def busqueda_relacional_desde_excel(
     archivo: UploadFile = File(...),
@@ -1465,7 +1657,9 @@ async def busqueda_relacional_desde_excel(
     contents = await archivo.read()
     
     try:
-        if archivo.filename.endswith(('.xlsx', '.xls')):
+        if archivo.filename.endswith('.xlsx'):
+            df = _leer_xlsx_busqueda(contents)
+        elif archivo.filename.endswith('.xls'):
             df = pd.read_excel(io.BytesIO(contents))
         elif archivo.filename.endswith('.csv'):
             df = pd.read_csv(io.BytesIO(contents))
@@ -1474,60 +1668,39 @@ async def busqueda_relacional_desde_excel(
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error leyendo archivo: {str(e)}")
     
-    columnas_map = {
-        "cedula": ["cedula", "cc", "identificacion", "documento"],
-        "serial": ["serial", "numero", "consecutivo", "id"],
-        "nombre": ["nombre", "trabajador", "empleado", "persona"],
-        "tipo_incapacidad": ["tipo", "tipo_incapacidad", "causa", "categoria"],
-        "eps": ["eps", "entidad", "salud", "aseguradora"],
-        "fecha_inicio": ["fecha_inicio", "fecha inicio", "inicio", "desde"],
-        "fecha_fin": ["fecha_fin", "fecha fin", "fin", "hasta"]
-    }
+    # Encabezados normalizados una sola vez (primera aparición gana); luego búsqueda por hash
+    encabezados = {}
+    for col_df in df.columns:
+        encabezados.setdefault(str(col_df).lower().strip(), col_df)
     
     columnas_detectadas = {}
-    for col_objetivo, posibles_nombres in columnas_map.items():
-        for col_df in df.columns:
-            if col_df.lower().strip() in posibles_nombres:
-                columnas_detectadas[col_objetivo] = col_df
-                break
+    for col_objetivo, posibles_nombres in _COLUMNAS_BUSQUEDA_EXCEL.items():
+        col_df = next((encabezados[n] for n in posibles_nombres if n in encabezados), None)
+        if col_df is not None:
+            columnas_detectadas[col_objetivo] = col_df
+    
+    # Conversión por columnas (vectorizada) en vez de iterrows + pd.notna por celda
+    datos = pd.DataFrame(index=df.index)
+    for campo, col_df in columnas_detectadas.items():
+        serie = df[col_df]
+        if campo in ("fecha_inicio", "fecha_fin"):
+            # format="mixed": cada celda se interpreta por separado, como antes fila a fila
+            serie = pd.to_datetime(serie, errors="coerce", format="mixed").dt.strftime("%Y-%m-%d")
+        else:
+            serie = serie.astype(str).where(serie.notna())
+        datos[campo] = serie
     
-    registros = []
-    for _, row in df.iterrows():
-        registro = BusquedaRelacional()
-        
-        if "cedula" in columnas_detectadas:
-            registro.cedula = str(row[columnas_detectadas["cedula"]]) if pd.notna(row[columnas_detectadas["cedula"]]) else None
-        
-        if "serial" in columnas_detectadas:
-            registro.serial = str(row[columnas_detectadas["serial"]]) if pd.notna(row[columnas_detectadas["serial"]]) else None
-        
-        if "nombre" in columnas_detectadas:
-            registro.nombre = str(row[columnas_detectadas["nombre"]]) if pd.notna(row[columnas_detectadas["nombre"]]) else None
-        
-        if "tipo_incapacidad" in columnas_detectadas:
-            registro.tipo_incapacidad = str(row[columnas_detectadas["tipo_incapacidad"]]) if pd.notna(row[columnas_detectadas["tipo_incapacidad"]]) else None
-        
-        if "eps" in columnas_detectadas:
-            registro.eps = str(row[columnas_detectadas["eps"]]) if pd.notna(row[columnas_detectadas["eps"]]) else None
-        
-        if "fecha_inicio" in columnas_detectadas:
-            try:
-                fecha = pd.to_datetime(row[columnas_detectadas["fecha_inicio"]])
-                registro.fecha_inicio = fecha.strftime("%Y-%m-%d")
-            except:
-                registro.fecha_inicio = None
-        
-        if "fecha_fin" in columnas_detectadas:
-            try:
-                fecha = pd.to_datetime(row[columnas_detectadas["fecha_fin"]])
-                registro.fecha_fin = fecha.strftime("%Y-%m-%d")
-            except:
-                registro.fecha_fin = None
-        
-        registros.append(registro)
+    registros = [
+        BusquedaRelacional(**r)
+        for r in datos.astype(object).where(datos.notna(), None).to_dict(orient="records")
+    ]
     
     request = BusquedaRelacionalRequest(registros=registros)
     
+    # busqueda_relacional es síncrona (Session bloqueante): se corre fuera del event loop
+    resultados_response = await asyncio.to_thread(busqueda_relacional, request, db, True)
+    
+    # Historial con el conteo final: un solo INSERT/commit (antes INSERT + UPDATE)
     historial = SearchHistory(
         usuario="Validador",
         tipo_busqueda="relacional_excel",
@@ -1536,17 +1709,12 @@ async def busqueda_relacional_desde_excel(
             "columnas_detectadas": list(columnas_detectadas.keys()),
             "total_filas": len(registros)
         },
-        resultados_count=0,
+        resultados_count=resultados_response["total_encontrados"],
         archivo_nombre=archivo.filename
     )
     db.add(historial)
     db.commit()
     
-    resultados_response = await busqueda_relacional(request, db, True)
-    
-    historial.resultados_count = resultados_response["total_encontrados"]
-    db.commit()
-    
     return {
         **resultados_response,
         "archivo_procesado": archivo.filename,
@@ -1554,8 +1722,18 @@ async def busqueda_relacional_desde_excel(
         "filas_procesadas": len(registros)
     }
 
+# Columnas de /exportar/casos (mismo orden que las tuplas de filas_export)
+_COLUMNAS_EXPORTACION_CASOS = (
+    "SERIAL", "CEDULA", "NOMBRE", "EMPRESA", "TIPO", "DIAS", "ESTADO", "EPS",
+    "FECHA INICIO", "FECHA FIN", "CODIGO CIE10", "DIAGNOSTICO", "ES PRORROGA", "LINK DRIVE",
+    "FECHA ADJUNTADO", "DIA ADJUNTADO", "HORA ADJUNTADO", "PROCESADO", "FECHA PROCESADO",
+    "USUARIO PROCESADO",
+)
+_DIAS_SEMANA = ("Lunes", "Martes", "Miércoles", "Jueves", "Viernes", "Sábado", "Domingo")
+
+
 @router.get("/exportar/casos")
-async def exportar_casos(
+def exportar_casos(
     formato: str = "xlsx",
     empresa: Optional[str] = None,
     estado: Optional[str] = None,
@@ -1574,26 +1752,29 @@ async def exportar_casos(
     - Usar incluir_historicos=true para exportar también históricos
     """
     
-    query = db.query(Case).join(Employee, Case.employee_id == Employee.id, isouter=True)
+    # Empleado y empresa por LEFT JOIN (muchos-a-uno: no multiplica filas)
+    query = db.query(Case).outerjoin(Employee, Case.employee_id == Employee.id).outerjoin(
+        Company, Case.company_id == Company.id
+    )
     
     # Filtrar históricos por defecto
     if not incluir_historicos:
         query = query.filter(Case.es_historico == False)
     
     if empresa and empresa != "all":
-        company = db.query(Company).filter(Company.nombre == empresa).first()
-        if company:
-            query = query.filter(Case.company_id == company.id)
+        company_id = _company_id_por_nombre(db, empresa)
+        if company_id:
+            query = query.filter(Case.company_id == company_id)
     
     if estado and estado != "all":
         query = query.filter(Case.estado == estado)
     
     if q and q.strip():
-        busqueda = f"%{q.strip()}%"
+        busqueda = _patron_contiene(q.strip())
         query = query.filter(
-            (Case.serial.ilike(busqueda)) |
-            (Case.cedula.ilike(busqueda)) |
-            (Employee.nombre.ilike(busqueda))
+            (Case.serial.ilike(busqueda, escape="\\")) |
+            (Case.cedula.ilike(busqueda, escape="\\")) |
+            (Employee.nombre.ilike(busqueda, escape="\\"))
         )
     
     if desde:
@@ -1610,10 +1791,11 @@ async def exportar_casos(
         except ValueError:
             pass
     
-    casos = query.all()
-    
-    # Detectar prórrogas reales por análisis de cadenas (no solo BD)
-    cedulas_unicas = list(set(c.cedula for c in casos if c.cedula))
+    # Detectar prórrogas reales por análisis de cadenas (no solo BD).
+    # Las cédulas salen de un DISTINCT liviano; los casos se recorren luego en streaming.
+    cedulas_unicas = [
+        ced for (ced,) in query.with_entities(Case.cedula).filter(Case.cedula.isnot(None)).distinct()
+    ]
     seriales_prorroga = set()
     for ced in cedulas_unicas:
         try:
@@ -1625,64 +1807,100 @@ async def exportar_casos(
         except Exception:
             pass
     
-    data = []
-    for caso in casos:
-        empleado = caso.empleado
-        empresa_obj = caso.empresa
-        
-        # Extraer estado (reemplazar DERIVADO_TTHH con ES POSIBLE FRAUDE)
-        estado_val = caso.estado.value if caso.estado else None
-        if estado_val in ["DERIVADO_TTHH", "TTHH"]:
-            estado_val = "ES POSIBLE FRAUDE - En espera de respuesta de EPS"
-        
-        # Extraer día de la semana del created_at
-        dia_semana = ""
-        if caso.created_at:
-            dias = ["Lunes", "Martes", "Miércoles", "Jueves", "Viernes", "Sábado", "Domingo"]
-            dia_semana = dias[caso.created_at.weekday()]
-        
-        data.append({
-            "SERIAL": caso.serial,
-            "CEDULA": caso.cedula,
-            "NOMBRE": empleado.nombre if empleado else "NO REGISTRADO",
-            "EMPRESA": empresa_obj.nombre if empresa_obj else "OTRA",
-            "TIPO": caso.tipo.value if caso.tipo else None,
-            "DIAS": caso.dias_incapacidad,
-            "ESTADO": estado_val,
-            "EPS": caso.eps or (empleado.eps if empleado else None),
-            "FECHA INICIO": caso.fecha_inicio.strftime("%d/%m/%Y") if caso.fecha_inicio else None,
-            "FECHA FIN": caso.fecha_fin.strftime("%d/%m/%Y") if caso.fecha_fin else None,
-            "CODIGO CIE10": caso.codigo_cie10,
-            "DIAGNOSTICO": caso.diagnostico,
-            "ES PRORROGA": "SI" if (caso.serial in seriales_prorroga or caso.es_prorroga) else "NO",
-            "LINK DRIVE": caso.drive_link,
-            "FECHA ADJUNTADO": caso.created_at.strftime("%d/%m/%Y") if caso.created_at else None,
-            "DIA ADJUNTADO": dia_semana,
-            "HORA ADJUNTADO": caso.created_at.strftime("%H:%M") if caso.created_at else None,
-            "PROCESADO": "SI" if caso.procesado else "NO",
-            "FECHA PROCESADO": caso.fecha_procesado.strftime("%d/%m/%Y") if caso.fecha_procesado else None,
-            "USUARIO PROCESADO": caso.usuario_procesado,
-        })
-    
-    df = pd.DataFrame(data)
+    # Fechas ya formateadas por Postgres (to_char, una pasada en la base); en otros
+    # motores se formatean en Python con strftime
+    fechas_en_sql = db.get_bind().dialect.name == "postgresql"
+    if fechas_en_sql:
+        columnas_fecha = (
+            func.to_char(Case.fecha_inicio, 'DD/MM/YYYY').label("fecha_inicio"),
+            func.to_char(Case.fecha_fin, 'DD/MM/YYYY').label("fecha_fin"),
+            func.to_char(Case.created_at, 'DD/MM/YYYY').label("fecha_adjuntado"),
+            func.to_char(Case.created_at, 'ID').label("dia_adjuntado"),  # 1 = lunes … 7 = domingo
+            func.to_char(Case.created_at, 'HH24:MI').label("hora_adjuntado"),
+            func.to_char(Case.fecha_procesado, 'DD/MM/YYYY').label("fecha_procesado"),
+        )
+    else:
+        columnas_fecha = (Case.fecha_inicio, Case.fecha_fin, Case.created_at, Case.fecha_procesado)
+    
+    # Solo las columnas exportadas (tuplas, sin instancias ORM ni metadata_form), por un
+    # cursor del lado del servidor en lotes de 1000
+    casos = query.with_entities(
+        Case.serial, Case.cedula, Case.tipo, Case.dias_incapacidad, Case.estado, Case.eps,
+        Case.codigo_cie10, Case.diagnostico, Case.es_prorroga, Case.drive_link,
+        Case.procesado, Case.usuario_procesado, *columnas_fecha,
+        Employee.nombre.label("empleado_nombre"), Employee.eps.label("empleado_eps"),
+        Company.nombre.label("empresa_nombre"),
+    ).execution_options(stream_results=True).yield_per(1000)
+    
+    def filas_export(casos):
+        """Una tupla por caso, en el orden de _COLUMNAS_EXPORTACION_CASOS."""
+        for caso in casos:
+            # Extraer estado (reemplazar DERIVADO_TTHH con ES POSIBLE FRAUDE)
+            estado_val = caso.estado.value if caso.estado else None
+            if estado_val in ["DERIVADO_TTHH", "TTHH"]:
+                estado_val = "ES POSIBLE FRAUDE - En espera de respuesta de EPS"
+            
+            if fechas_en_sql:
+                fecha_inicio, fecha_fin = caso.fecha_inicio, caso.fecha_fin
+                fecha_adj, hora_adj, fecha_proc = caso.fecha_adjuntado, caso.hora_adjuntado, caso.fecha_procesado
+                dia_adj = _DIAS_SEMANA[int(caso.dia_adjuntado) - 1] if caso.dia_adjuntado else ""
+            else:
+                fecha_inicio = caso.fecha_inicio.strftime("%d/%m/%Y") if caso.fecha_inicio else None
+                fecha_fin = caso.fecha_fin.strftime("%d/%m/%Y") if caso.fecha_fin else None
+                fecha_adj = caso.created_at.strftime("%d/%m/%Y") if caso.created_at else None
+                dia_adj = _DIAS_SEMANA[caso.created_at.weekday()] if caso.created_at else ""
+                hora_adj = caso.created_at.strftime("%H:%M") if caso.created_at else None
+                fecha_proc = caso.fecha_procesado.strftime("%d/%m/%Y") if caso.fecha_procesado else None
+            
+            yield (
+                caso.serial,
+                caso.cedula,
+                caso.empleado_nombre if caso.empleado_nombre is not None else "NO REGISTRADO",
+                caso.empresa_nombre if caso.empresa_nombre is not None else "OTRA",
+                caso.tipo.value if caso.tipo else None,
+                caso.dias_incapacidad,
+                estado_val,
+                caso.eps or caso.empleado_eps,
+                fecha_inicio,
+                fecha_fin,
+                caso.codigo_cie10,
+                caso.diagnostico,
+                "SI" if (caso.serial in seriales_prorroga or caso.es_prorroga) else "NO",
+                caso.drive_link,
+                fecha_adj,
+                dia_adj,
+                hora_adj,
+                "SI" if caso.procesado else "NO",
+                fecha_proc,
+                caso.usuario_procesado,
+            )
     
     # Aplicar formatter profesional
-    from app.utils.excel_formatter import ExcelFormatter
+    from app.utils.excel_formatter import crear_excel_filas_temp, leer_por_bloques, crear_csv_filas
     
     if formato == "xlsx":
-        archivo = ExcelFormatter.crear_excel(df, titulo="Exportación de Casos")
+        # Filas directo al xlsx (xlsxwriter constant_memory), sin lista intermedia ni DataFrame;
+        # el archivo queda en un SpooledTemporaryFile (disco si pasa de 16 MB) y sale por bloques
+        archivo = crear_excel_filas_temp(_COLUMNAS_EXPORTACION_CASOS, filas_export(casos), titulo="Exportación de Casos")
         
         return StreamingResponse(
-            io.BytesIO(archivo),
+            leer_por_bloques(archivo),
             media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
             headers={"Content-Disposition": f"attachment; filename=casos_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"}
         )
     
     elif formato == "csv":
-        archivo = ExcelFormatter.crear_csv(df)
+        def csv_en_streaming():
+            # El cuerpo se genera después de cerrar la sesión de get_db: sesión propia
+            db_stream = SessionLocal()
+            try:
+                yield from crear_csv_filas(_COLUMNAS_EXPORTACION_CASOS, filas_export(casos.with_session(db_stream)))
+            finally:
+                db_stream.close()
         
+        # Filas al cliente por bloques a medida que salen del cursor (sin pandas ni buffer completo)
         return StreamingResponse(
-            io.BytesIO(archivo),
+            csv_en_streaming(),
             media_type="text/csv",
             headers={"Content-Disposition": f"attachment; filename=casos_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"}
         )
@@ -1742,9 +1960,9 @@ async def exportar_casos_zip(
     
     # Filtro por empresa
     if empresa_filtro and empresa_filtro != "all":
-        company = db.query(Company).filter(Company.nombre == empresa_filtro).first()
-        if company:
-            query = query.filter(Case.company_id == company.id)
+        company_id = _company_id_por_nombre(db, empresa_filtro)
+        if company_id:
+            query = query.filter(Case.company_id == company_id)
     
     # Filtro por tipo
     if tipo_filtro and tipo_filtro != "all":
@@ -1804,11 +2022,7 @@ async def exportar_casos_zip(
         for caso in casos:
             try:
                 # Extraer file_id del link de Drive
-                drive_id = None
-                if "/file/d/" in caso.drive_link:
-                    drive_id = caso.drive_link.split("/file/d/")[1].split("/")[0]
-                elif "id=" in caso.drive_link:
-                    drive_id = caso.drive_link.split("id=")[1].split("&")[0]
+                drive_id = _extraer_drive_id(caso.drive_link)
                 
                 if not drive_id:
                     errores += 1
@@ -1816,7 +2030,7 @@ async def exportar_casos_zip(
                 
                 # Descargar PDF de Drive
                 download_url = f"https://drive.google.com/uc?export=download&id={drive_id}"
-                response = requests.get(download_url, timeout=15)
+                response = await _drive_http.get(download_url, timeout=15)
                 
                 if response.status_code != 200 or len(response.content) < 100:
                     errores += 1
@@ -1910,9 +2124,9 @@ async def preview_exportar_zip(
     query = db.query(Case).join(Employee, Case.employee_id == Employee.id, isouter=True)
     
     if empresa_filtro and empresa_filtro != "all":
-        company = db.query(Company).filter(Company.nombre == empresa_filtro).first()
-        if company:
-            query = query.filter(Case.company_id == company.id)
+        company_id = _company_id_por_nombre(db, empresa_filtro)
+        if company_id:
+            query = query.filter(Case.company_id == company_id)
     
     if tipo_filtro and tipo_filtro != "all":
         query = query.filter(Case.tipo == tipo_filtro)
@@ -2125,9 +2339,9 @@ async def exportar_historico_drive(
         if month:
             casos_bd = casos_bd.filter(func.extract('month', Case.created_at) == month)
         if empresa_filtro and empresa_filtro != "all":
-            company = db.query(Company).filter(Company.nombre == empresa_filtro).first()
-            if company:
-                casos_bd = casos_bd.filter(Case.company_id == company.id)
+            company_id = _company_id_por_nombre(db, empresa_filtro)
+            if company_id:
+                casos_bd = casos_bd.filter(Case.company_id == company_id)
         
         total_bd = casos_bd.count()
         con_pdf_bd = casos_bd.filter(Case.drive_link.isnot(None), Case.drive_link != "").count()
@@ -2213,9 +2427,9 @@ async def exportar_a_drive_temporal(
     query = db.query(Case).join(Employee, Case.employee_id == Employee.id, isouter=True)
     
     if empresa_filtro and empresa_filtro != "all":
-        company = db.query(Company).filter(Company.nombre == empresa_filtro).first()
-        if company:
-            query = query.filter(Case.company_id == company.id)
+        company_id = _company_id_por_nombre(db, empresa_filtro)
+        if company_id:
+            query = query.filter(Case.company_id == company_id)
     
     if tipo_filtro and tipo_filtro != "all":
         query = query.filter(Case.tipo == tipo_filtro)
@@ -2279,11 +2493,7 @@ async def exportar_a_drive_temporal(
         for caso in casos:
             try:
                 # Extraer file_id del link de Drive
-                drive_id = None
-                if "/file/d/" in caso.drive_link:
-                    drive_id = caso.drive_link.split("/file/d/")[1].split("/")[0]
-                elif "id=" in caso.drive_link:
-                    drive_id = caso.drive_link.split("id=")[1].split("&")[0]
+                drive_id = _extraer_drive_id(caso.drive_link)
                 
                 if not drive_id:
                     errores += 1
@@ -2445,7 +2655,7 @@ async def obtener_pdf_caso(
 ):
     """Devuelve el PDF del caso desde Google Drive"""
     
-    caso = db.query(Case).filter(Case.serial == serial).first()
+    caso = db.execute(_PDF_CASO_POR_SERIAL, {"serial": serial}).first()
     if not caso:
         raise HTTPException(status_code=404, detail="Caso no encontrado")
     
@@ -2453,18 +2663,14 @@ async def obtener_pdf_caso(
         raise HTTPException(status_code=404, detail="Este caso no tiene PDF asociado")
     
     try:
-        drive_id = None
-        if "/file/d/" in caso.drive_link:
-            drive_id = caso.drive_link.split("/file/d/")[1].split("/")[0]
-        elif "id=" in caso.drive_link:
-            drive_id = caso.drive_link.split("id=")[1].split("&")[0]
+        drive_id = _extraer_drive_id(caso.drive_link)
         
         if not drive_id:
             raise HTTPException(status_code=400, detail="Link de Drive inválido")
         
         download_url = f"https://drive.google.com/uc?export=download&id={drive_id}"
         
-        response = requests.get(download_url, stream=True)
+        response = await _drive_http.get(download_url)
         
         if response.status_code != 200:
             raise HTTPException(status_code=500, detail="Error descargando PDF desde Drive")
@@ -2481,12 +2687,14 @@ async def obtener_pdf_caso(
     except HTTPException:
         raise
     except Exception as e:
-        print(f"❌ Error obteniendo PDF para {serial}: {e}")
+        logger.error(f"❌ Error obteniendo PDF para {serial}: {e}", extra={"serial": serial})
         raise HTTPException(status_code=500, detail=f"Error procesando PDF: {str(e)}")
 
 @router.get("/casos/{serial}/pdf/stream")
 async def obtener_pdf_stream(
     serial: str,
+    range_header: Optional[str] = Header(None, alias="Range"),
+    if_none_match: Optional[str] = Header(None, alias="If-None-Match"),
     db: Session = Depends(get_db),
     _: bool = Depends(verificar_token_admin)
 ):
@@ -2504,43 +2712,51 @@ async def obtener_pdf_stream(
     - TOTAL: < 1.2s ✅
     """
     
-    print(f"📥 [PDF Stream] Iniciando descarga para {serial}...")
+    logger.debug(f"📥 [PDF Stream] Iniciando descarga para {serial}...", extra={"serial": serial})
     
-    caso = db.query(Case).filter(Case.serial == serial).first()
+    caso = db.execute(_PDF_CASO_POR_SERIAL, {"serial": serial}).first()
     if not caso or not caso.drive_link:
-        print(f"❌ [PDF Stream] Caso no encontrado o sin PDF: {serial}")
+        logger.warning(f"❌ [PDF Stream] Caso no encontrado o sin PDF: {serial}", extra={"serial": serial})
         raise HTTPException(status_code=404, detail="Caso o PDF no encontrado")
     
     try:
         # ✅ PASO 1: Extraer file_id
-        print(f"   1️⃣ Extrayendo file_id...")
-        if '/file/d/' in caso.drive_link:
-            file_id = caso.drive_link.split('/file/d/')[1].split('/')[0]
-        elif 'id=' in caso.drive_link:
-            file_id = caso.drive_link.split('id=')[1].split('&')[0]
-        else:
-            print(f"   ❌ Link inválido: {caso.drive_link}")
+        logger.debug(f"1️⃣ [PDF Stream] {serial}: Extrayendo file_id...", extra={"serial": serial})
+        file_id = _extraer_drive_id(caso.drive_link)
+        if not file_id:
+            logger.error(f"❌ [PDF Stream] {serial}: Link inválido: {caso.drive_link}", extra={"serial": serial})
             raise HTTPException(status_code=400, detail="Link de Drive inválido")
         
-        print(f"   ✅ File ID: {file_id}")
+        logger.debug(f"✅ [PDF Stream] {serial}: File ID: {file_id}", extra={"serial": serial})
+        
+        # ETag por versión (file_id + updated_at del caso): editar el PDF conserva el file_id
+        # en Drive pero cambia updated_at → el navegador no se queda con la versión vieja
+        updated_str = caso.updated_at.isoformat() if caso.updated_at else ""
+        etag = f'"{_etag_pdf(file_id, updated_str)}"'
+        if if_none_match == etag and not range_header:
+            return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "public, max-age=3600"})
         
         # ✅ PASO 2: URL de descarga directa
-        print(f"   2️⃣ Generando URL de descarga...")
+        logger.debug(f"2️⃣ [PDF Stream] {serial}: Generando URL de descarga...", extra={"serial": serial})
         download_url = f"https://drive.google.com/uc?export=download&id={file_id}"
         
         # ✅ PASO 3: Descargar desde Drive con timeout para Railway
-        print(f"   3️⃣ Descargando desde Drive (timeout 25s)...")
+        logger.debug(f"3️⃣ [PDF Stream] {serial}: Descargando desde Drive (timeout 25s)...", extra={"serial": serial})
         
         try:
             # ⚠️ CRÍTICO: Railway timeout es 30s, usamos 25s para seguridad
-            response = requests.get(
-                download_url,
-                stream=True,
-                timeout=25  # ✅ IMPORTANTE para Railway
+            # Range del visor (PDF.js pide bloques) se reenvía a Drive: solo viajan esos bytes
+            response = await _drive_http.send(
+                _drive_http.build_request(
+                    "GET", download_url,
+                    headers={"Range": range_header} if range_header else None,
+                ),
+                stream=True,  # timeout 25s del cliente ✅ IMPORTANTE para Railway
             )
             
-            if response.status_code != 200:
-                print(f"   ❌ Error HTTP {response.status_code}")
+            if response.status_code not in (200, 206):
+                await response.aclose()
+                logger.error(f"❌ [PDF Stream] {serial}: Error HTTP {response.status_code}", extra={"serial": serial})
                 raise HTTPException(
                     status_code=500,
                     detail=f"Error descargando PDF (HTTP {response.status_code})"
@@ -2548,26 +2764,33 @@ async def obtener_pdf_stream(
             
             content_type = response.headers.get('content-type', '')
             if 'pdf' not in content_type.lower():
-                print(f"   ⚠️ Content-Type inesperado: {content_type}")
+                logger.warning(f"⚠️ [PDF Stream] {serial}: Content-Type inesperado: {content_type}", extra={"serial": serial})
             
-            print(f"   ✅ Descarga iniciada ({response.headers.get('content-length', 'unknown')} bytes)")
+            logger.debug(f"✅ [PDF Stream] {serial}: Descarga iniciada ({response.headers.get('content-length', 'unknown')} bytes)", extra={"serial": serial})
             
-        except requests.Timeout:
-            print(f"   ❌ TIMEOUT después de 25s - PDF muy grande")
+        except httpx.TimeoutException:
+            logger.error(f"❌ [PDF Stream] {serial}: TIMEOUT después de 25s - PDF muy grande", extra={"serial": serial})
             raise HTTPException(
                 status_code=504,
                 detail="PDF tardó más de 25s en descargar. Intenta de nuevo."
             )
-        except requests.RequestException as e:
-            print(f"   ❌ Error de conexión: {str(e)}")
+        except httpx.HTTPError as e:
+            logger.error(f"❌ [PDF Stream] {serial}: Error de conexión: {str(e)}", extra={"serial": serial})
             raise HTTPException(status_code=500, detail="Error conectando con Drive")
         
         # ✅ PASO 4: Retornar stream con headers optimizados
-        print(f"   4️⃣ Retornando stream con headers optimizados...")
+        logger.debug(f"4️⃣ [PDF Stream] {serial}: Retornando stream con headers optimizados...", extra={"serial": serial})
+        
+        # 206 Partial Content si Drive respetó el Range: se reflejan rango y tamaño
+        headers_rango = {}
+        if response.status_code == 206:
+            for nombre in ("Content-Range", "Content-Length"):
+                if response.headers.get(nombre):
+                    headers_rango[nombre] = response.headers[nombre]
         
         return StreamingResponse(
             # ✅ IMPORTANTE: chunk_size 16KB para velocidad en Railway
-            response.iter_content(chunk_size=16384),
+            response.aiter_bytes(chunk_size=16384),
             
             media_type="application/pdf",
             
@@ -2581,7 +2804,7 @@ async def obtener_pdf_stream(
                 
                 # ✅ CRÍTICO para caché en cliente (evita re-descargas)
                 "Cache-Control": "public, max-age=3600",  # 1 hora
-                "ETag": f'"{file_id}"',  # Para validar caché
+                "ETag": etag,  # Para validar caché
                 
                 # ✅ CRÍTICO para streaming eficiente
                 "Accept-Ranges": "bytes",
@@ -2592,16 +2815,17 @@ async def obtener_pdf_stream(
                 
                 # Performance
                 "X-UA-Compatible": "IE=edge",
-            }
+                **headers_rango,
+            },
+            status_code=response.status_code,
+            background=BackgroundTask(response.aclose),  # libera la conexión al terminar
         )
         
     except HTTPException:
         raise  # Re-lanzar excepciones HTTP
     
     except Exception as e:
-        print(f"   ❌ Error inesperado: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.error(f"❌ [PDF Stream] {serial}: Error inesperado: {str(e)}", exc_info=True, extra={"serial": serial})
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
 
@@ -2612,25 +2836,149 @@ _PDF_CACHE_ORDEN: list = []          # etags en orden de inserción
 _PDF_CACHE_MAX_BYTES = 150 * 1024 * 1024
 
 
-def _pdf_cache_get(etag: str):
-    return _PDF_BYTES_CACHE.get(etag)
+# Segundo nivel en disco (mismo ETag = file_id + updated_at): sobrevive al desalojo de
+# memoria y a reinicios del worker. LRU por mtime con tope configurable.
+_PDF_DISK_DIR = os.path.join(
+    os.environ.get("PDF_CACHE_DIR") or tempfile.gettempdir(), "pdfs_incapacidades"
+)
+_PDF_DISK_MAX_BYTES = int(os.environ.get("PDF_CACHE_MAX_MB", "1024")) * 1024 * 1024
 
 
-def _pdf_cache_put(etag: str, data: bytes):
-    if etag in _PDF_BYTES_CACHE:
-        return
-    _PDF_BYTES_CACHE[etag] = data
-    _PDF_CACHE_ORDEN.append(etag)
-    total = sum(len(v) for v in _PDF_BYTES_CACHE.values())
-    while total > _PDF_CACHE_MAX_BYTES and _PDF_CACHE_ORDEN:
-        viejo = _PDF_CACHE_ORDEN.pop(0)
-        total -= len(_PDF_BYTES_CACHE.pop(viejo, b""))
+def _pdf_disk_path(etag: str) -> str:
+    return os.path.join(_PDF_DISK_DIR, f"{etag}.pdf")
 
 
-@router.get("/casos/{serial}/pdf/fast")
-async def obtener_pdf_fast(
-    serial: str,
-    if_none_match: Optional[str] = Header(None),
+def _pdf_disk_get(etag: str):
+    ruta = _pdf_disk_path(etag)
+    try:
+        with open(ruta, "rb") as f:
+            data = f.read()
+        os.utime(ruta)  # marca de uso reciente para el LRU
+        return data
+    except OSError:
+        return None
+
+
+def _pdf_disk_ruta(etag: str):
+    """Ruta del PDF en disco si existe (marcándolo como usado), para servirlo sin leerlo."""
+    ruta = _pdf_disk_path(etag)
+    try:
+        os.utime(ruta)  # marca de uso reciente para el LRU
+        return ruta
+    except OSError:
+        return None
+
+
+def _pdf_disk_put(etag: str, data: bytes):
+    try:
+        os.makedirs(_PDF_DISK_DIR, exist_ok=True)
+        ruta = _pdf_disk_path(etag)
+        temporal = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporal, "wb") as f:
+            f.write(data)
+        os.replace(temporal, ruta)  # atómico: nadie lee un PDF a medio escribir
+        
+        # Desalojo de los menos usados recientemente si se pasa del tope
+        archivos = []
+        for entrada in os.scandir(_PDF_DISK_DIR):
+            if entrada.is_file() and entrada.name.endswith(".pdf"):
+                st = entrada.stat()
+                archivos.append((st.st_mtime, st.st_size, entrada.path))
+        total = sum(tam for _, tam, _ in archivos)
+        for _, tam, path in sorted(archivos):
+            if total <= _PDF_DISK_MAX_BYTES:
+                break
+            try:
+                os.remove(path)
+                total -= tam
+            except OSError:
+                pass
+    except OSError as e:
+        logger.warning(f"⚠️ Caché de PDFs en disco no disponible: {e}")  # sin disco solo queda la memoria
+
+
+def _pdf_cache_get(etag: str):
+    data = _PDF_BYTES_CACHE.get(etag)
+    if data is None:
+        data = _pdf_disk_get(etag)
+        if data is not None:
+            _pdf_cache_memoria_put(etag, data)
+    return data
+
+
+def _pdf_cache_put(etag: str, data: bytes):
+    if etag in _PDF_BYTES_CACHE:
+        return
+    _pdf_cache_memoria_put(etag, data)
+    _pdf_disk_put(etag, data)
+
+
+def _pdf_cache_memoria_put(etag: str, data: bytes):
+    _PDF_BYTES_CACHE[etag] = data
+    _PDF_CACHE_ORDEN.append(etag)
+    total = sum(len(v) for v in _PDF_BYTES_CACHE.values())
+    while total > _PDF_CACHE_MAX_BYTES and _PDF_CACHE_ORDEN:
+        viejo = _PDF_CACHE_ORDEN.pop(0)
+        total -= len(_PDF_BYTES_CACHE.pop(viejo, b""))
+
+
+# Descargas de Drive en curso por versión (etag): las peticiones simultáneas al mismo PDF
+# esperan esa descarga en vez de lanzar una cada una (single-flight)
+_descargas_pdf_en_curso: Dict[str, asyncio.Task] = {}
+
+
+async def _descargar_pdf_con_fallback(file_id: str, origen: str) -> bytes:
+    """API autenticada (rangos en paralelo); si falla, URL pública de descarga."""
+    try:
+        pdf_bytes = await _descargar_pdf_drive(file_id)
+        logger.debug(f"✅ [{origen}] {file_id}: {len(pdf_bytes)} bytes via API autenticada")
+        return pdf_bytes
+    except Exception as drive_api_error:
+        logger.warning(f"⚠️ [{origen}] API falló, usando URL pública: {drive_api_error}")
+    
+    response = await _drive_http.get(f"https://drive.google.com/uc?export=download&id={file_id}")
+    if response.status_code != 200:
+        raise HTTPException(status_code=500, detail="Error descargando PDF")
+    return response.content
+
+
+async def _obtener_pdf_bytes(file_id: str, etag: str, origen: str) -> bytes:
+    """
+    Bytes del PDF en la versión `etag`: caché de servidor (memoria/disco) o una sola
+    descarga de Drive compartida por todas las peticiones simultáneas a esa versión.
+    """
+    pdf_bytes = _pdf_cache_get(etag)
+    if pdf_bytes:
+        logger.debug(f"⚡ [{origen}] {file_id}: {len(pdf_bytes)} bytes desde caché de servidor")
+        return pdf_bytes
+    
+    en_curso = _descargas_pdf_en_curso.get(etag)
+    if en_curso is None:
+        # La descarga es una tarea propia, no de la petición que la inició: si ese cliente
+        # se desconecta, la descarga sigue para los demás que la esperan
+        en_curso = asyncio.create_task(_descargar_pdf_a_cache(file_id, etag, origen))
+        # Excepción marcada como leída aunque todos los que esperaban se hayan ido
+        en_curso.add_done_callback(lambda t: t.cancelled() or t.exception())
+        _descargas_pdf_en_curso[etag] = en_curso
+    else:
+        logger.debug(f"⏳ [{origen}] {file_id}: esperando descarga en curso")
+    return await asyncio.shield(en_curso)
+
+
+async def _descargar_pdf_a_cache(file_id: str, etag: str, origen: str) -> bytes:
+    """Tarea de _obtener_pdf_bytes: descarga una versión del PDF y la deja en caché."""
+    try:
+        pdf_bytes = await _descargar_pdf_con_fallback(file_id, origen)
+        _pdf_cache_put(etag, pdf_bytes)
+        return pdf_bytes
+    finally:
+        _descargas_pdf_en_curso.pop(etag, None)
+
+
+@router.get("/casos/{serial}/pdf/fast")
+async def obtener_pdf_fast(
+    serial: str,
+    if_none_match: Optional[str] = Header(None),
     db: Session = Depends(get_db),
     _: bool = Depends(verificar_token_admin)
 ):
@@ -2649,28 +2997,23 @@ async def obtener_pdf_fast(
     - PDF muy grande (>10MB): 3-8s
     """
     
-    caso = db.query(Case).filter(Case.serial == serial).first()
+    caso = db.execute(_PDF_CASO_POR_SERIAL, {"serial": serial}).first()
     if not caso or not caso.drive_link:
         raise HTTPException(status_code=404, detail="Caso o PDF no encontrado")
     
     try:
         # Extraer file_id
-        if '/file/d/' in caso.drive_link:
-            file_id = caso.drive_link.split('/file/d/')[1].split('/')[0]
-        elif 'id=' in caso.drive_link:
-            file_id = caso.drive_link.split('id=')[1].split('&')[0]
-        else:
+        file_id = _extraer_drive_id(caso.drive_link)
+        if not file_id:
             raise HTTPException(status_code=400, detail="Link de Drive inválido")
         
         # Generar ETag basado en file_id + updated_at del caso
         updated_str = caso.updated_at.isoformat() if caso.updated_at else ""
-        import hashlib
-        etag_value = hashlib.md5(f"{file_id}:{updated_str}".encode()).hexdigest()
+        etag_value = _etag_pdf(file_id, updated_str)
         etag_header = f'"{etag_value}"'
         
         # ✅ CACHÉ: Si cliente tiene la versión actual, retornar 304
         if if_none_match and if_none_match.strip('"') == etag_value:
-            from fastapi.responses import Response
             return Response(
                 status_code=304,
                 headers={
@@ -2680,65 +3023,40 @@ async def obtener_pdf_fast(
                 }
             )
         
-        # ⚡ Caché de servidor: si otro validador ya cargó esta versión, 0 viajes a Drive
-        pdf_bytes = _pdf_cache_get(etag_value)
-        if pdf_bytes:
-            print(f"⚡ [PDF Fast] {serial}: {len(pdf_bytes)} bytes desde caché de servidor")
-        else:
-            # ✅ Descargar usando API autenticada (más rápida y confiable)
-            try:
-                from app.drive_uploader import get_authenticated_service
-                service = get_authenticated_service()
-
-                # Descargar contenido del archivo
-                request_drive = service.files().get_media(fileId=file_id)
-
-                pdf_content = io.BytesIO()
-                from googleapiclient.http import MediaIoBaseDownload
-                downloader = MediaIoBaseDownload(pdf_content, request_drive)
-
-                done = False
-                while not done:
-                    _, done = downloader.next_chunk()
-
-                pdf_bytes = pdf_content.getvalue()
-                print(f"✅ [PDF Fast] {serial}: {len(pdf_bytes)} bytes via API autenticada")
-
-            except Exception as drive_api_error:
-                # Fallback: URL pública si la API falla
-                print(f"⚠️ [PDF Fast] API falló, usando URL pública: {drive_api_error}")
-                download_url = f"https://drive.google.com/uc?export=download&id={file_id}"
-                response = requests.get(download_url, timeout=25)
-                if response.status_code != 200:
-                    raise HTTPException(status_code=500, detail=f"Error descargando PDF")
-                pdf_bytes = response.content
-
-            _pdf_cache_put(etag_value, pdf_bytes)
+        headers_pdf = {
+            "Content-Disposition": f"inline; filename={serial}.pdf",
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Allow-Methods": "GET, HEAD, OPTIONS",
+            "Access-Control-Expose-Headers": "ETag, X-PDF-Modified, Content-Length",
+            "Cache-Control": "private, max-age=3600",
+            "ETag": etag_header,
+            "X-PDF-Modified": updated_str,
+            "X-Content-Type-Options": "nosniff",
+        }
+        
+        # 💾 Versión en disco pero no en memoria: FileResponse la envía desde el archivo por
+        # bloques (zero-copy si el servidor ASGI soporta sendfile), sin cargarla en Python
+        if etag_value not in _PDF_BYTES_CACHE:
+            ruta_disco = _pdf_disk_ruta(etag_value)
+            if ruta_disco:
+                logger.debug(f"💾 [PDF Fast] {serial}: servido desde caché en disco", extra={"serial": serial})
+                return FileResponse(ruta_disco, media_type="application/pdf", headers=headers_pdf)
+        
+        # ⚡ Caché de servidor (si otro validador ya cargó esta versión, 0 viajes a Drive)
+        # o descarga única compartida con peticiones simultáneas al mismo PDF
+        pdf_bytes = await _obtener_pdf_bytes(file_id, etag_value, "PDF Fast")
         
         # Retornar PDF completo con headers de caché
-        from fastapi.responses import Response
         return Response(
             content=pdf_bytes,
             media_type="application/pdf",
-            headers={
-                "Content-Disposition": f"inline; filename={serial}.pdf",
-                "Content-Length": str(len(pdf_bytes)),
-                "Access-Control-Allow-Origin": "*",
-                "Access-Control-Allow-Methods": "GET, HEAD, OPTIONS",
-                "Access-Control-Expose-Headers": "ETag, X-PDF-Modified, Content-Length",
-                "Cache-Control": "private, max-age=3600",
-                "ETag": etag_header,
-                "X-PDF-Modified": updated_str,
-                "X-Content-Type-Options": "nosniff",
-            }
+            headers={**headers_pdf, "Content-Length": str(len(pdf_bytes))}
         )
         
     except HTTPException:
         raise
     except Exception as e:
-        print(f"❌ [PDF Fast] Error: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.error(f"❌ [PDF Fast] Error: {str(e)}", exc_info=True, extra={"serial": serial})
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
 
@@ -2755,28 +3073,23 @@ async def obtener_preview_caso(
     Cacheado en disco por versión (ETag): el primer render tarda ~1s,
     los siguientes son instantáneos para todos los validadores.
     """
-    import hashlib as _hashlib
     import tempfile as _tempfile
     from pathlib import Path as _Path
-    from fastapi.responses import Response as _Response
 
-    caso = db.query(Case).filter(Case.serial == serial).first()
+    caso = db.execute(_PDF_CASO_POR_SERIAL, {"serial": serial}).first()
     if not caso or not caso.drive_link:
         raise HTTPException(status_code=404, detail="Caso o PDF no encontrado")
 
-    if '/file/d/' in caso.drive_link:
-        file_id = caso.drive_link.split('/file/d/')[1].split('/')[0]
-    elif 'id=' in caso.drive_link:
-        file_id = caso.drive_link.split('id=')[1].split('&')[0]
-    else:
+    file_id = _extraer_drive_id(caso.drive_link)
+    if not file_id:
         raise HTTPException(status_code=400, detail="Link de Drive inválido")
 
     updated_str = caso.updated_at.isoformat() if caso.updated_at else ""
-    etag_value = _hashlib.md5(f"{file_id}:{updated_str}:preview".encode()).hexdigest()
+    etag_value = _etag_pdf(file_id, updated_str, "preview")
     etag_header = f'"{etag_value}"'
 
     if if_none_match and if_none_match.strip('"') == etag_value:
-        return _Response(status_code=304, headers={
+        return Response(status_code=304, headers={
             "ETag": etag_header,
             "Cache-Control": "private, max-age=86400",
             "Access-Control-Allow-Origin": "*",
@@ -2791,25 +3104,7 @@ async def obtener_preview_caso(
         img_bytes = cache_file.read_bytes()
     else:
         # Obtener el PDF (reusa el caché de bytes de /pdf/fast si está)
-        pdf_etag = _hashlib.md5(f"{file_id}:{updated_str}".encode()).hexdigest()
-        pdf_bytes = _pdf_cache_get(pdf_etag)
-        if not pdf_bytes:
-            try:
-                from app.drive_uploader import get_authenticated_service
-                from googleapiclient.http import MediaIoBaseDownload
-                service = get_authenticated_service()
-                buf = io.BytesIO()
-                downloader = MediaIoBaseDownload(buf, service.files().get_media(fileId=file_id))
-                done = False
-                while not done:
-                    _, done = downloader.next_chunk()
-                pdf_bytes = buf.getvalue()
-            except Exception:
-                resp = requests.get(f"https://drive.google.com/uc?export=download&id={file_id}", timeout=25)
-                if resp.status_code != 200:
-                    raise HTTPException(status_code=500, detail="Error descargando PDF para preview")
-                pdf_bytes = resp.content
-            _pdf_cache_put(pdf_etag, pdf_bytes)
+        pdf_bytes = await _obtener_pdf_bytes(file_id, _etag_pdf(file_id, updated_str), "Preview")
 
         # Render de la primera página (~1100px de ancho, JPEG calidad 80)
         import fitz
@@ -2830,7 +3125,7 @@ async def obtener_preview_caso(
             pass  # sin caché en disco no pasa nada — solo será un poco más lento
 
     media = "image/jpeg" if img_bytes[:3] == b"\xff\xd8\xff" else "image/png"
-    return _Response(content=img_bytes, media_type=media, headers={
+    return Response(content=img_bytes, media_type=media, headers={
         "ETag": etag_header,
         "Cache-Control": "private, max-age=86400",
         "Access-Control-Allow-Origin": "*",
@@ -2839,7 +3134,7 @@ async def obtener_preview_caso(
 
 
 @router.get("/casos/{serial}/pdf/meta")
-async def obtener_pdf_meta(
+def obtener_pdf_meta(
     serial: str,
     db: Session = Depends(get_db),
     _: bool = Depends(verificar_token_admin)
@@ -2849,32 +3144,57 @@ async def obtener_pdf_meta(
     Retorna ETag y fecha de modificación para que el frontend
     decida si necesita descargar o usar caché local.
     """
-    caso = db.query(Case).filter(Case.serial == serial).first()
-    if not caso or not caso.drive_link:
+    caso = db.execute(_PDF_CASO_POR_SERIAL, {"serial": serial}).first()
+    if not caso:
         raise HTTPException(status_code=404, detail="Caso no encontrado")
     
-    if '/file/d/' in caso.drive_link:
-        file_id = caso.drive_link.split('/file/d/')[1].split('/')[0]
-    elif 'id=' in caso.drive_link:
-        file_id = caso.drive_link.split('id=')[1].split('&')[0]
-    else:
-        file_id = "unknown"
+    # Sin PDF: nada que parsear ni hashear
+    if not caso.drive_link:
+        return {"serial": serial, "etag": "", "modified": "", "has_pdf": False}
+    
+    file_id = _extraer_drive_id(caso.drive_link) or "unknown"
     
     updated_str = caso.updated_at.isoformat() if caso.updated_at else ""
-    import hashlib
-    etag_value = hashlib.md5(f"{file_id}:{updated_str}".encode()).hexdigest()
+    etag_value = _etag_pdf(file_id, updated_str)
     
     return {
         "serial": serial,
         "etag": etag_value,
         "modified": updated_str,
-        "has_pdf": bool(caso.drive_link)
+        "has_pdf": True
     }
 
 
+def _marcar_efectos_validacion(caso, **valores):
+    """Guarda en metadata_form['efectos_validacion'] el estado de los efectos en segundo plano de /validar."""
+    if not caso.metadata_form:
+        caso.metadata_form = {}
+    caso.metadata_form['efectos_validacion'] = valores
+    flag_modified(caso, 'metadata_form')
+
+
+def _marcar_efectos_fallidos(db, caso_id, serial, error):
+    """La tarea de fondo de /validar falló: revertir lo pendiente y dejar el error consultable."""
+    import traceback
+    traceback.print_exc()
+    print(f"❌ [{serial}] Error en efectos de validación: {error}")
+    db.rollback()
+    try:
+        caso = db.query(Case).filter(Case.id == caso_id).first()
+        if caso:
+            _marcar_efectos_validacion(
+                caso, pendiente=False, nuevo_link=caso.drive_link, usa_ia=None,
+                error=str(error), completado=datetime.now().isoformat(),
+            )
+            db.commit()
+    except Exception:
+        db.rollback()
+
+
 @router.post("/casos/{serial}/validar")
 async def validar_caso_con_checks(
     serial: str,
+    background_tasks: BackgroundTasks,
     accion: str = Form(...),
     checks: List[str] = Form(default=[]),
     observaciones: str = Form(default=""),
@@ -2885,12 +3205,16 @@ async def validar_caso_con_checks(
     """
     Endpoint unificado para validaciones con SISTEMA HÍBRIDO IA/PLANTILLAS
     Acciones: 'completa', 'incompleta', 'ilegible', 'eps', 'tthh', 'falsa'
+
+    Respuesta versión 2: Drive, correos, WhatsApp y Sheets corren en segundo plano
+    (pending_side_effects). "nuevo_link" (link tras mover el archivo) y "usa_ia" (la IA
+    redactó el correo) ya no vienen aquí: se consultan en GET /casos/{serial}/validar/efectos
+    (efectos_url) cuando "pendiente" es False, con el mismo significado de siempre.
     """
     caso = db.query(Case).filter(Case.serial == serial).first()
     if not caso:
         raise HTTPException(status_code=404, detail="Caso no encontrado")
     
-    empleado = caso.empleado
     # ✅ MAPEAR ACCIÓN A ESTADO
     estado_map = {
         'completa': EstadoCaso.COMPLETA,
@@ -2908,6 +3232,7 @@ async def validar_caso_con_checks(
     # ✅ INICIALIZAR VARIABLES
     es_reenvio = False
     casos_borrados = []
+    caso_id = caso.id
 
     # ✅ SI SE APRUEBA COMO COMPLETA Y ES UN REENVÍO
     if nuevo_estado == EstadoCaso.COMPLETA:
@@ -2926,20 +3251,27 @@ async def validar_caso_con_checks(
                 ])
             ).all()
             
-            for caso_anterior in casos_anteriores:
-                print(f"🗑️ Borrando caso anterior incompleto: {caso_anterior.serial}")
-                casos_borrados.append(caso_anterior.serial)
-                
-                # ✅ Intentar archivar en Drive (opcional)
-                try:
-                    organizer = CaseFileOrganizer()
-                    organizer.archivar_caso(caso_anterior)
-                    print(f"   ✅ Archivos movidos a carpeta de archivados")
-                except Exception as e:
-                    print(f"   ⚠️ No se pudieron archivar archivos: {e}")
+            casos_borrados = [c.serial for c in casos_anteriores]
+            if casos_anteriores:
+                print(f"🗑️ Borrando casos anteriores incompletos: {casos_borrados}")
                 
-                # ✅ Eliminar registro de BD
-                db.delete(caso_anterior)
+                # ✅ Desligar de la sesión y borrar con un DELETE por tabla en la misma
+                # transacción. Los hijos (documentos/eventos/notas, el cascade del ORM) se
+                # borran explícitamente: SQLite y esquemas viejos pueden no tener ON DELETE CASCADE
+                ids_anteriores = [c.id for c in casos_anteriores]
+                for caso_anterior in casos_anteriores:
+                    db.expunge(caso_anterior)
+                for modelo_hijo in (CaseDocument, CaseEvent, CaseNote):
+                    db.execute(
+                        delete(modelo_hijo)
+                        .where(modelo_hijo.case_id.in_(ids_anteriores))
+                        .execution_options(synchronize_session=False)
+                    )
+                db.execute(
+                    delete(Case)
+                    .where(Case.id.in_(ids_anteriores))
+                    .execution_options(synchronize_session=False)
+                )
             
             print(f"✅ Eliminados {len(casos_borrados)} casos anteriores: {casos_borrados}")
         
@@ -2958,55 +3290,6 @@ async def validar_caso_con_checks(
         caso.recordatorio_enviado = False
         caso.fecha_recordatorio = None
         
-        # ✅ COPIAR A HISTÓRICO + COMPLETAS + ELIMINAR DE INCOMPLETAS
-        try:
-            from app.drive_manager import IncompleteFileManager
-            organizer = CaseFileOrganizer()
-            incomplete_mgr_validar = IncompleteFileManager()
-
-            # 1️⃣ Copiar a Histórico (Incapacidades/{Empresa}/{Año}/{Quincena}/{Tipo}/)
-            try:
-                link_hist = organizer.copiar_a_historico(caso)
-                if link_hist:
-                    print(f"✅ [{serial}] Copiado a Histórico: {link_hist}")
-            except Exception as e:
-                print(f"⚠️ [{serial}] Error copiando a Histórico: {e}")
-
-            # 2️⃣ Copiar a Completas
-            print(f"📋 Copiando caso {serial} a carpeta Completes...")
-            try:
-                link_completes = completes_mgr.copiar_caso_a_completes(caso)
-                if link_completes:
-                    if not caso.metadata_form:
-                        caso.metadata_form = {}
-                    caso.metadata_form['link_completes'] = link_completes
-                    flag_modified(caso, 'metadata_form')
-                    print(f"✅ Caso {serial} disponible en Completes: {link_completes}")
-            except Exception as e:
-                print(f"⚠️ Error copiando a Completes: {e}")
-
-            # 3️⃣ ELIMINAR DE INCOMPLETAS — Búsqueda robusta por serial
-            print(f"🗑️ [{serial}] Buscando y eliminando de Incompletas...")
-            eliminados_validar = incomplete_mgr_validar.eliminar_de_incompletas_por_serial(serial)
-            if eliminados_validar > 0:
-                print(f"✅ [{serial}] {eliminados_validar} archivo(s) eliminados de Incompletas")
-            else:
-                # Fallback por file_id
-                if caso.drive_link:
-                    import re as re_val
-                    match_val = re_val.search(r'/d/([a-zA-Z0-9_-]+)', caso.drive_link)
-                    if match_val:
-                        fid_val = match_val.group(1)
-                        eliminado_id = incomplete_mgr_validar.eliminar_de_incompletas_por_file_id(fid_val)
-                        if eliminado_id:
-                            print(f"✅ [{serial}] Eliminado de Incompletas por file_id")
-                        else:
-                            print(f"ℹ️ [{serial}] No estaba en Incompletas")
-        except Exception as e:
-            print(f"⚠️ Error en manejo de archivos COMPLETA en /validar: {e}")
-            import traceback
-            traceback.print_exc()
-        
         # ✅ REGISTRAR EVENTO para COMPLETA desde /validar
         registrar_evento(
             db, caso.id,
@@ -3018,78 +3301,149 @@ async def validar_caso_con_checks(
             metadata={"checks": checks, "es_reenvio": es_reenvio}
         )
         
-        # ✅ ENVIAR NOTIFICACIÓN EMAIL/WHATSAPP para COMPLETA desde /validar
-        try:
-            nombre_emp = empleado.nombre if empleado else 'Colaborador/a'
-            email_completa = get_email_template_universal(
-                tipo_email='completa',
-                nombre=nombre_emp,
-                serial=serial,
-                empresa=caso.empresa.nombre if caso.empresa else 'N/A',
-                tipo_incapacidad=caso.tipo.value if caso.tipo else 'General',
-                telefono=caso.telefono_form or 'N/A',
-                email=caso.email_form or '',
-                link_drive=caso.drive_link
-            )
-            
-            # Construir mensaje WhatsApp
-            wa_msg_completa = None
-            if caso.telefono_form:
+        # ✅ Drive (Histórico/Completas/Incompletas), notificación y Sheets después de responder
+        # (segundos de red): la tarea abre su propia sesión, la de get_db ya se habrá cerrado
+        def _efectos_completa():
+            # Tarea en segundo plano: sesión propia
+            db = SessionLocal()
+            try:
+                caso = db.query(Case).filter(Case.id == caso_id).first()
+                if not caso:
+                    return
+                empleado = caso.empleado
+                
+                # ✅ COPIAR A HISTÓRICO + COMPLETAS + ELIMINAR DE INCOMPLETAS
                 try:
-                    from app.ia_redactor import redactar_whatsapp_completa
-                    wa_msg_completa = redactar_whatsapp_completa(nombre_emp, serial)
-                except Exception:
-                    wa_msg_completa = (
-                        f"✅ *Incapacidad Validada*\n\n"
-                        f"Hola {nombre_emp}, tu incapacidad {serial} ha sido validada exitosamente.\n"
-                        f"_Automatico por Incapacidades_"
+                    from app.drive_manager import IncompleteFileManager
+                    organizer = CaseFileOrganizer()
+                    incomplete_mgr_validar = IncompleteFileManager()
+
+                    # 1️⃣ Copiar a Histórico (Incapacidades/{Empresa}/{Año}/{Quincena}/{Tipo}/)
+                    try:
+                        link_hist = organizer.copiar_a_historico(caso)
+                        if link_hist:
+                            print(f"✅ [{serial}] Copiado a Histórico: {link_hist}")
+                    except Exception as e:
+                        print(f"⚠️ [{serial}] Error copiando a Histórico: {e}")
+
+                    # 2️⃣ Copiar a Completas
+                    print(f"📋 Copiando caso {serial} a carpeta Completes...")
+                    try:
+                        link_completes = completes_mgr.copiar_caso_a_completes(caso)
+                        if link_completes:
+                            if not caso.metadata_form:
+                                caso.metadata_form = {}
+                            caso.metadata_form['link_completes'] = link_completes
+                            flag_modified(caso, 'metadata_form')
+                            print(f"✅ Caso {serial} disponible en Completes: {link_completes}")
+                    except Exception as e:
+                        print(f"⚠️ Error copiando a Completes: {e}")
+
+                    # 3️⃣ ELIMINAR DE INCOMPLETAS — Búsqueda robusta por serial
+                    print(f"🗑️ [{serial}] Buscando y eliminando de Incompletas...")
+                    eliminados_validar = incomplete_mgr_validar.eliminar_de_incompletas_por_serial(serial)
+                    if eliminados_validar > 0:
+                        print(f"✅ [{serial}] {eliminados_validar} archivo(s) eliminados de Incompletas")
+                    else:
+                        # Fallback por file_id
+                        if caso.drive_link:
+                            import re as re_val
+                            match_val = re_val.search(r'/d/([a-zA-Z0-9_-]+)', caso.drive_link)
+                            if match_val:
+                                fid_val = match_val.group(1)
+                                eliminado_id = incomplete_mgr_validar.eliminar_de_incompletas_por_file_id(fid_val)
+                                if eliminado_id:
+                                    print(f"✅ [{serial}] Eliminado de Incompletas por file_id")
+                                else:
+                                    print(f"ℹ️ [{serial}] No estaba en Incompletas")
+                except Exception as e:
+                    print(f"⚠️ Error en manejo de archivos COMPLETA en /validar: {e}")
+                    import traceback
+                    traceback.print_exc()
+        
+                # ✅ ENVIAR NOTIFICACIÓN EMAIL/WHATSAPP para COMPLETA desde /validar
+                try:
+                    nombre_emp = empleado.nombre if empleado else 'Colaborador/a'
+                    email_completa = get_email_template_universal(
+                        tipo_email='completa',
+                        nombre=nombre_emp,
+                        serial=serial,
+                        empresa=caso.empresa.nombre if caso.empresa else 'N/A',
+                        tipo_incapacidad=caso.tipo.value if caso.tipo else 'General',
+                        telefono=caso.telefono_form or 'N/A',
+                        email=caso.email_form or '',
+                        link_drive=caso.drive_link
                     )
             
-            # Obtener emails de directorio
-            emails_dir = obtener_emails_empresa_directorio(
-                caso.company_id, db
-            ) if caso.company_id else []
-            cc_dir = ",".join(emails_dir) if emails_dir else None
-            correo_bd_emp = getattr(empleado, 'correo', None) if empleado else None
+                    # Construir mensaje WhatsApp
+                    wa_msg_completa = None
+                    if caso.telefono_form:
+                        try:
+                            from app.ia_redactor import redactar_whatsapp_completa
+                            wa_msg_completa = redactar_whatsapp_completa(nombre_emp, serial)
+                        except Exception:
+                            wa_msg_completa = (
+                                f"✅ *Incapacidad Validada*\n\n"
+                                f"Hola {nombre_emp}, tu incapacidad {serial} ha sido validada exitosamente.\n"
+                                f"_Automatico por Incapacidades_"
+                            )
             
-            fechas_str_c = f" ({caso.fecha_inicio.strftime('%d/%m/%Y')} al {caso.fecha_fin.strftime('%d/%m/%Y')})" if caso.fecha_inicio and caso.fecha_fin else ""
-            asunto_completa = f"CC {caso.cedula} - {serial}{fechas_str_c} - Validada - {nombre_emp} - {caso.empresa.nombre if caso.empresa else 'N/A'}"
+                    # Obtener emails de directorio
+                    emails_dir = obtener_emails_empresa_directorio(
+                        caso.company_id, db
+                    ) if caso.company_id else []
+                    cc_dir = ",".join(emails_dir) if emails_dir else None
+                    correo_bd_emp = getattr(empleado, 'correo', None) if empleado else None
             
-            if caso.email_form:
-                enviar_notificacion(
-                    tipo_notificacion='completa',
-                    email=caso.email_form,
-                    serial=serial,
-                    subject=asunto_completa,
-                    html_content=email_completa,
-                    cc_email=cc_dir,
-                    correo_bd=correo_bd_emp,
-                    whatsapp=caso.telefono_form,
-                    whatsapp_message=wa_msg_completa,
-                    drive_link=caso.drive_link
+                    fechas_str_c = f" ({caso.fecha_inicio.strftime('%d/%m/%Y')} al {caso.fecha_fin.strftime('%d/%m/%Y')})" if caso.fecha_inicio and caso.fecha_fin else ""
+                    asunto_completa = f"CC {caso.cedula} - {serial}{fechas_str_c} - Validada - {nombre_emp} - {caso.empresa.nombre if caso.empresa else 'N/A'}"
+            
+                    if caso.email_form:
+                        enviar_notificacion(
+                            tipo_notificacion='completa',
+                            email=caso.email_form,
+                            serial=serial,
+                            subject=asunto_completa,
+                            html_content=email_completa,
+                            cc_email=cc_dir,
+                            correo_bd=correo_bd_emp,
+                            whatsapp=caso.telefono_form,
+                            whatsapp_message=wa_msg_completa,
+                            drive_link=caso.drive_link
+                        )
+                        print(f"✅ [{serial}] Notificación COMPLETA enviada desde /validar → {caso.email_form}")
+                    else:
+                        print(f"⚠️ [{serial}] Sin email_form, no se envió notificación")
+                except Exception as e:
+                    print(f"⚠️ [{serial}] Error enviando notificación COMPLETA desde /validar: {e}")
+                    import traceback
+                    traceback.print_exc()
+        
+                # ✅ SINCRONIZAR CON GOOGLE SHEETS para COMPLETA
+                try:
+                    from app.google_sheets_tracker import actualizar_caso_en_sheet, registrar_cambio_estado_sheet
+                    actualizar_caso_en_sheet(caso, accion="actualizar")
+                    registrar_cambio_estado_sheet(
+                        caso,
+                        estado_anterior="INCOMPLETA",
+                        estado_nuevo="COMPLETA",
+                        validador="Sistema",
+                        observaciones="Validado como completa"
+                    )
+                    print(f"✅ [{serial}] Sincronizado con Google Sheets")
+                except Exception as e:
+                    print(f"⚠️ [{serial}] Error sincronizando con Sheets: {e}")
+                _marcar_efectos_validacion(
+                    caso, pendiente=False, nuevo_link=caso.drive_link, usa_ia=False,
+                    completado=datetime.now().isoformat(),
                 )
-                print(f"✅ [{serial}] Notificación COMPLETA enviada desde /validar → {caso.email_form}")
-            else:
-                print(f"⚠️ [{serial}] Sin email_form, no se envió notificación")
-        except Exception as e:
-            print(f"⚠️ [{serial}] Error enviando notificación COMPLETA desde /validar: {e}")
-            import traceback
-            traceback.print_exc()
+                db.commit()
+            except Exception as e:
+                _marcar_efectos_fallidos(db, caso_id, serial, e)
+            finally:
+                db.close()
         
-        # ✅ SINCRONIZAR CON GOOGLE SHEETS para COMPLETA
-        try:
-            from app.google_sheets_tracker import actualizar_caso_en_sheet, registrar_cambio_estado_sheet
-            actualizar_caso_en_sheet(caso, accion="actualizar")
-            registrar_cambio_estado_sheet(
-                caso,
-                estado_anterior="INCOMPLETA",
-                estado_nuevo="COMPLETA",
-                validador="Sistema",
-                observaciones="Validado como completa"
-            )
-            print(f"✅ [{serial}] Sincronizado con Google Sheets")
-        except Exception as e:
-            print(f"⚠️ [{serial}] Error sincronizando con Sheets: {e}")
+        background_tasks.add_task(_efectos_completa)
 
     else:
         # ✅ Si es INCOMPLETA, ILEGIBLE, etc. → bloquea nuevas
@@ -3108,529 +3462,575 @@ async def validar_caso_con_checks(
             caso.bloquea_nueva = True
             print(f"🔒 Caso {serial} BLOQUEADO - Empleado debe reenviar")
         
+        # ✅ FALSA CONFIRMADA: guardar metadata de fraude confirmado
+        if accion == 'falsa_confirmada':
+            if not caso.metadata_form:
+                caso.metadata_form = {}
+            caso.metadata_form['fraude_confirmado'] = True
+            caso.metadata_form['fraude_resultado'] = 'adulterada'
+            caso.metadata_form['fecha_fraude_confirmado'] = datetime.now().isoformat()
+            flag_modified(caso, 'metadata_form')
+        
         db.commit()
         
-        # ✅ Mover archivo en Drive según el estado
-        if accion in ['incompleta', 'ilegible']:
-            # Usar el nuevo gestor de incompletas
-            from app.drive_manager import IncompleteFileManager
-            incomplete_mgr = IncompleteFileManager()
+        # Procesar adjuntos si los hay
+        adjuntos_paths = await _guardar_adjuntos_temp(adjuntos, f"{serial}_adjunto") if adjuntos else []
+        
+        # ✅ Drive, correos (IA incluida), WhatsApp y Sheets después de responder; los
+        # adjuntos ya quedaron en archivos temporales que la tarea borra al terminar
+        def _efectos_validacion():
+            # Tarea en segundo plano: sesión propia
+            db = SessionLocal()
+            try:
+                caso = db.query(Case).filter(Case.id == caso_id).first()
+                if not caso:
+                    return
+                empleado = caso.empleado
+                
+                # ✅ Mover archivo en Drive según el estado
+                if accion in ['incompleta', 'ilegible']:
+                    # Usar el nuevo gestor de incompletas
+                    from app.drive_manager import IncompleteFileManager
+                    incomplete_mgr = IncompleteFileManager()
             
-            # Determinar categoría
-            motivo_categoria = 'Ilegibles' if 'ilegible' in accion else 'Faltan_Soportes'
+                    # Determinar categoría
+                    motivo_categoria = 'Ilegibles' if 'ilegible' in accion else 'Faltan_Soportes'
             
-            if checks:
-                checks_str = ' '.join(checks).lower()
-                if 'ilegible' in checks_str or 'recortada' in checks_str or 'borrosa' in checks_str:
-                    motivo_categoria = 'Ilegibles'
-                elif 'eps' in checks_str or 'transcri' in checks_str:
-                    motivo_categoria = 'EPS_No_Transcritas'
+                    if checks:
+                        checks_str = ' '.join(checks).lower()
+                        if 'ilegible' in checks_str or 'recortada' in checks_str or 'borrosa' in checks_str:
+                            motivo_categoria = 'Ilegibles'
+                        elif 'eps' in checks_str or 'transcri' in checks_str:
+                            motivo_categoria = 'EPS_No_Transcritas'
             
-            nuevo_link = incomplete_mgr.mover_a_incompletas(caso, motivo_categoria)
-            if nuevo_link:
-                caso.drive_link = nuevo_link
-                db.commit()
-                print(f"✅ Archivo movido a Incompletas/{motivo_categoria}: {nuevo_link}")
-        else:
-            # Usar el gestor normal para otros estados
-            try:
-                organizer = CaseFileOrganizer()
-                nuevo_link = organizer.mover_caso_segun_estado(caso, nuevo_estado.value, observaciones)
-                if nuevo_link:
-                    caso.drive_link = nuevo_link
-                    db.commit()
-                    print(f"✅ Archivo movido en Drive: {nuevo_link}")
-            except Exception as e:
-                print(f"⚠️ Error moviendo archivo en Drive (no bloquea emails): {e}")
-                import traceback
-                traceback.print_exc()
-        
-        # Procesar adjuntos si los hay
-        adjuntos_paths = []
-        if adjuntos:
-            for i, adjunto in enumerate(adjuntos):
-                temp_path = os.path.join(tempfile.gettempdir(), f"{serial}_adjunto_{i}_{adjunto.filename}")
-                with open(temp_path, "wb") as f:
-                    contenido = await adjunto.read()
-                    f.write(contenido)
-                adjuntos_paths.append(temp_path)
-        
-        # ✅ SISTEMA HÍBRIDO: IA vs Plantillas
-        from app.ia_redactor import (
-            redactar_email_incompleta, 
-            redactar_email_ilegible, 
-            redactar_alerta_tthh
-        )
+                    nuevo_link = incomplete_mgr.mover_a_incompletas(caso, motivo_categoria)
+                    if nuevo_link:
+                        caso.drive_link = nuevo_link
+                        db.commit()
+                        print(f"✅ Archivo movido a Incompletas/{motivo_categoria}: {nuevo_link}")
+                else:
+                    # Usar el gestor normal para otros estados
+                    try:
+                        organizer = CaseFileOrganizer()
+                        nuevo_link = organizer.mover_caso_segun_estado(caso, nuevo_estado.value, observaciones)
+                        if nuevo_link:
+                            caso.drive_link = nuevo_link
+                            db.commit()
+                            print(f"✅ Archivo movido en Drive: {nuevo_link}")
+                    except Exception as e:
+                        print(f"⚠️ Error moviendo archivo en Drive (no bloquea emails): {e}")
+                        import traceback
+                        traceback.print_exc()
+        
+                # ✅ SISTEMA HÍBRIDO: IA vs Plantillas
+                from app.ia_redactor import (
+                    redactar_email_incompleta, 
+                    redactar_email_ilegible, 
+                    redactar_alerta_tthh
+                )
         
-        contenido_ia = None
+                contenido_ia = None
         
-        # ========== LÓGICA HÍBRIDA ==========
-        if accion in ['incompleta', 'ilegible']:
-            # ✅ USAR IA para casos complejos
-            print(f"🤖 Generando email con IA Claude Haiku para {serial}...")
+                # ========== LÓGICA HÍBRIDA ==========
+                if accion in ['incompleta', 'ilegible']:
+                    # ✅ USAR IA para casos complejos
+                    print(f"🤖 Generando email con IA Claude Haiku para {serial}...")
             
-            if accion == 'incompleta':
-                contenido_ia = redactar_email_incompleta(
-                    empleado.nombre if empleado else 'Colaborador/a',
-                    serial,
-                    checks,
-                    caso.tipo.value if caso.tipo else 'General'
-                )
-            elif accion == 'ilegible':
-                contenido_ia = redactar_email_ilegible(
-                    empleado.nombre if empleado else 'Colaborador/a',
-                    serial,
-                    checks
-                )
+                    if accion == 'incompleta':
+                        contenido_ia = redactar_email_incompleta(
+                            empleado.nombre if empleado else 'Colaborador/a',
+                            serial,
+                            checks,
+                            caso.tipo.value if caso.tipo else 'General'
+                        )
+                    elif accion == 'ilegible':
+                        contenido_ia = redactar_email_ilegible(
+                            empleado.nombre if empleado else 'Colaborador/a',
+                            serial,
+                            checks
+                        )
             
-            # Insertar contenido IA en plantilla
-            email_empleada = get_email_template_universal(
-                tipo_email=accion,
-                nombre=empleado.nombre if empleado else 'Colaborador/a',
-                serial=serial,
-                empresa=caso.empresa.nombre if caso.empresa else 'N/A',
-                tipo_incapacidad=caso.tipo.value if caso.tipo else 'General',
-                telefono=caso.telefono_form,
-                email=caso.email_form,
-                link_drive=caso.drive_link,
-                checks_seleccionados=checks,
-                contenido_ia=contenido_ia  # ✅ IA aquí
-            )
+                    # Insertar contenido IA en plantilla
+                    email_empleada = get_email_template_universal(
+                        tipo_email=accion,
+                        nombre=empleado.nombre if empleado else 'Colaborador/a',
+                        serial=serial,
+                        empresa=caso.empresa.nombre if caso.empresa else 'N/A',
+                        tipo_incapacidad=caso.tipo.value if caso.tipo else 'General',
+                        telefono=caso.telefono_form,
+                        email=caso.email_form,
+                        link_drive=caso.drive_link,
+                        checks_seleccionados=checks,
+                        contenido_ia=contenido_ia  # ✅ IA aquí
+                    )
             
-            # Enviar con formato de asunto actualizado
-            estado_label = 'Incompleta' if accion == 'incompleta' else 'Ilegible'
-            fechas_str = f" ({caso.fecha_inicio.strftime('%d/%m/%Y')} al {caso.fecha_fin.strftime('%d/%m/%Y')})" if caso.fecha_inicio and caso.fecha_fin else ""
-            asunto = f"CC {caso.cedula} - {serial}{fechas_str} - {estado_label} - {empleado.nombre if empleado else 'Colaborador'} - {caso.empresa.nombre if caso.empresa else 'N/A'}"
-            # ✅ Construir mensaje WhatsApp con los checks directamente (sin parsear HTML)
-            from app.checks_disponibles import CHECKS_DISPONIBLES
-            _cedula_wa, _fechas_wa = _parsear_serial_local(serial)
-            wa_lineas = []
-            wa_emoji = '⚠️'
-            wa_titulo = 'Documentacion Incompleta' if accion == 'incompleta' else 'Documento Ilegible'
-            _fecha_texto_wa = f" {_fechas_wa}" if _fechas_wa else ""
-            wa_lineas.append(f"{wa_emoji} *{wa_titulo}*")
-            wa_lineas.append(f"Incapacidad{_fecha_texto_wa}")
-            wa_lineas.append("")
-            # Motivos desde checks
-            motivos_wa = []
-            for ck in checks:
-                if ck in CHECKS_DISPONIBLES:
-                    motivos_wa.append(CHECKS_DISPONIBLES[ck]['label'])
-            if motivos_wa:
-                wa_lineas.append("*Motivo:*")
-                for m in motivos_wa[:5]:
-                    wa_lineas.append(f"• {m}")
-                wa_lineas.append("")
-            # Soportes requeridos
-            from app.ia_redactor import DOCUMENTOS_REQUERIDOS
-            tipo_val = caso.tipo.value.lower().replace(' ', '_') if caso.tipo else 'enfermedad_general'
-            soportes_wa = DOCUMENTOS_REQUERIDOS.get(tipo_val, [])
-            if soportes_wa:
-                wa_lineas.append("*Soportes requeridos:*")
-                for s in soportes_wa[:5]:
-                    wa_lineas.append(f"• {s}")
-                wa_lineas.append("")
-            wa_lineas.append("Enviar en *PDF escaneado*, completo y legible.")
-            if caso.drive_link:
-                wa_lineas.append("")
-                wa_lineas.append(f"📄 Ver documento actual: {caso.drive_link}")
-            wa_lineas.append("")
-            wa_lineas.append("Subir documentos: https://repogemin.vercel.app/")
-            wa_lineas.append("")
-            wa_lineas.append("_Automatico por Incapacidades_")
-            wa_msg = "\n".join(wa_lineas)
-
-            enviar_email_con_adjuntos(
-                caso.email_form,
-                asunto,
-                email_empleada,
-                adjuntos_paths,
-                caso=caso,  # ✅ COPIA AUTOMÁTICA
-                whatsapp_message=wa_msg
-            )
+                    # Enviar con formato de asunto actualizado
+                    estado_label = 'Incompleta' if accion == 'incompleta' else 'Ilegible'
+                    fechas_str = f" ({caso.fecha_inicio.strftime('%d/%m/%Y')} al {caso.fecha_fin.strftime('%d/%m/%Y')})" if caso.fecha_inicio and caso.fecha_fin else ""
+                    asunto = f"CC {caso.cedula} - {serial}{fechas_str} - {estado_label} - {empleado.nombre if empleado else 'Colaborador'} - {caso.empresa.nombre if caso.empresa else 'N/A'}"
+                    # ✅ Construir mensaje WhatsApp con los checks directamente (sin parsear HTML)
+                    from app.checks_disponibles import CHECKS_DISPONIBLES
+                    _cedula_wa, _fechas_wa = _parsear_serial_local(serial)
+                    wa_lineas = []
+                    wa_emoji = '⚠️'
+                    wa_titulo = 'Documentacion Incompleta' if accion == 'incompleta' else 'Documento Ilegible'
+                    _fecha_texto_wa = f" {_fechas_wa}" if _fechas_wa else ""
+                    wa_lineas.append(f"{wa_emoji} *{wa_titulo}*")
+                    wa_lineas.append(f"Incapacidad{_fecha_texto_wa}")
+                    wa_lineas.append("")
+                    # Motivos desde checks
+                    motivos_wa = []
+                    for ck in checks:
+                        if ck in CHECKS_DISPONIBLES:
+                            motivos_wa.append(CHECKS_DISPONIBLES[ck]['label'])
+                    if motivos_wa:
+                        wa_lineas.append("*Motivo:*")
+                        for m in motivos_wa[:5]:
+                            wa_lineas.append(f"• {m}")
+                        wa_lineas.append("")
+                    # Soportes requeridos
+                    from app.ia_redactor import DOCUMENTOS_REQUERIDOS
+                    tipo_val = caso.tipo.value.lower().replace(' ', '_') if caso.tipo else 'enfermedad_general'
+                    soportes_wa = DOCUMENTOS_REQUERIDOS.get(tipo_val, [])
+                    if soportes_wa:
+                        wa_lineas.append("*Soportes requeridos:*")
+                        for s in soportes_wa[:5]:
+                            wa_lineas.append(f"• {s}")
+                        wa_lineas.append("")
+                    wa_lineas.append("Enviar en *PDF escaneado*, completo y legible.")
+                    if caso.drive_link:
+                        wa_lineas.append("")
+                        wa_lineas.append(f"📄 Ver documento actual: {caso.drive_link}")
+                    wa_lineas.append("")
+                    wa_lineas.append("Subir documentos: https://repogemin.vercel.app/")
+                    wa_lineas.append("")
+                    wa_lineas.append("_Automatico por Incapacidades_")
+                    wa_msg = "\n".join(wa_lineas)
+
+                    enviar_email_con_adjuntos(
+                        caso.email_form,
+                        asunto,
+                        email_empleada,
+                        adjuntos_paths,
+                        caso=caso,  # ✅ COPIA AUTOMÁTICA
+                        whatsapp_message=wa_msg
+                    )
         
-        elif accion == 'tthh':
-            # ✅ USAR IA para alerta a TTHH
-            print(f"🚨 Generando alerta TTHH con IA para {serial}...")
+                elif accion == 'tthh':
+                    # ✅ USAR IA para alerta a TTHH
+                    print(f"🚨 Generando alerta TTHH con IA para {serial}...")
             
-            contenido_ia_tthh = redactar_alerta_tthh(
-                empleado.nombre if empleado else 'Colaborador/a',
-                serial,
-                caso.empresa.nombre if caso.empresa else 'N/A',
-                checks,
-                observaciones
-            )
+                    contenido_ia_tthh = redactar_alerta_tthh(
+                        empleado.nombre if empleado else 'Colaborador/a',
+                        serial,
+                        caso.empresa.nombre if caso.empresa else 'N/A',
+                        checks,
+                        observaciones
+                    )
             
-            # Email al encargado de presunto fraude (múltiples destinatarios)
-            emails_fraude = obtener_emails_presunto_fraude(caso.empresa.nombre if caso.empresa else 'Default', db=db)
+                    # Email al encargado de presunto fraude (múltiples destinatarios)
+                    emails_fraude = obtener_emails_presunto_fraude(caso.empresa.nombre if caso.empresa else 'Default', db=db)
             
-            email_tthh = get_email_template_universal(
-                tipo_email='tthh',
-                nombre='Encargado de Presunto Fraude',
-                serial=serial,
-                empresa=caso.empresa.nombre if caso.empresa else 'N/A',
-                tipo_incapacidad=caso.tipo.value if caso.tipo else 'General',
-                telefono=caso.telefono_form,
-                email=caso.email_form,
-                link_drive=caso.drive_link,
-                checks_seleccionados=checks,
-                contenido_ia=contenido_ia_tthh,  # ✅ IA aquí
-                empleado_nombre=empleado.nombre if empleado else 'Colaborador/a'
-            )
+                    email_tthh = get_email_template_universal(
+                        tipo_email='tthh',
+                        nombre='Encargado de Presunto Fraude',
+                        serial=serial,
+                        empresa=caso.empresa.nombre if caso.empresa else 'N/A',
+                        tipo_incapacidad=caso.tipo.value if caso.tipo else 'General',
+                        telefono=caso.telefono_form,
+                        email=caso.email_form,
+                        link_drive=caso.drive_link,
+                        checks_seleccionados=checks,
+                        contenido_ia=contenido_ia_tthh,  # ✅ IA aquí
+                        empleado_nombre=empleado.nombre if empleado else 'Colaborador/a'
+                    )
             
-            fechas_str_tthh = f" ({caso.fecha_inicio.strftime('%d/%m/%Y')} al {caso.fecha_fin.strftime('%d/%m/%Y')})" if caso.fecha_inicio and caso.fecha_fin else ""
-            asunto_tthh = f"CC {caso.cedula} - {serial}{fechas_str_tthh} - PRESUNTO FRAUDE - {empleado.nombre if empleado else 'Colaborador'} - {caso.empresa.nombre if caso.empresa else 'N/A'}"
+                    fechas_str_tthh = f" ({caso.fecha_inicio.strftime('%d/%m/%Y')} al {caso.fecha_fin.strftime('%d/%m/%Y')})" if caso.fecha_inicio and caso.fecha_fin else ""
+                    asunto_tthh = f"CC {caso.cedula} - {serial}{fechas_str_tthh} - PRESUNTO FRAUDE - {empleado.nombre if empleado else 'Colaborador'} - {caso.empresa.nombre if caso.empresa else 'N/A'}"
             
-            # Obtener CC empresa del directorio (se usa en ambos correos)
-            cc_empresa_fraude = None
-            if caso.company_id:
-                emails_dir_fraude = obtener_emails_empresa_directorio(caso.company_id, db=db)
-                if emails_dir_fraude:
-                    cc_empresa_fraude = ",".join(emails_dir_fraude)
-            print(f"📧 CC empresa para tthh: {cc_empresa_fraude or 'N/A'}")
+                    # Obtener CC empresa del directorio (se usa en ambos correos)
+                    cc_empresa_fraude = None
+                    if caso.company_id:
+                        emails_dir_fraude = obtener_emails_empresa_directorio(caso.company_id, db=db)
+                        if emails_dir_fraude:
+                            cc_empresa_fraude = ",".join(emails_dir_fraude)
+                    print(f"📧 CC empresa para tthh: {cc_empresa_fraude or 'N/A'}")
             
-            # ✅ Agregar emails del directorio empresa como destinatarios DIRECTOS
-            if cc_empresa_fraude:
-                for _em in cc_empresa_fraude.split(","):
-                    _em = _em.strip()
-                    if _em and "@" in _em and _em.lower() not in [e.lower() for e in emails_fraude]:
-                        emails_fraude.append(_em)
-            print(f"📧 Destinatarios finales tthh: {emails_fraude}")
+                    # ✅ Agregar emails del directorio empresa como destinatarios DIRECTOS
+                    if cc_empresa_fraude:
+                        for _em in cc_empresa_fraude.split(","):
+                            _em = _em.strip()
+                            if _em and "@" in _em and _em.lower() not in [e.lower() for e in emails_fraude]:
+                                emails_fraude.append(_em)
+                    print(f"📧 Destinatarios finales tthh: {emails_fraude}")
             
-            # ✅ CORREO 1: Alerta a directorio presunto fraude + empresa
-            try:
-                import base64 as _b64_fraude
-                adjuntos_b64_fraude = []
-                for _path in adjuntos_paths:
-                    if os.path.exists(_path):
-                        try:
-                            with open(_path, 'rb') as _f:
-                                _content = _b64_fraude.b64encode(_f.read()).decode('utf-8')
-                                adjuntos_b64_fraude.append({
-                                    'filename': os.path.basename(_path),
-                                    'content': _content,
-                                    'mimetype': 'application/pdf'
-                                })
-                        except Exception as _e:
-                            print(f"⚠️ Error procesando adjunto fraude {_path}: {_e}")
+                    # ✅ CORREO 1: Alerta a directorio presunto fraude + empresa
+                    try:
+                        import base64 as _b64_fraude
+                        adjuntos_b64_fraude = []
+                        for _path in adjuntos_paths:
+                            if os.path.exists(_path):
+                                try:
+                                    with open(_path, 'rb') as _f:
+                                        _content = _b64_fraude.b64encode(_f.read()).decode('utf-8')
+                                        adjuntos_b64_fraude.append({
+                                            'filename': os.path.basename(_path),
+                                            'content': _content,
+                                            'mimetype': 'application/pdf'
+                                        })
+                                except Exception as _e:
+                                    print(f"⚠️ Error procesando adjunto fraude {_path}: {_e}")
                 
-                for email_dest in emails_fraude:
-                    _cc_para_dest = cc_empresa_fraude
-                    if _cc_para_dest:
-                        _cc_filtrado = [e.strip() for e in _cc_para_dest.split(",") if e.strip().lower() != email_dest.lower()]
-                        _cc_para_dest = ",".join(_cc_filtrado) if _cc_filtrado else None
+                        for email_dest in emails_fraude:
+                            _cc_para_dest = cc_empresa_fraude
+                            if _cc_para_dest:
+                                _cc_filtrado = [e.strip() for e in _cc_para_dest.split(",") if e.strip().lower() != email_dest.lower()]
+                                _cc_para_dest = ",".join(_cc_filtrado) if _cc_filtrado else None
                     
-                    resultado = enviar_notificacion(
-                        tipo_notificacion='tthh',
-                        email=email_dest,
-                        serial=serial,
-                        subject=asunto_tthh,
-                        html_content=email_tthh,
-                        cc_email=_cc_para_dest,
-                        correo_bd=None,
-                        whatsapp=None,
-                        whatsapp_message=None,
-                        adjuntos_base64=adjuntos_b64_fraude,
-                        drive_link=caso.drive_link
-                    )
-                    print(f"🚨 Presunto fraude enviado a: {email_dest} → resultado={resultado} (CC: {_cc_para_dest or 'N/A'})")
-            except Exception as e:
-                print(f"⚠️ Error enviando CORREO 1 (alerta fraude) tthh: {e}")
+                            resultado = enviar_notificacion(
+                                tipo_notificacion='tthh',
+                                email=email_dest,
+                                serial=serial,
+                                subject=asunto_tthh,
+                                html_content=email_tthh,
+                                cc_email=_cc_para_dest,
+                                correo_bd=None,
+                                whatsapp=None,
+                                whatsapp_message=None,
+                                adjuntos_base64=adjuntos_b64_fraude,
+                                drive_link=caso.drive_link
+                            )
+                            print(f"🚨 Presunto fraude enviado a: {email_dest} → resultado={resultado} (CC: {_cc_para_dest or 'N/A'})")
+                    except Exception as e:
+                        print(f"⚠️ Error enviando CORREO 1 (alerta fraude) tthh: {e}")
             
-            # ✅ CORREO 2: Confirmación NORMAL al empleado — CON CC empresa
-            try:
-                email_empleada_falsa = get_email_template_universal(
-                    tipo_email='falsa',
-                    nombre=empleado.nombre if empleado else 'Colaborador/a',
-                    serial=serial,
-                    empresa=caso.empresa.nombre if caso.empresa else 'N/A',
-                    tipo_incapacidad=caso.tipo.value if caso.tipo else 'General',
-                    telefono=caso.telefono_form,
-                    email=caso.email_form,
-                    link_drive=caso.drive_link
-                )
+                    # ✅ CORREO 2: Confirmación NORMAL al empleado — CON CC empresa
+                    try:
+                        email_empleada_falsa = get_email_template_universal(
+                            tipo_email='falsa',
+                            nombre=empleado.nombre if empleado else 'Colaborador/a',
+                            serial=serial,
+                            empresa=caso.empresa.nombre if caso.empresa else 'N/A',
+                            tipo_incapacidad=caso.tipo.value if caso.tipo else 'General',
+                            telefono=caso.telefono_form,
+                            email=caso.email_form,
+                            link_drive=caso.drive_link
+                        )
                 
-                fechas_str_conf = f" ({caso.fecha_inicio.strftime('%d/%m/%Y')} al {caso.fecha_fin.strftime('%d/%m/%Y')})" if caso.fecha_inicio and caso.fecha_fin else ""
-                asunto_confirmacion = f"CC {caso.cedula} - {serial}{fechas_str_conf} - Confirmación - {empleado.nombre if empleado else 'Colaborador'} - {caso.empresa.nombre if caso.empresa else 'N/A'}"
-                send_html_email(
-                    caso.email_form,
-                    asunto_confirmacion,
-                    email_empleada_falsa,
-                    caso=caso  # ✅ CC empresa automático
-                )
-                print(f"📧 Correo confirmación enviado al colaborador: {caso.email_form}")
-            except Exception as e:
-                print(f"⚠️ Error enviando CORREO 2 (confirmación empleado) tthh: {e}")
+                        fechas_str_conf = f" ({caso.fecha_inicio.strftime('%d/%m/%Y')} al {caso.fecha_fin.strftime('%d/%m/%Y')})" if caso.fecha_inicio and caso.fecha_fin else ""
+                        asunto_confirmacion = f"CC {caso.cedula} - {serial}{fechas_str_conf} - Confirmación - {empleado.nombre if empleado else 'Colaborador'} - {caso.empresa.nombre if caso.empresa else 'N/A'}"
+                        send_html_email(
+                            caso.email_form,
+                            asunto_confirmacion,
+                            email_empleada_falsa,
+                            caso=caso  # ✅ CC empresa automático
+                        )
+                        print(f"📧 Correo confirmación enviado al colaborador: {caso.email_form}")
+                    except Exception as e:
+                        print(f"⚠️ Error enviando CORREO 2 (confirmación empleado) tthh: {e}")
         
-        elif accion in ['completa', 'eps', 'falsa']:
-            # ✅ PLANTILLAS ESTÁTICAS (Gratis)
-            print(f"📄 Usando plantilla estática para {accion}...")
+                elif accion in ['completa', 'eps', 'falsa']:
+                    # ✅ PLANTILLAS ESTÁTICAS (Gratis)
+                    print(f"📄 Usando plantilla estática para {accion}...")
             
-            email_empleada = get_email_template_universal(
-                tipo_email=accion,
-                nombre=empleado.nombre if empleado else 'Colaborador/a',
-                serial=serial,
-                empresa=caso.empresa.nombre if caso.empresa else 'N/A',
-                tipo_incapacidad=caso.tipo.value if caso.tipo else 'General',
-                telefono=caso.telefono_form,
-                email=caso.email_form,
-                link_drive=caso.drive_link
-            )
+                    email_empleada = get_email_template_universal(
+                        tipo_email=accion,
+                        nombre=empleado.nombre if empleado else 'Colaborador/a',
+                        serial=serial,
+                        empresa=caso.empresa.nombre if caso.empresa else 'N/A',
+                        tipo_incapacidad=caso.tipo.value if caso.tipo else 'General',
+                        telefono=caso.telefono_form,
+                        email=caso.email_form,
+                        link_drive=caso.drive_link
+                    )
             
-            estado_map_asunto = {
-                'completa': 'Validada',
-                'eps': 'EPS',
-                'falsa': 'Confirmación'
-            }
-            estado_label = estado_map_asunto.get(accion, 'Actualización')
-            fechas_str = f" ({caso.fecha_inicio.strftime('%d/%m/%Y')} al {caso.fecha_fin.strftime('%d/%m/%Y')})" if caso.fecha_inicio and caso.fecha_fin else ""
-            asunto = f"CC {caso.cedula} - {serial}{fechas_str} - {estado_label} - {empleado.nombre if empleado else 'Colaborador'} - {caso.empresa.nombre if caso.empresa else 'N/A'}"
-            send_html_email(
-                caso.email_form,
-                asunto,
-                email_empleada,
-                caso=caso  # ✅ COPIA AUTOMÁTICA
-            )
+                    estado_map_asunto = {
+                        'completa': 'Validada',
+                        'eps': 'EPS',
+                        'falsa': 'Confirmación'
+                    }
+                    estado_label = estado_map_asunto.get(accion, 'Actualización')
+                    fechas_str = f" ({caso.fecha_inicio.strftime('%d/%m/%Y')} al {caso.fecha_fin.strftime('%d/%m/%Y')})" if caso.fecha_inicio and caso.fecha_fin else ""
+                    asunto = f"CC {caso.cedula} - {serial}{fechas_str} - {estado_label} - {empleado.nombre if empleado else 'Colaborador'} - {caso.empresa.nombre if caso.empresa else 'N/A'}"
+                    send_html_email(
+                        caso.email_form,
+                        asunto,
+                        email_empleada,
+                        caso=caso  # ✅ COPIA AUTOMÁTICA
+                    )
         
-        elif accion == 'solicitar_epicrisis':
-            # ✅ SOLICITAR EPICRISIS: Email al trabajador pidiendo epicrisis (como si EPS lo pidiera)
-            print(f"📋 Solicitando epicrisis para {serial}...")
+                elif accion == 'solicitar_epicrisis':
+                    # ✅ SOLICITAR EPICRISIS: Email al trabajador pidiendo epicrisis (como si EPS lo pidiera)
+                    print(f"📋 Solicitando epicrisis para {serial}...")
             
-            email_empleada = get_email_template_universal(
-                tipo_email='solicitar_epicrisis',
-                nombre=empleado.nombre if empleado else 'Colaborador/a',
-                serial=serial,
-                empresa=caso.empresa.nombre if caso.empresa else 'N/A',
-                tipo_incapacidad=caso.tipo.value if caso.tipo else 'General',
-                telefono=caso.telefono_form,
-                email=caso.email_form,
-                link_drive=caso.drive_link
-            )
+                    email_empleada = get_email_template_universal(
+                        tipo_email='solicitar_epicrisis',
+                        nombre=empleado.nombre if empleado else 'Colaborador/a',
+                        serial=serial,
+                        empresa=caso.empresa.nombre if caso.empresa else 'N/A',
+                        tipo_incapacidad=caso.tipo.value if caso.tipo else 'General',
+                        telefono=caso.telefono_form,
+                        email=caso.email_form,
+                        link_drive=caso.drive_link
+                    )
             
-            fechas_str = f" ({caso.fecha_inicio.strftime('%d/%m/%Y')} al {caso.fecha_fin.strftime('%d/%m/%Y')})" if caso.fecha_inicio and caso.fecha_fin else ""
-            asunto = f"CC {caso.cedula} - {serial}{fechas_str} - Solicitud Epicrisis - {empleado.nombre if empleado else 'Colaborador'} - {caso.empresa.nombre if caso.empresa else 'N/A'}"
-            send_html_email(
-                caso.email_form,
-                asunto,
-                email_empleada,
-                caso=caso  # ✅ COPIA AUTOMÁTICA con CC empresa
-            )
+                    fechas_str = f" ({caso.fecha_inicio.strftime('%d/%m/%Y')} al {caso.fecha_fin.strftime('%d/%m/%Y')})" if caso.fecha_inicio and caso.fecha_fin else ""
+                    asunto = f"CC {caso.cedula} - {serial}{fechas_str} - Solicitud Epicrisis - {empleado.nombre if empleado else 'Colaborador'} - {caso.empresa.nombre if caso.empresa else 'N/A'}"
+                    send_html_email(
+                        caso.email_form,
+                        asunto,
+                        email_empleada,
+                        caso=caso  # ✅ COPIA AUTOMÁTICA con CC empresa
+                    )
         
-        elif accion == 'enviar_validar':
-            # ✅ ENVIAR A VALIDAR: Email normal al trabajador + Email al directorio fraude con adjuntos
-            print(f"🔍 Enviando a validar con EPS para {serial}...")
+                elif accion == 'enviar_validar':
+                    # ✅ ENVIAR A VALIDAR: Email normal al trabajador + Email al directorio fraude con adjuntos
+                    print(f"🔍 Enviando a validar con EPS para {serial}...")
             
-            # CC empresa (se usa en ambos correos)
-            cc_empresa_validar = None
-            if caso.company_id:
-                emails_dir_validar = obtener_emails_empresa_directorio(caso.company_id, db=db)
-                if emails_dir_validar:
-                    cc_empresa_validar = ",".join(emails_dir_validar)
-            print(f"📧 CC empresa para enviar_validar: {cc_empresa_validar or 'N/A'}")
+                    # CC empresa (se usa en ambos correos)
+                    cc_empresa_validar = None
+                    if caso.company_id:
+                        emails_dir_validar = obtener_emails_empresa_directorio(caso.company_id, db=db)
+                        if emails_dir_validar:
+                            cc_empresa_validar = ",".join(emails_dir_validar)
+                    print(f"📧 CC empresa para enviar_validar: {cc_empresa_validar or 'N/A'}")
             
-            # ── CORREO 1: Mensaje neutro al colaborador (con CC empresa) ──
-            try:
-                email_empleada_neutro = get_email_template_universal(
-                    tipo_email='falsa',
-                    nombre=empleado.nombre if empleado else 'Colaborador/a',
-                    serial=serial,
-                    empresa=caso.empresa.nombre if caso.empresa else 'N/A',
-                    tipo_incapacidad=caso.tipo.value if caso.tipo else 'General',
-                    telefono=caso.telefono_form,
-                    email=caso.email_form,
-                    link_drive=caso.drive_link
-                )
+                    # ── CORREO 1: Mensaje neutro al colaborador (con CC empresa) ──
+                    try:
+                        email_empleada_neutro = get_email_template_universal(
+                            tipo_email='falsa',
+                            nombre=empleado.nombre if empleado else 'Colaborador/a',
+                            serial=serial,
+                            empresa=caso.empresa.nombre if caso.empresa else 'N/A',
+                            tipo_incapacidad=caso.tipo.value if caso.tipo else 'General',
+                            telefono=caso.telefono_form,
+                            email=caso.email_form,
+                            link_drive=caso.drive_link
+                        )
                 
-                fechas_str_conf = f" ({caso.fecha_inicio.strftime('%d/%m/%Y')} al {caso.fecha_fin.strftime('%d/%m/%Y')})" if caso.fecha_inicio and caso.fecha_fin else ""
-                asunto_confirmacion = f"CC {caso.cedula} - {serial}{fechas_str_conf} - Confirmación - {empleado.nombre if empleado else 'Colaborador'} - {caso.empresa.nombre if caso.empresa else 'N/A'}"
-                send_html_email(
-                    caso.email_form,
-                    asunto_confirmacion,
-                    email_empleada_neutro,
-                    caso=caso  # ✅ CC empresa automático
-                )
-                print(f"📧 Correo neutro enviado al colaborador: {caso.email_form}")
-            except Exception as e:
-                print(f"⚠️ Error enviando CORREO 1 (neutro colaborador) enviar_validar: {e}")
+                        fechas_str_conf = f" ({caso.fecha_inicio.strftime('%d/%m/%Y')} al {caso.fecha_fin.strftime('%d/%m/%Y')})" if caso.fecha_inicio and caso.fecha_fin else ""
+                        asunto_confirmacion = f"CC {caso.cedula} - {serial}{fechas_str_conf} - Confirmación - {empleado.nombre if empleado else 'Colaborador'} - {caso.empresa.nombre if caso.empresa else 'N/A'}"
+                        send_html_email(
+                            caso.email_form,
+                            asunto_confirmacion,
+                            email_empleada_neutro,
+                            caso=caso  # ✅ CC empresa automático
+                        )
+                        print(f"📧 Correo neutro enviado al colaborador: {caso.email_form}")
+                    except Exception as e:
+                        print(f"⚠️ Error enviando CORREO 1 (neutro colaborador) enviar_validar: {e}")
             
-            # ── CORREO 2: Alerta al directorio + empresa para validar con EPS ──
-            try:
-                emails_validador = obtener_emails_presunto_fraude(caso.empresa.nombre if caso.empresa else 'Default', db=db)
+                    # ── CORREO 2: Alerta al directorio + empresa para validar con EPS ──
+                    try:
+                        emails_validador = obtener_emails_presunto_fraude(caso.empresa.nombre if caso.empresa else 'Default', db=db)
                 
-                # ✅ Agregar emails del directorio empresa como destinatarios DIRECTOS (TO)
-                # Antes solo iban como BCC y podían no llegar
-                if cc_empresa_validar:
-                    for _em in cc_empresa_validar.split(","):
-                        _em = _em.strip()
-                        if _em and "@" in _em and _em.lower() not in [e.lower() for e in emails_validador]:
-                            emails_validador.append(_em)
-                print(f"📧 Destinatarios finales enviar_validar: {emails_validador}")
+                        # ✅ Agregar emails del directorio empresa como destinatarios DIRECTOS (TO)
+                        # Antes solo iban como BCC y podían no llegar
+                        if cc_empresa_validar:
+                            for _em in cc_empresa_validar.split(","):
+                                _em = _em.strip()
+                                if _em and "@" in _em and _em.lower() not in [e.lower() for e in emails_validador]:
+                                    emails_validador.append(_em)
+                        print(f"📧 Destinatarios finales enviar_validar: {emails_validador}")
                 
-                email_validar = get_email_template_universal(
-                    tipo_email='enviar_validar',
-                    nombre=empleado.nombre if empleado else 'Colaborador/a',
-                    serial=serial,
-                    empresa=caso.empresa.nombre if caso.empresa else 'N/A',
-                    tipo_incapacidad=caso.tipo.value if caso.tipo else 'General',
-                    telefono=caso.telefono_form,
-                    email=caso.email_form,
-                    link_drive=caso.drive_link,
-                    checks_seleccionados=checks,
-                )
+                        email_validar = get_email_template_universal(
+                            tipo_email='enviar_validar',
+                            nombre=empleado.nombre if empleado else 'Colaborador/a',
+                            serial=serial,
+                            empresa=caso.empresa.nombre if caso.empresa else 'N/A',
+                            tipo_incapacidad=caso.tipo.value if caso.tipo else 'General',
+                            telefono=caso.telefono_form,
+                            email=caso.email_form,
+                            link_drive=caso.drive_link,
+                            checks_seleccionados=checks,
+                        )
                 
-                fechas_str = f" ({caso.fecha_inicio.strftime('%d/%m/%Y')} al {caso.fecha_fin.strftime('%d/%m/%Y')})" if caso.fecha_inicio and caso.fecha_fin else ""
-                asunto_validar = f"CC {caso.cedula} - {serial}{fechas_str} - Validar con EPS - {empleado.nombre if empleado else 'Colaborador'} - {caso.empresa.nombre if caso.empresa else 'N/A'}"
+                        fechas_str = f" ({caso.fecha_inicio.strftime('%d/%m/%Y')} al {caso.fecha_fin.strftime('%d/%m/%Y')})" if caso.fecha_inicio and caso.fecha_fin else ""
+                        asunto_validar = f"CC {caso.cedula} - {serial}{fechas_str} - Validar con EPS - {empleado.nombre if empleado else 'Colaborador'} - {caso.empresa.nombre if caso.empresa else 'N/A'}"
                 
-                # Preparar adjuntos en base64
-                import base64 as _b64_validar
-                adjuntos_b64_validar = []
-                for _path in adjuntos_paths:
-                    if os.path.exists(_path):
-                        try:
-                            with open(_path, 'rb') as _f:
-                                _content = _b64_validar.b64encode(_f.read()).decode('utf-8')
-                                adjuntos_b64_validar.append({
-                                    'filename': os.path.basename(_path),
-                                    'content': _content,
-                                    'mimetype': 'application/pdf'
-                                })
-                        except Exception as _e:
-                            print(f"⚠️ Error procesando adjunto validar {_path}: {_e}")
+                        # Preparar adjuntos en base64
+                        import base64 as _b64_validar
+                        adjuntos_b64_validar = []
+                        for _path in adjuntos_paths:
+                            if os.path.exists(_path):
+                                try:
+                                    with open(_path, 'rb') as _f:
+                                        _content = _b64_validar.b64encode(_f.read()).decode('utf-8')
+                                        adjuntos_b64_validar.append({
+                                            'filename': os.path.basename(_path),
+                                            'content': _content,
+                                            'mimetype': 'application/pdf'
+                                        })
+                                except Exception as _e:
+                                    print(f"⚠️ Error procesando adjunto validar {_path}: {_e}")
                 
-                for email_dest in emails_validador:
-                    # Evitar CC duplicado si este email ya es destinatario directo
-                    _cc_para_dest = cc_empresa_validar
-                    if _cc_para_dest:
-                        _cc_filtrado = [e.strip() for e in _cc_para_dest.split(",") if e.strip().lower() != email_dest.lower()]
-                        _cc_para_dest = ",".join(_cc_filtrado) if _cc_filtrado else None
+                        for email_dest in emails_validador:
+                            # Evitar CC duplicado si este email ya es destinatario directo
+                            _cc_para_dest = cc_empresa_validar
+                            if _cc_para_dest:
+                                _cc_filtrado = [e.strip() for e in _cc_para_dest.split(",") if e.strip().lower() != email_dest.lower()]
+                                _cc_para_dest = ",".join(_cc_filtrado) if _cc_filtrado else None
                     
-                    resultado = enviar_notificacion(
-                        tipo_notificacion='enviar_validar',
-                        email=email_dest,
-                        serial=serial,
-                        subject=asunto_validar,
-                        html_content=email_validar,
-                        cc_email=_cc_para_dest,
-                        correo_bd=None,
-                        whatsapp=None,
-                        whatsapp_message=None,
-                        adjuntos_base64=adjuntos_b64_validar,
-                        drive_link=caso.drive_link
-                    )
-                    print(f"🔍 Enviado a validar EPS: {email_dest} → resultado={resultado} (CC: {_cc_para_dest or 'N/A'})")
-            except Exception as e:
-                print(f"⚠️ Error enviando CORREO 2 (presunto fraude) enviar_validar: {e}")
-                import traceback
-                traceback.print_exc()
+                            resultado = enviar_notificacion(
+                                tipo_notificacion='enviar_validar',
+                                email=email_dest,
+                                serial=serial,
+                                subject=asunto_validar,
+                                html_content=email_validar,
+                                cc_email=_cc_para_dest,
+                                correo_bd=None,
+                                whatsapp=None,
+                                whatsapp_message=None,
+                                adjuntos_base64=adjuntos_b64_validar,
+                                drive_link=caso.drive_link
+                            )
+                            print(f"🔍 Enviado a validar EPS: {email_dest} → resultado={resultado} (CC: {_cc_para_dest or 'N/A'})")
+                    except Exception as e:
+                        print(f"⚠️ Error enviando CORREO 2 (presunto fraude) enviar_validar: {e}")
+                        import traceback
+                        traceback.print_exc()
         
-        elif accion == 'falsa_confirmada':
-            # ✅ FALSA CONFIRMADA: Marcar como incapacidad adulterada definitiva
-            print(f"🚫 Marcando como FALSA CONFIRMADA: {serial}")
+                elif accion == 'falsa_confirmada':
+                    # ✅ FALSA CONFIRMADA: Marcar como incapacidad adulterada definitiva
+                    print(f"🚫 Marcando como FALSA CONFIRMADA: {serial}")
             
-            # Guardar metadata de fraude confirmado
-            if not caso.metadata_form:
-                caso.metadata_form = {}
-            caso.metadata_form['fraude_confirmado'] = True
-            caso.metadata_form['fraude_resultado'] = 'adulterada'
-            caso.metadata_form['fecha_fraude_confirmado'] = datetime.now().isoformat()
-            flag_modified(caso, 'metadata_form')
-            
-            # Notificar al área encargada (directorio presunto fraude)
-            try:
-                emails_fraude = obtener_emails_presunto_fraude(caso.empresa.nombre if caso.empresa else 'Default', db=db)
+                    # Notificar al área encargada (directorio presunto fraude)
+                    try:
+                        emails_fraude = obtener_emails_presunto_fraude(caso.empresa.nombre if caso.empresa else 'Default', db=db)
                 
-                email_fraude_conf = get_email_template_universal(
-                    tipo_email='tthh',
-                    nombre='Encargado de Presunto Fraude',
-                    serial=serial,
-                    empresa=caso.empresa.nombre if caso.empresa else 'N/A',
-                    tipo_incapacidad=caso.tipo.value if caso.tipo else 'General',
-                    telefono=caso.telefono_form,
-                    email=caso.email_form,
-                    link_drive=caso.drive_link,
-                    contenido_ia=f"Se confirma que la incapacidad {serial} del colaborador/a {empleado.nombre if empleado else 'N/A'} ha sido verificada como **ADULTERADA/FALSA**. Se notifica al area encargada para los tramites correspondientes."
-                )
+                        email_fraude_conf = get_email_template_universal(
+                            tipo_email='tthh',
+                            nombre='Encargado de Presunto Fraude',
+                            serial=serial,
+                            empresa=caso.empresa.nombre if caso.empresa else 'N/A',
+                            tipo_incapacidad=caso.tipo.value if caso.tipo else 'General',
+                            telefono=caso.telefono_form,
+                            email=caso.email_form,
+                            link_drive=caso.drive_link,
+                            contenido_ia=f"Se confirma que la incapacidad {serial} del colaborador/a {empleado.nombre if empleado else 'N/A'} ha sido verificada como **ADULTERADA/FALSA**. Se notifica al area encargada para los tramites correspondientes."
+                        )
                 
-                fechas_str = f" ({caso.fecha_inicio.strftime('%d/%m/%Y')} al {caso.fecha_fin.strftime('%d/%m/%Y')})" if caso.fecha_inicio and caso.fecha_fin else ""
-                asunto_fraude = f"CC {caso.cedula} - {serial}{fechas_str} - INCAPACIDAD ADULTERADA CONFIRMADA - {empleado.nombre if empleado else 'Colaborador'} - {caso.empresa.nombre if caso.empresa else 'N/A'}"
+                        fechas_str = f" ({caso.fecha_inicio.strftime('%d/%m/%Y')} al {caso.fecha_fin.strftime('%d/%m/%Y')})" if caso.fecha_inicio and caso.fecha_fin else ""
+                        asunto_fraude = f"CC {caso.cedula} - {serial}{fechas_str} - INCAPACIDAD ADULTERADA CONFIRMADA - {empleado.nombre if empleado else 'Colaborador'} - {caso.empresa.nombre if caso.empresa else 'N/A'}"
                 
-                # CC empresa
-                cc_empresa_fraude = None
-                if caso.company_id:
-                    emails_dir_fraude = obtener_emails_empresa_directorio(caso.company_id, db=db)
-                    if emails_dir_fraude:
-                        cc_empresa_fraude = ",".join(emails_dir_fraude)
-                print(f"📧 CC empresa para falsa_confirmada: {cc_empresa_fraude or 'N/A'}")
+                        # CC empresa
+                        cc_empresa_fraude = None
+                        if caso.company_id:
+                            emails_dir_fraude = obtener_emails_empresa_directorio(caso.company_id, db=db)
+                            if emails_dir_fraude:
+                                cc_empresa_fraude = ",".join(emails_dir_fraude)
+                        print(f"📧 CC empresa para falsa_confirmada: {cc_empresa_fraude or 'N/A'}")
                 
-                for email_dest in emails_fraude:
-                    enviar_notificacion(
-                        tipo_notificacion='tthh',
-                        email=email_dest,
-                        serial=serial,
-                        subject=asunto_fraude,
-                        html_content=email_fraude_conf,
-                        cc_email=cc_empresa_fraude,  # ✅ CC empresa
-                        correo_bd=None,
-                        whatsapp=None,
-                        whatsapp_message=None,
-                        adjuntos_base64=[],
-                        drive_link=caso.drive_link
+                        for email_dest in emails_fraude:
+                            enviar_notificacion(
+                                tipo_notificacion='tthh',
+                                email=email_dest,
+                                serial=serial,
+                                subject=asunto_fraude,
+                                html_content=email_fraude_conf,
+                                cc_email=cc_empresa_fraude,  # ✅ CC empresa
+                                correo_bd=None,
+                                whatsapp=None,
+                                whatsapp_message=None,
+                                adjuntos_base64=[],
+                                drive_link=caso.drive_link
+                            )
+                            print(f"🚫 Fraude confirmado notificado a: {email_dest} (CC empresa: {cc_empresa_fraude or 'N/A'})")
+                    except Exception as e:
+                        print(f"⚠️ Error enviando email falsa_confirmada: {e}")
+                        import traceback
+                        traceback.print_exc()
+        
+                # Registrar evento (aquí ya se sabe si la IA redactó el correo)
+                registrar_evento(
+                    db, caso.id, 
+                    "validacion_con_ia" if contenido_ia else "validacion_estatica",
+                    actor="Validador",
+                    estado_anterior=caso.estado.value,
+                    estado_nuevo=nuevo_estado.value,
+                    motivo=observaciones,
+                    metadata={"checks": checks, "usa_ia": bool(contenido_ia)}
+                )
+        
+                # ✅ SINCRONIZAR CON GOOGLE SHEETS
+                try:
+                    from app.google_sheets_tracker import actualizar_caso_en_sheet, registrar_cambio_estado_sheet
+                    actualizar_caso_en_sheet(caso, accion="actualizar")
+                    registrar_cambio_estado_sheet(
+                        caso, 
+                        estado_anterior=caso.estado.value,
+                        estado_nuevo=nuevo_estado.value,
+                        validador="Sistema",
+                        observaciones=observaciones
                     )
-                    print(f"🚫 Fraude confirmado notificado a: {email_dest} (CC empresa: {cc_empresa_fraude or 'N/A'})")
+                    print(f"✅ Caso {serial} sincronizado con Google Sheets")
+                except Exception as e:
+                    print(f"⚠️ Error sincronizando con Sheets: {e}")
+                _marcar_efectos_validacion(
+                    caso, pendiente=False, nuevo_link=caso.drive_link, usa_ia=bool(contenido_ia),
+                    completado=datetime.now().isoformat(),
+                )
+                db.commit()
             except Exception as e:
-                print(f"⚠️ Error enviando email falsa_confirmada: {e}")
-                import traceback
-                traceback.print_exc()
-        
-        # Limpiar adjuntos temporales
-        for temp_file in adjuntos_paths:
-            try:
-                os.remove(temp_file)
-            except:
-                pass
-        
-        # Registrar evento
-        registrar_evento(
-            db, caso.id, 
-            "validacion_con_ia" if contenido_ia else "validacion_estatica",
-            actor="Validador",
-            estado_anterior=caso.estado.value,
-            estado_nuevo=nuevo_estado.value,
-            motivo=observaciones,
-            metadata={"checks": checks, "usa_ia": bool(contenido_ia)}
-        )
+                _marcar_efectos_fallidos(db, caso_id, serial, e)
+            finally:
+                db.close()
+                # Limpiar adjuntos temporales (también si la tarea falla o el caso ya no existe)
+                for temp_file in adjuntos_paths:
+                    try:
+                        os.remove(temp_file)
+                    except:
+                        pass
         
-        # ✅ SINCRONIZAR CON GOOGLE SHEETS
-        try:
-            from app.google_sheets_tracker import actualizar_caso_en_sheet, registrar_cambio_estado_sheet
-            actualizar_caso_en_sheet(caso, accion="actualizar")
-            registrar_cambio_estado_sheet(
-                caso, 
-                estado_anterior=caso.estado.value,
-                estado_nuevo=nuevo_estado.value,
-                validador="Sistema",
-                observaciones=observaciones
-            )
-            print(f"✅ Caso {serial} sincronizado con Google Sheets")
-        except Exception as e:
-            print(f"⚠️ Error sincronizando con Sheets: {e}")
-    
-    # ✅ GUARDAR TODOS LOS CAMBIOS EN BD
+        background_tasks.add_task(_efectos_validacion)
+
+    # ✅ GUARDAR TODOS LOS CAMBIOS EN BD (efectos pendientes hasta que termine la tarea de fondo)
+    _marcar_efectos_validacion(caso, pendiente=True)
     db.commit()
     
     return {
         "status": "ok",
+        "version_respuesta": 2,
         "serial": serial,
         "accion": accion,
         "checks": checks,
-        "nuevo_link": caso.drive_link,
-        "usa_ia": bool(contenido_ia),
         "es_reenvio": es_reenvio if nuevo_estado == EstadoCaso.COMPLETA else False,
         "casos_borrados": len(casos_borrados) if nuevo_estado == EstadoCaso.COMPLETA and es_reenvio else 0,
+        # Drive/correos/Sheets siguen en segundo plano: "nuevo_link" y "usa_ia" finales en efectos_url
+        "pending_side_effects": True,
+        "efectos_url": f"{router.prefix}/casos/{serial}/validar/efectos",
+        "link_previo": caso.drive_link,  # link ANTES de mover el archivo en Drive
+        "redaccion_ia_prevista": accion in ('incompleta', 'ilegible'),  # no confirma que la IA respondió
         "mensaje": f"Caso {accion} correctamente"
     }
 
 
+@router.get("/casos/{serial}/validar/efectos")
+def obtener_efectos_validacion(
+    serial: str,
+    db: Session = Depends(get_db),
+    _: bool = Depends(verificar_token_admin)
+):
+    """
+    Resultado de los efectos en segundo plano del último /validar del caso.
+    "nuevo_link" y "usa_ia" conservan el significado de la respuesta v1 de /validar.
+    """
+    caso = db.query(Case).filter(Case.serial == serial).first()
+    if not caso:
+        raise HTTPException(status_code=404, detail="Caso no encontrado")
+    efectos = (caso.metadata_form or {}).get('efectos_validacion')
+    if not efectos:
+        raise HTTPException(status_code=404, detail="El caso no tiene validaciones registradas")
+    return {
+        "serial": serial,
+        "pendiente": efectos.get("pendiente", False),
+        "nuevo_link": efectos.get("nuevo_link"),
+        "usa_ia": efectos.get("usa_ia"),
+        "error": efectos.get("error"),
+        "completado": efectos.get("completado"),
+    }
+
+
 # ✅ NUEVO: Endpoint para notificación libre con IA
 @router.post("/casos/{serial}/notificar-libre")
 async def notificar_libre_con_ia(
@@ -3662,14 +4062,7 @@ async def notificar_libre_con_ia(
     )
     
     # Procesar adjuntos
-    adjuntos_paths = []
-    if adjuntos:
-        for i, adjunto in enumerate(adjuntos):
-            temp_path = os.path.join(tempfile.gettempdir(), f"{serial}_extra_{i}_{adjunto.filename}")
-            with open(temp_path, "wb") as f:
-                contenido = await adjunto.read()
-                f.write(contenido)
-            adjuntos_paths.append(temp_path)
+    adjuntos_paths = await _guardar_adjuntos_temp(adjuntos, f"{serial}_extra") if adjuntos else []
     
     # Insertar en plantilla
     email_personalizado = get_email_template_universal(
@@ -3687,7 +4080,7 @@ async def notificar_libre_con_ia(
     # Enviar con formato de asunto actualizado
     fechas_str = f" ({caso.fecha_inicio.strftime('%d/%m/%Y')} al {caso.fecha_fin.strftime('%d/%m/%Y')})" if caso.fecha_inicio and caso.fecha_fin else ""
     asunto = f"CC {caso.cedula} - {serial}{fechas_str} - Extra - {empleado.nombre if empleado else 'Colaborador'} - {caso.empresa.nombre if caso.empresa else 'N/A'}"
-    enviar_email_con_adjuntos(
+    await enviar_email_con_adjuntos_async(
         caso.email_form,
         asunto,
         email_personalizado,
@@ -3732,6 +4125,87 @@ async def obtener_checks_disponibles_endpoint(
     }
 # ==================== AGREGAR AL FINAL DE app/validador.py ====================
 
+def _aplicar_operaciones_pdf(pdf_bytes: bytes, temp_output: str, operaciones: dict) -> List[str]:
+    """
+    Aplica las operaciones de edición sobre el PDF (en memoria) y guarda en temp_output.
+    Trabajo de CPU (PyMuPDF / PDFEditor): se ejecuta en un hilo, fuera del event loop.
+    """
+    # Usar PyMuPDF directo para operaciones simples (RÁPIDO)
+    import fitz
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    modificaciones = []
+    
+    # PROCESAR OPERACIONES
+    for op_type, op_data in operaciones.items():
+        
+        if op_type == 'rotate':
+            # Rotación simple (INSTANTÁNEA con PyMuPDF)
+            for item in op_data:
+                page_num = item['page_num']
+                angle = item['angle']
+                page = doc[page_num]
+                current = page.rotation
+                page.set_rotation((current + angle) % 360)
+                modificaciones.append(f"Rotated page {page_num} by {angle}°")
+        
+        elif op_type == 'delete_pages':
+            # Eliminar páginas (RÁPIDO)
+            for page_num in sorted(op_data, reverse=True):
+                doc.delete_page(page_num)
+                modificaciones.append(f"Deleted page {page_num}")
+        
+        elif op_type == 'enhance_quality' or op_type == 'aplicar_filtro' or op_type == 'crop_auto' or op_type == 'deskew':
+            # Operaciones PESADAS - usar PDFEditor completo
+            doc.close()
+            from app.pdf_editor import PDFEditor
+            editor = PDFEditor(pdf_bytes)
+            
+            if op_type == 'enhance_quality':
+                pages = op_data.get('pages', [])
+                scale = op_data.get('scale', 2.5)
+                if len(pages) > 1 and len(set(pages)) == len(pages):
+                    # Varias páginas: render + mejora en paralelo (pool de procesos), luego
+                    # se insertan en orden; el editor parte del mismo PDF original.
+                    # Con páginas repetidas se usa el camino secuencial: ahí la 2ª pasada
+                    # mejora la página ya mejorada, y el pool partiría dos veces del original
+                    from app.pdf_editor import mejorar_paginas_en_paralelo
+                    for page_num in pages:
+                        if page_num < 0 or page_num >= len(editor.doc):
+                            raise ValueError(f"Número de página inválido: {page_num}")
+                    pngs = mejorar_paginas_en_paralelo(pdf_bytes, pages, scale)
+                    for page_num, png in zip(pages, pngs):
+                        editor.aplicar_pagina_mejorada(page_num, png, scale)
+                else:
+                    for page_num in pages:
+                        editor.enhance_page_quality(page_num, scale)
+            
+            elif op_type == 'aplicar_filtro':
+                page_num = op_data.get('page_num', 0)
+                filtro = op_data.get('filtro', 'grayscale')
+                editor.aplicar_filtro_imagen(page_num, filtro)
+            
+            elif op_type == 'crop_auto':
+                for item in op_data:
+                    page_num = item['page_num']
+                    margin = item.get('margin', 10)
+                    editor.auto_crop_page(page_num, margin)
+            
+            elif op_type == 'deskew':
+                page_num = op_data.get('page_num', 0)
+                editor.enhance_page_quality(page_num, scale=2.0)
+            
+            editor.save_changes(temp_output)
+            modificaciones = editor.get_modifications_log()
+            break  # Salir del loop si usamos PDFEditor
+    
+    # Si usamos PyMuPDF directo, guardar
+    if doc.is_closed == False:
+        doc.save(temp_output, garbage=4, deflate=True)
+        doc.close()
+    
+    return modificaciones
+
+
 @router.post("/casos/{serial}/editar-pdf")
 async def editar_pdf_caso(
     serial: str,
@@ -3757,94 +4231,25 @@ async def editar_pdf_caso(
         raise HTTPException(status_code=404, detail="Caso o PDF no encontrado")
     
     # Extraer file_id de Drive
-    if '/file/d/' in caso.drive_link:
-        file_id = caso.drive_link.split('/file/d/')[1].split('/')[0]
-    elif 'id=' in caso.drive_link:
-        file_id = caso.drive_link.split('id=')[1].split('&')[0]
-    else:
+    file_id = _extraer_drive_id(caso.drive_link)
+    if not file_id:
         raise HTTPException(status_code=400, detail="Link de Drive inválido")
     
     download_url = f"https://drive.google.com/uc?export=download&id={file_id}"
     
-    import time
     start_time = time.time()
     
-    # Descargar PDF
-    response = requests.get(download_url, timeout=15)
-    if response.status_code != 200:
-        raise HTTPException(status_code=500, detail="Error descargando PDF")
-    
-    temp_input = os.path.join(tempfile.gettempdir(), f"{serial}_original.pdf")
+    # Descargar PDF a memoria: se abre con fitz.open(stream=...), sin archivo de entrada
+    pdf_bytes = await _descargar_drive_bytes(download_url, timeout=15)
+    # Solo la salida va a disco (la subida a Drive recibe una ruta)
     temp_output = os.path.join(tempfile.gettempdir(), f"{serial}_edited.pdf")
     
-    with open(temp_input, 'wb') as f:
-        f.write(response.content)
-    
     download_time = time.time() - start_time
     print(f"⬇️ Descarga: {download_time:.2f}s")
     
     try:
-        # Usar PyMuPDF directo para operaciones simples (RÁPIDO)
-        import fitz
-        doc = fitz.open(temp_input)
-        modificaciones = []
-        
         process_start = time.time()
-        
-        # PROCESAR OPERACIONES
-        for op_type, op_data in operaciones.items():
-            
-            if op_type == 'rotate':
-                # Rotación simple (INSTANTÁNEA con PyMuPDF)
-                for item in op_data:
-                    page_num = item['page_num']
-                    angle = item['angle']
-                    page = doc[page_num]
-                    current = page.rotation
-                    page.set_rotation((current + angle) % 360)
-                    modificaciones.append(f"Rotated page {page_num} by {angle}°")
-            
-            elif op_type == 'delete_pages':
-                # Eliminar páginas (RÁPIDO)
-                for page_num in sorted(op_data, reverse=True):
-                    doc.delete_page(page_num)
-                    modificaciones.append(f"Deleted page {page_num}")
-            
-            elif op_type == 'enhance_quality' or op_type == 'aplicar_filtro' or op_type == 'crop_auto' or op_type == 'deskew':
-                # Operaciones PESADAS - usar PDFEditor completo
-                doc.close()
-                from app.pdf_editor import PDFEditor
-                editor = PDFEditor(temp_input)
-                
-                if op_type == 'enhance_quality':
-                    pages = op_data.get('pages', [])
-                    scale = op_data.get('scale', 2.5)
-                    for page_num in pages:
-                        editor.enhance_page_quality(page_num, scale)
-                
-                elif op_type == 'aplicar_filtro':
-                    page_num = op_data.get('page_num', 0)
-                    filtro = op_data.get('filtro', 'grayscale')
-                    editor.aplicar_filtro_imagen(page_num, filtro)
-                
-                elif op_type == 'crop_auto':
-                    for item in op_data:
-                        page_num = item['page_num']
-                        margin = item.get('margin', 10)
-                        editor.auto_crop_page(page_num, margin)
-                
-                elif op_type == 'deskew':
-                    page_num = op_data.get('page_num', 0)
-                    editor.enhance_page_quality(page_num, scale=2.0)
-                
-                editor.save_changes(temp_output)
-                modificaciones = editor.get_modifications_log()
-                break  # Salir del loop si usamos PDFEditor
-        
-        # Si usamos PyMuPDF directo, guardar
-        if doc.is_closed == False:
-            doc.save(temp_output, garbage=4, deflate=True)
-            doc.close()
+        modificaciones = await asyncio.to_thread(_aplicar_operaciones_pdf, pdf_bytes, temp_output, operaciones)
         
         process_time = time.time() - process_start
         print(f"⚙️ Procesamiento: {process_time:.2f}s")
@@ -3853,18 +4258,18 @@ async def editar_pdf_caso(
         upload_start = time.time()
         from app.drive_manager import CaseFileOrganizer
         organizer = CaseFileOrganizer()
-        nuevo_link = organizer.actualizar_pdf_editado(caso, temp_output)
+        nuevo_link = await asyncio.to_thread(organizer.actualizar_pdf_editado, caso, temp_output)
         
         upload_time = time.time() - upload_start
         print(f"⬆️ Subida: {upload_time:.2f}s")
         
         if nuevo_link:
             caso.drive_link = nuevo_link
+            # Drive conserva el file_id: updated_at es lo que cambia el ETag de /pdf/stream y /pdf/fast
+            caso.updated_at = get_utc_now()
             db.commit()
         
         # Limpiar
-        if os.path.exists(temp_input):
-            os.remove(temp_input)
         if os.path.exists(temp_output):
             os.remove(temp_output)
         
@@ -3891,201 +4296,10 @@ async def editar_pdf_caso(
         traceback.print_exc()
         
         # Limpiar
-        if os.path.exists(temp_input):
-            os.remove(temp_input)
         if os.path.exists(temp_output):
             os.remove(temp_output)
         
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
-    else:
-        raise HTTPException(status_code=400, detail="Link de Drive inválido")
-    
-    download_url = f"https://drive.google.com/uc?export=download&id={file_id}"
-    response = requests.get(download_url)
-    
-    if response.status_code != 200:
-        raise HTTPException(status_code=500, detail="Error descargando PDF")
-    
-    temp_input = os.path.join(tempfile.gettempdir(), f"{serial}_original.pdf")
-    temp_output = os.path.join(tempfile.gettempdir(), f"{serial}_edited.pdf")
-    
-    with open(temp_input, 'wb') as f:
-        f.write(response.content)
-    
-    try:
-        editor = PDFEditor(temp_input)
-        
-        # ✅ PROCESAR OPERACIONES
-        for op_type, op_data in operaciones.items():
-            if op_type == 'enhance_quality':
-                for page_num in op_data.get('pages', []):
-                    editor.enhance_page_quality(page_num)
-            
-            elif op_type == 'rotate':
-                for item in op_data:
-                    editor.rotate_page(item['page_num'], item['angle'])
-            
-            elif op_type == 'aplicar_filtro':
-                editor.aplicar_filtro_imagen(op_data['page_num'], op_data['filtro'])
-            
-            elif op_type == 'crop_auto':
-                for item in op_data:
-                    editor.auto_crop_page(item['page_num'], item.get('margin', 10))
-            
-            elif op_type == 'deskew':
-                page_num = op_data.get('page_num', 0)
-                page = editor.doc[page_num]
-                mat = fitz.Matrix(2.0, 2.0)
-                pix = page.get_pixmap(matrix=mat)
-                img_array = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
-                
-                deskewed = editor.auto_deskew(img_array)
-                
-                from PIL import Image
-                img_pil = Image.fromarray(deskewed)
-                img_bytes = io.BytesIO()
-                img_pil.save(img_bytes, format='PNG')
-                img_bytes.seek(0)
-                
-                rect = page.rect
-                page.clean_contents()
-                page.insert_image(rect, stream=img_bytes.getvalue())
-        
-        editor.save_changes(temp_output)
-        
-        # Subir a Drive
-        from app.drive_manager import CaseFileOrganizer
-        organizer = CaseFileOrganizer()
-        nuevo_link = organizer.actualizar_pdf_editado(caso, temp_output)
-        
-        if nuevo_link:
-            caso.drive_link = nuevo_link
-            db.commit()
-        
-        os.remove(temp_input)
-        os.remove(temp_output)
-        
-        return {
-            "status": "ok",
-            "serial": serial,
-            "nuevo_link": nuevo_link,
-            "modificaciones": editor.get_modifications_log(),
-            "mensaje": "PDF editado y actualizado en Drive"
-        }
-    
-    except Exception as e:
-        if os.path.exists(temp_input):
-            os.remove(temp_input)
-        if os.path.exists(temp_output):
-            os.remove(temp_output)
-        raise HTTPException(status_code=500, detail=f"Error editando PDF: {str(e)}")
-    """
-    Edita el PDF de un caso con múltiples operaciones
-    
-    Operaciones soportadas:
-    - enhance_quality: {page_num: int}
-    - rotate: {page_num: int, angle: int}
-    - crop_auto: {page_num: int, margin: int}
-    - crop_custom: {page_num: int, x: int, y: int, width: int, height: int}
-    - reorder: {new_order: [1, 0, 2, ...]}
-    - annotate: {page_num: int, type: str, coords: [x1,y1,x2,y2], text: str, color: [r,g,b]}
-    - delete_page: {pages: [0, 2, 5]}
-    """
-    from app.pdf_editor import PDFEditor
-    
-    caso = db.query(Case).filter(Case.serial == serial).first()
-    if not caso or not caso.drive_link:
-        raise HTTPException(status_code=404, detail="Caso o PDF no encontrado")
-    
-    # Extraer file_id y descargar PDF
-    if '/file/d/' in caso.drive_link:
-        file_id = caso.drive_link.split('/file/d/')[1].split('/')[0]
-    elif 'id=' in caso.drive_link:
-        file_id = caso.drive_link.split('id=')[1].split('&')[0]
-    else:
-        raise HTTPException(status_code=400, detail="Link de Drive inválido")
-    
-    download_url = f"https://drive.google.com/uc?export=download&id={file_id}"
-    response = requests.get(download_url)
-    
-    if response.status_code != 200:
-        raise HTTPException(status_code=500, detail="Error descargando PDF")
-    
-    temp_input = os.path.join(tempfile.gettempdir(), f"{serial}_original.pdf")
-    temp_output = os.path.join(tempfile.gettempdir(), f"{serial}_edited.pdf")
-    
-    with open(temp_input, 'wb') as f:
-        f.write(response.content)
-    
-    try:
-        editor = PDFEditor(temp_input)
-        
-        for op_type, op_data in operaciones.items():
-            if op_type == 'enhance_quality':
-                for page_num in op_data.get('pages', []):
-                    editor.enhance_page_quality(page_num)
-            
-            elif op_type == 'rotate':
-                for item in op_data:
-                    editor.rotate_page(item['page_num'], item['angle'])
-            
-            elif op_type == 'crop_auto':
-                for item in op_data:
-                    editor.auto_crop_page(item['page_num'], item.get('margin', 10))
-            
-            elif op_type == 'crop_custom':
-                for item in op_data:
-                    editor.crop_page_custom(
-                        item['page_num'],
-                        item['x'], item['y'],
-                        item['width'], item['height']
-                    )
-            
-            elif op_type == 'reorder':
-                editor.reorder_pages(op_data['new_order'])
-            
-            elif op_type == 'annotate':
-                for item in op_data:
-                    color_tuple = tuple(item.get('color', [1, 0, 0]))
-                    editor.add_annotation(
-                        item['page_num'],
-                        item['type'],
-                        tuple(item['coords']),
-                        item.get('text', ''),
-                        color_tuple
-                    )
-            
-            elif op_type == 'delete_page':
-                for page_num in sorted(op_data['pages'], reverse=True):
-                    editor.delete_page(page_num)
-        
-        editor.save_changes(temp_output)
-        
-        # Subir a Drive
-        organizer = CaseFileOrganizer()
-        nuevo_link = organizer.actualizar_pdf_editado(caso, temp_output)
-        
-        if nuevo_link:
-            caso.drive_link = nuevo_link
-            db.commit()
-        
-        os.remove(temp_input)
-        os.remove(temp_output)
-        
-        return {
-            "status": "ok",
-            "serial": serial,
-            "nuevo_link": nuevo_link,
-            "modificaciones": editor.get_modifications_log(),
-            "mensaje": "PDF editado y actualizado en Drive"
-        }
-    
-    except Exception as e:
-        if os.path.exists(temp_input):
-            os.remove(temp_input)
-        if os.path.exists(temp_output):
-            os.remove(temp_output)
-        raise HTTPException(status_code=500, detail=f"Error editando PDF: {str(e)}")
 
 @router.post("/casos/{serial}/crear-adjunto")
 async def crear_adjunto_desde_pdf(
@@ -4106,32 +4320,28 @@ async def crear_adjunto_desde_pdf(
     if not caso or not caso.drive_link:
         raise HTTPException(status_code=404, detail="Caso no encontrado")
     
-    if '/file/d/' in caso.drive_link:
-        file_id = caso.drive_link.split('/file/d/')[1].split('/')[0]
-    else:
+    file_id = _extraer_drive_id(caso.drive_link)
+    if not file_id:
         raise HTTPException(status_code=400, detail="Link inválido")
     
     download_url = f"https://drive.google.com/uc?export=download&id={file_id}"
-    response = requests.get(download_url)
     
-    temp_pdf = os.path.join(tempfile.gettempdir(), f"{serial}_temp.pdf")
     temp_img = os.path.join(tempfile.gettempdir(), f"{serial}_adjunto_{page_num}.png")
     
-    with open(temp_pdf, 'wb') as f:
-        f.write(response.content)
+    # El PDF se abre desde memoria (fitz stream), sin archivo temporal de entrada
+    pdf_bytes = await _descargar_drive_bytes(download_url)
     
     try:
         manager = PDFAttachmentManager()
         
         if tipo == "highlight":
-            manager.create_highlight_image(temp_pdf, page_num, coords, temp_img)
+            manager.create_highlight_image(pdf_bytes, page_num, coords, temp_img)
         else:
-            manager.create_page_preview(temp_pdf, page_num, temp_img, [coords])
+            manager.create_page_preview(pdf_bytes, page_num, temp_img, [coords])
         
         with open(temp_img, 'rb') as f:
             img_data = f.read()
         
-        os.remove(temp_pdf)
         os.remove(temp_img)
         
         return StreamingResponse(
@@ -4141,8 +4351,6 @@ async def crear_adjunto_desde_pdf(
         )
     
     except Exception as e:
-        if os.path.exists(temp_pdf):
-            os.remove(temp_pdf)
         if os.path.exists(temp_img):
             os.remove(temp_img)
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
@@ -4678,6 +4886,8 @@ async def guardar_pdf_editado(
         
         if nuevo_link:
             caso.drive_link = nuevo_link
+            # Drive conserva el file_id: updated_at es lo que cambia el ETag de /pdf/stream y /pdf/fast
+            caso.updated_at = get_utc_now()
             db.commit()
             
             registrar_evento(
@@ -4710,7 +4920,6 @@ async def guardar_pdf_editado(
 # Este endpoint solo mejora y devuelve el PDF nítido (NO lo guarda).
 # El guardado final lo hace el frontend con /guardar-pdf-editado.
 # ════════════════════════════════════════════════════════════════════
-from fastapi.responses import Response
 
 @router.post("/casos/{serial}/mejorar-hd")
 async def mejorar_calidad_hd(